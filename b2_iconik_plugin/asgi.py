@@ -0,0 +1,347 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+An ASGI app for the plugin, as an alternative to the Flask app in plugin.py.
+
+Each server process runs a single asyncio event loop. The loop accepts
+requests, and validates each custom action in the loop's default thread pool,
+since the iconik client makes blocking calls. Accepted actions are queued and
+scheduled exactly as in the Flask app (see scheduler.py), but each runs as an
+asyncio task wrapping a thread from a pool of MAX_CONCURRENT_ACTIONS threads,
+or AUTOSCALE_MAX_ACTIONS with autoscaling, rather than in a subprocess of its
+own. Actions share the process's memory and iconik connection pools, and
+start without the cost of a new interpreter.
+
+Run one process per core, for example:
+
+    uvicorn --factory b2_iconik_plugin.asgi:create_app --host 0.0.0.0 --port 8000 --workers $(nproc)
+"""
+
+import asyncio
+import copy
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.wrappers import Request, Response
+
+from b2_iconik_plugin import autoscaler, common, metrics, prefetch, scheduler, sync, tracing, workqueue
+from b2_iconik_plugin.common import IconikHandler, DEFAULT_FORMAT_NAMES, check_environment_variables
+from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.scheduler import (DISPATCH_INTERVAL, DRAIN_TIMEOUT, EXECUTE_ACTIONS, MAX_CONCURRENT_ACTIONS, Job,
+                                        Scheduler)
+from b2_iconik_plugin.tenants import TenantResolver
+
+
+def run_job(handler, job):
+    iconik, b2_storage, ll_storage, format_names = job.args
+    if job.rate_limiter:
+        iconik.rate_limiter = job.rate_limiter
+    return handler.do_process(job.request, iconik, b2_storage, ll_storage, format_names)
+
+
+class TaskHandle:
+    """
+    A scheduled action running as an asyncio task
+    """
+    def __init__(self, future, yield_event, logger=None):
+        self._future = future
+        self._yield_event = yield_event
+        self._logger = logger
+
+    def done(self):
+        return self._future.done()
+
+    def preempt(self):
+        self._yield_event.set()
+
+    def continuation(self):
+        if self._future.cancelled():
+            return None
+        ex = self._future.exception()
+        if ex:
+            if self._logger:
+                self._logger.log("ERROR", f"Action failed: {ex!r}")
+            return None
+        return self._future.result()
+
+    def terminate(self):
+        # A thread can't be stopped from outside, so just ask it to yield as soon as it can. The action stays done()
+        # False until it has, so the scheduler doesn't hand it off while it is still running.
+        self._yield_event.set()
+
+
+def task_runner(handler, loop, executor, on_done=None):
+    """
+    Args:
+        handler (IconikHandler): Processes the jobs
+        loop: The event loop that runs the tasks
+        executor: The thread pool that runs the tasks' blocking work
+        on_done: Optional function called on the loop when a job finishes
+    Returns:
+        A scheduler runner that processes each job in an asyncio task
+    """
+    def run(job):
+        # Each job needs its own yield event, so give it its own copy of the handler
+        job_handler = copy.copy(handler)
+        yield_event = threading.Event()
+        job_handler.set_yield_event(yield_event)
+        future = loop.run_in_executor(executor, tracing.propagated(run_job), job_handler, job)
+        if on_done:
+            future.add_done_callback(lambda _future: on_done())
+        return TaskHandle(future, yield_event, handler._logger)  # noqa
+    return run
+
+
+class AsyncIconikHandler(IconikHandler):
+    """
+    Process the request in an asyncio task, in priority order
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = None
+        self.tenants = TenantResolver()
+        self._loop = None
+        self._executor = None
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def startup(self):
+        if self.is_testing():
+            return
+        self._loop = asyncio.get_running_loop()
+        scaler = autoscaler.from_environment()
+        threads = max(MAX_CONCURRENT_ACTIONS, scaler.max_slots if scaler else 0)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="action")
+        self._wakeup = asyncio.Event()
+        # Finished jobs wake the dispatcher, so the next job starts straight away
+        runner = task_runner(self, self._loop, self._executor, on_done=self._wakeup.set)
+        self.scheduler = Scheduler(runner, max_concurrent=MAX_CONCURRENT_ACTIONS, logger=self._logger,
+                                   queue=workqueue.open_work_queue(), autoscaler=scaler)
+        scheduler.schedulers.append(self.scheduler)
+        if EXECUTE_ACTIONS:
+            handoff = workqueue.open_handoff_queue()
+            if handoff and not self.scheduler.queue.shared:
+                self.scheduler.adopt(handoff)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        elif not self.scheduler.queue.shared:
+            self._logger.log("WARNING", "EXECUTE_ACTIONS is false, but WORK_QUEUE is not set; actions will not be run")
+
+    async def _dispatch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), DISPATCH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                self.scheduler.dispatch()
+            except Exception as ex:  # noqa
+                self._logger.log("ERROR", f"Scheduler error: {ex!r}")
+
+    async def shutdown(self, timeout=None):
+        """
+        Ask running actions to yield, and hand the remaining work on, as when
+        a gunicorn worker shuts down
+        """
+        if not self.scheduler:
+            return
+        if self._dispatcher:
+            self._dispatcher.cancel()
+        if self.scheduler in scheduler.schedulers:
+            scheduler.schedulers.remove(self.scheduler)
+        # Draining waits for tasks that complete on this loop, so it runs in another thread
+        await self._loop.run_in_executor(None, self.scheduler.drain, DRAIN_TIMEOUT if timeout is None else timeout,
+                                         workqueue.open_handoff_queue())
+        self._executor.shutdown(wait=False)
+
+    def __getstate__(self):
+        # Only the handler's configuration is needed elsewhere
+        state = self.__dict__.copy()
+        for name in ["scheduler", "tenants", "_loop", "_executor", "_wakeup", "_dispatcher"]:
+            state[name] = None
+        return state
+
+    def start_process(self, request, iconik, b2_storage, ll_storage, format_names):
+        if self.is_testing():
+            # Process request synchronously so we can check results
+            self.do_process(request, iconik, b2_storage, ll_storage, format_names)
+        else:
+            self.scheduler.submit(Job(request, (iconik, b2_storage, ll_storage, format_names),
+                                      tenant=self.tenants.resolve(iconik, request)))
+            # Requests are validated in the thread pool, so wake the dispatcher via the loop
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+
+def wsgi_environ(scope, body):
+    """
+    Returns:
+        A WSGI environment for an ASGI HTTP request, so that the request can
+        be handled as a werkzeug Request, as in the Flask app
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.version": (1, 0),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(scope, receive, max_bytes):
+    """
+    Returns:
+        The request body, or None if it is larger than max_bytes, in which
+        case no more of it is read
+    """
+    for name, value in scope.get("headers", []):
+        if name == b"content-length" and int(value) > max_bytes:
+            return None
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > max_bytes:
+            return None
+        if not message.get("more_body"):
+            return bytes(body)
+
+
+async def send_response(send, response):
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in response.headers.items()],
+    })
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+def create_app(test_config=None):
+    """
+    Returns:
+        The plugin as an ASGI application
+    """
+    load_dotenv()
+
+    check_environment_variables(['BZ_SHARED_SECRET', 'ICONIK_ID'])
+
+    logging.basicConfig(format='%(asctime)s.%(msecs)03d, %(levelname)s, %(message)s', datefmt='%Y-%m-%dT%H:%M:%S',
+                        level=os.getenv('APP_LOG_LEVEL', 'INFO'), stream=sys.stdout)
+
+    tracing.configure()
+
+    metrics.WORKERS.set(1)
+
+    logger = Logger()
+    format_names = os.environ.get("FORMAT_NAMES", DEFAULT_FORMAT_NAMES).split(',')
+    handler = AsyncIconikHandler(logger, os.environ['BZ_SHARED_SECRET'], os.environ['ICONIK_ID'], format_names,
+                                 bool((test_config or {}).get('TESTING')))
+
+    # iconik webhooks for collection changes, if sync is configured. See sync.py
+    sync_state = sync.open_sync_state()
+
+    # Prefetch requests, if prefetching is configured. See prefetch.py
+    prefetch_store = prefetch.open_prefetch_store()
+
+    async def respond(req):
+        # Helpful message at root
+        if req.path == "/":
+            return Response("<p>The b2-iconik-plugin is ready for requests</p>", mimetype="text/html")
+        # Prometheus metrics
+        if req.path == "/metrics":
+            body, content_type = metrics.generate()
+            return Response(body, content_type=content_type)
+        try:
+            if req.path == "/sync/events":
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, sync.handle_event, req, sync_state, os.environ['BZ_SHARED_SECRET'])
+            elif req.path == "/prefetch":
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, prefetch.handle_request, req, prefetch_store, os.environ['BZ_SHARED_SECRET'])
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(None, handler.post, req)
+        except HTTPException as ex:
+            return ex.get_response()
+        except Exception as ex:  # noqa
+            logger.log("ERROR", f"Error handling request: {ex!r}")
+            return Response("Internal Server Error", status=500)
+        return Response(json.dumps(result) + "\n", mimetype="application/json")
+
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await handler.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await handler.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        body = await read_body(scope, receive, common.MAX_REQUEST_BYTES)
+        if body is None:
+            await send_response(send, RequestEntityTooLarge().get_response())
+            return
+        metrics.REQUESTS_IN_PROGRESS.inc()
+        try:
+            response = await respond(Request(wsgi_environ(scope, body)))
+        finally:
+            metrics.REQUESTS_IN_PROGRESS.dec()
+        await send_response(send, response)
+
+    app.handler = handler
+    return app
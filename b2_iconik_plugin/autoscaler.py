@@ -0,0 +1,116 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Sizes a scheduler's pool of action slots to match demand.
+
+Demand is the number of running actions, plus the queued actions that could
+start if there were a free slot, plus the slots reserved for interactive
+actions. When demand exceeds the pool, the pool grows to match straight away,
+so bursts are picked up within a dispatch interval. When demand falls, the
+pool only shrinks once demand has stayed below it for
+AUTOSCALE_SCALE_DOWN_DELAY seconds, and then only to the highest demand seen
+in that time, so that the pool doesn't thrash as actions come and go.
+Shrinking never stops running actions; it just starts fewer.
+
+Autoscaling is enabled by setting AUTOSCALE_MAX_ACTIONS.
+"""
+
+import os
+import time
+
+from b2_iconik_plugin import metrics
+
+# Bounds on the number of actions that may run at once in each worker
+AUTOSCALE_MIN_ACTIONS = int(os.environ.get("AUTOSCALE_MIN_ACTIONS", "2"))
+AUTOSCALE_MAX_ACTIONS = int(os.environ.get("AUTOSCALE_MAX_ACTIONS", "0"))
+
+# Seconds that demand must stay below the pool's size before the pool shrinks
+AUTOSCALE_SCALE_DOWN_DELAY = float(os.environ.get("AUTOSCALE_SCALE_DOWN_DELAY", "300"))
+
+
+def from_environment():
+    """
+    Returns:
+        An Autoscaler configured from the environment, or None if
+        AUTOSCALE_MAX_ACTIONS is not set
+    """
+    if AUTOSCALE_MAX_ACTIONS <= 0:
+        return None
+    return Autoscaler(AUTOSCALE_MIN_ACTIONS, AUTOSCALE_MAX_ACTIONS, AUTOSCALE_SCALE_DOWN_DELAY)
+
+
+class Autoscaler:
+    def __init__(self, min_slots, max_slots, scale_down_delay, clock=time.monotonic):
+        """
+        Args:
+            min_slots (int): The fewest slots in the pool
+            max_slots (int): The most slots in the pool
+            scale_down_delay (float): Seconds that demand must stay below the
+                                      pool's size before the pool shrinks
+            clock: Returns the current time, in seconds
+        """
+        if min_slots < 1 or max_slots < min_slots:
+            raise ValueError(f"Invalid autoscaling bounds: {min_slots} to {max_slots}")
+        self.min_slots = min_slots
+        self.max_slots = max_slots
+        self._scale_down_delay = scale_down_delay
+        self._clock = clock
+        # When demand fell below the pool's size, and the highest demand since
+        self._low_since = None
+        self._low_peak = 0
+
+    def clamp(self, slots):
+        return max(self.min_slots, min(self.max_slots, slots))
+
+    def resize(self, slots, demand):
+        """
+        Args:
+            slots (int): The pool's current size
+            demand (int): The number of slots that would be busy right now
+                          if the pool were big enough
+        Returns:
+            The pool's new size
+        """
+        target = self.clamp(demand)
+        if target >= slots:
+            self._low_since = None
+            if target > slots:
+                metrics.AUTOSCALE_EVENTS.labels("up").inc()
+            return target
+
+        now = self._clock()
+        if self._low_since is None:
+            self._low_since = now
+            self._low_peak = target
+            return slots
+        self._low_peak = max(self._low_peak, target)
+        if now - self._low_since < self._scale_down_delay:
+            return slots
+
+        # Demand has stayed low for long enough; if it is lower still, the
+        # pool may shrink again after another delay
+        resized = self._low_peak
+        self._low_since = now if target < resized else None
+        self._low_peak = target
+        metrics.AUTOSCALE_EVENTS.labels("down").inc()
+        return resized
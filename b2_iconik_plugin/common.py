@@ -20,13 +20,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
 import os
 import time
 
 from flask import abort, Response
+from werkzeug.exceptions import HTTPException
 
+from b2_iconik_plugin import eviction, metrics, planner, profiling, tracing
 # Names for secrets
-from b2_iconik_plugin.iconik import Iconik
+from b2_iconik_plugin.iconik import CHECK_PRESENCE, Iconik
+from b2_iconik_plugin.ids import IdSet
 
 DEFAULT_FORMAT_NAMES = "ORIGINAL,PPRO_PROXY"
 
@@ -35,6 +39,15 @@ SHARED_SECRET_NAME = "bz-shared-secret"
 
 X_BZ_SHARED_SECRET = "x-bz-secret"
 
+# Largest custom action request body accepted, in bytes; 16 MiB is enough for over 300,000 asset ids
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
+
+# Request fields holding lists of ids
+ID_FIELDS = ["asset_ids", "collection_ids"]
+
+# Number of assets to process between checks on whether to yield to higher priority actions
+PREEMPT_CHUNK_SIZE = int(os.environ.get("PREEMPT_CHUNK_SIZE", "200"))
+
 
 class IconikHandler:
     def __init__(self, logger, shared_secret, iconik_id, format_names=None, testing=False):
@@ -43,10 +56,23 @@ class IconikHandler:
         self._shared_secret = shared_secret
         self._iconik_id = iconik_id
         self._testing = testing
+        self._yield_event = None
 
     def is_testing(self):
         return self._testing
 
+    def set_yield_event(self, event):
+        """
+        Args:
+            event: An event that is set when processing should stop at the
+                   next chunk of assets, so that a higher priority action can
+                   run
+        """
+        self._yield_event = event
+
+    def should_yield(self):
+        return self._yield_event is not None and self._yield_event.is_set()
+
     def post(self, req):
         """
         Handles iconik custom action.
@@ -56,8 +82,30 @@ class IconikHandler:
             those assets' files from LucidLink
         """
         start_time = time.perf_counter()
+        status_code = 500
+        with tracing.span("IconikHandler.post", context=tracing.request_context(req), kind="server",
+                          **{"http.request.method": req.method, "url.path": req.path}) as span:
+            try:
+                with profiling.profile("post"):
+                    response = self.handle(req)
+                status_code = 200
+                return response
+            except HTTPException as ex:
+                status_code = ex.code
+                raise
+            finally:
+                if span:
+                    span.set_attribute("http.response.status_code", status_code)
+                metrics.HANDLER_LATENCY.labels(
+                    metrics.operation_name(req.path), status_code).observe(time.perf_counter() - start_time)
+
+    def handle(self, req):
+        """
+        Validates the custom action request and starts processing it
+        """
+        start_time = time.perf_counter()
         self._logger.log("DEBUG", "Handler started")
-        self._logger.log("DEBUG", req.get_data(as_text=True), req)
+        self._logger.log("DEBUG", "Request", req)
 
         # Authenticate caller via shared secret
         if req.headers.get(X_BZ_SHARED_SECRET) != self._shared_secret:
@@ -74,13 +122,12 @@ class IconikHandler:
             self._logger.log("ERROR", f"Invalid method: {req.method}")
             abort(405)
 
-        # Parse the request body as JSON; return None on any errors rather than
-        # raising an exception
-        request = req.get_json(silent=True)
+        # Read the request body once, and parse it as JSON; None on any errors
+        body, request = read_json_body(req)
 
         # Is JSON body missing or badly formed?
-        if not request:
-            self._logger.log("ERROR", f"Invalid JSON body: {req.get_data(as_text=True)}")
+        if not request or not isinstance(request, dict):
+            self._logger.log("ERROR", f"Invalid JSON body: {body[:200].decode('utf-8', errors='replace')}")
             abort(400)
 
         # Create an iconic API client per request, since it uses the auth_token
@@ -116,39 +163,142 @@ class IconikHandler:
         # Perform the requested operation
         if req.path in ["/add", "/remove"]:
             request["action"] = req.path[1:]
-            self.start_process(request, iconik, b2_storage, ll_storage, format_names)
+            plan_key = planner.plan_key(request, format_names, b2_storage["id"], ll_storage["id"])
+            if req.args.get("dry_run", "").lower() in ["1", "true", "yes"]:
+                # Just report what the action would do, keeping the listings for when it's executed
+                plan = planner.plan_action(iconik, request, format_names, b2_storage["id"], ll_storage["id"])
+                planner.plans.put(plan_key, plan)
+                result = plan.to_dict()
+            else:
+                plan = planner.plans.take(plan_key)
+                if plan:
+                    self._logger.log("DEBUG", f"Reusing {len(plan.listings)} listings from plan")
+                    iconik.listings.update(plan.listings)
+                # Carry the trace across to wherever the request is processed
+                request[tracing.TRACE_CONTEXT_KEY] = tracing.inject()
+                self.start_process(request, iconik, b2_storage, ll_storage, format_names)
+                result = "OK"
         else:
             self._logger.log("ERROR", f"Invalid path: {req.path}")
             abort(404)
 
         self._logger.log("DEBUG", f"Handler complete in {(time.perf_counter() - start_time):.3f} seconds")
-        return "OK"
+        return result
 
     def start_process(self, request, iconik, b2_storage, ll_storage, format_names):
         self.do_process(request, iconik, b2_storage, ll_storage, format_names)
 
     def do_process(self, request, iconik, b2_storage, ll_storage, format_names):
+        """
+        Returns:
+            None if the action is complete, otherwise a request for the
+            remaining assets of an action that yielded
+        """
         start_time = time.perf_counter()
         self._logger.log("DEBUG", "Processor started")
+        metrics.ACTIONS_IN_PROGRESS.inc()
+        try:
+            parent = tracing.extract(request.get(tracing.TRACE_CONTEXT_KEY))
+            with tracing.span("IconikHandler.do_process", context=parent,
+                              **{"iconik.action": request["action"], "iconik.context": request.get("context")}), \
+                    profiling.profile(f"do_process-{request['action']}"):
+                continuation = self.process(request, iconik, b2_storage, ll_storage, format_names)
+        finally:
+            metrics.ACTIONS_IN_PROGRESS.dec()
+            metrics.PROCESS_LATENCY.labels(request["action"]).observe(time.perf_counter() - start_time)
 
-        if request["action"] == "add":
-            # Copy files to LucidLink
+        if continuation:
+            self._logger.log("INFO", f"Processor yielded with {len(continuation['asset_ids'])} assets remaining")
+        self._logger.log("DEBUG", f"Processor complete in {(time.perf_counter() - start_time):.3f} seconds")
+        return continuation
+
+    def process(self, request, iconik, b2_storage, ll_storage, format_names):
+        """
+        Copies and/or deletes files according to the requested action. The
+        request's collections are expanded, and the assets are processed in
+        chunks, or for /remove in copy batches, checking between them whether
+        to yield.
+        Returns:
+            None if the action is complete, otherwise a request for the
+            remaining assets
+        """
+        if request["action"] == "add" and not CHECK_PRESENCE:
+            # Nothing can be skipped, so collections are copied whole rather than expanded
             iconik.copy_files(request=request,
                               format_names=format_names,
                               target_storage_id=ll_storage["id"],
-                              sync=self._testing)
-        elif request["action"] == "remove":
-            # Copy any original files to B2, waiting for job(s) to complete
-            if iconik.copy_files(request=request,
-                                 format_names=[format_names[0]],
-                                 target_storage_id=b2_storage["id"],
-                                 sync=True):
-                # Delete files from LucidLink
-                iconik.delete_files(request=request,
-                                    format_names=format_names,
-                                    storage_id=ll_storage["id"])
+                              sync=self._testing,
+                              check_presence=False)
+            eviction.record_added(request.get("asset_ids") or [])
+            return None
 
-        self._logger.log("DEBUG", f"Processor complete in {(time.perf_counter() - start_time):.3f} seconds")
+        asset_ids = iconik.get_request_asset_ids(request)
+        if request["action"] == "remove":
+            # Copy any original files to B2, deleting each batch of assets' files
+            # from LucidLink as soon as its copy job completes, and checking
+            # between batches whether to yield
+            failed, remaining = iconik.remove_assets(asset_ids,
+                                                     format_names=format_names,
+                                                     b2_storage_id=b2_storage["id"],
+                                                     ll_storage_id=ll_storage["id"],
+                                                     should_yield=self.should_yield)
+            if failed:
+                self._logger.log("ERROR", "Some assets could not be copied to B2, so their files were not deleted")
+            eviction.record_removed(IdSet(asset_id for asset_id in asset_ids
+                                          if asset_id not in remaining and asset_id not in failed))
+            if remaining:
+                return dict(request, asset_ids=remaining, collection_ids=[])
+            return None
+
+        for i in range(0, len(asset_ids), PREEMPT_CHUNK_SIZE):
+            if i > 0 and self.should_yield():
+                return dict(request, asset_ids=asset_ids[i:], collection_ids=[])
+            chunk = dict(request, asset_ids=asset_ids[i:i + PREEMPT_CHUNK_SIZE], collection_ids=[])
+            if request["action"] == "add":
+                # Copy files to LucidLink
+                iconik.copy_files(request=chunk,
+                                  format_names=format_names,
+                                  target_storage_id=ll_storage["id"],
+                                  sync=self._testing)
+                eviction.record_added(chunk["asset_ids"])
+        return None
+
+
+def compact_ids(obj):
+    """
+    JSON object hook that stores lists of ids as IdSets as soon as they are
+    decoded
+    """
+    for field in ID_FIELDS:
+        if isinstance(obj.get(field), list):
+            obj[field] = IdSet(obj[field])
+    return obj
+
+
+def read_json_body(req, max_bytes=None):
+    """
+    Read a request body in a single pass into one buffer, and parse it as
+    JSON, with the lists of ids in ID_FIELDS stored as IdSets. Bodies larger
+    than max_bytes are rejected with 413 Payload Too Large, before any of the
+    body is read if the request has a Content-Length.
+    Args:
+        req (flask.Request): The request
+        max_bytes (int): Optional limit; defaults to MAX_REQUEST_BYTES
+    Returns:
+        A tuple of (body, parsed JSON), with the parsed JSON None if the body
+        is not valid JSON or contains an invalid id
+    """
+    max_bytes = MAX_REQUEST_BYTES if max_bytes is None else max_bytes
+    if req.content_length is not None and req.content_length > max_bytes:
+        abort(413)
+    # Read one byte more than the limit, to catch bodies without a Content-Length
+    body = req.stream.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        abort(413)
+    try:
+        return body, json.loads(body, object_hook=compact_ids)
+    except ValueError:
+        return body, None
 
 
 def check_environment_variables(names):
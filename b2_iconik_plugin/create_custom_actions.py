@@ -20,8 +20,34 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+"""
+Creates the plugin's custom actions in iconik.
+
+As well as from the command line, actions can be provisioned from a JSON
+config file listing any number of plugin endpoints and format lists:
+
+    {
+        "endpoints": [
+            {
+                "url": "https://plugin1.example.com/",
+                "b2_storage_id": "73a746d2-a3ed-4d61-8fd9-aa8f37a27bbb",
+                "ll_storage_id": "d39b62e1-c586-438a-a82b-70543c228c1b",
+                "formats": [null, "ORIGINAL", "ORIGINAL,PPRO_PROXY"]
+            }
+        ]
+    }
+
+A null format list, or no "formats" at all, creates actions for the plugin's
+default formats. The functions here can also be used as a library:
+
+    actions = desired_actions(load_config("actions.json"))
+    results = provision(iconik, actions, app_id, shared_secret)
+"""
+
 import argparse
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 from urllib.parse import urlencode
 
@@ -47,6 +73,9 @@ FORMATS = {
     'EDIT_PROXY': 'edit proxy'
 }
 
+# Number of actions created at once
+DEFAULT_CONCURRENCY = 8
+
 
 def urljoin(*args):
     """
@@ -65,6 +94,90 @@ def make_title(title, formats):
     names = ', '.join([FORMATS[f] if f in FORMATS else f for f in formats.split(',')])
     return f'{verb} {names} file(s) {rest}'
 
+
+def endpoint_actions(endpoint, b2_storage_id, ll_storage_id, formats=None):
+    """
+    Args:
+        endpoint (str): The plugin's endpoint URL
+        b2_storage_id (str): The ID of the B2 storage in iconik
+        ll_storage_id (str): The ID of the LucidLink storage in iconik
+        formats (str): Optional comma-separated list of formats
+    Returns:
+        A list of the custom actions for the endpoint and formats, each a
+        dict with "context", "url" and "title"
+    """
+    query_params = {"b2_storage_id": b2_storage_id, "ll_storage_id": ll_storage_id}
+    if formats:
+        formats = fix_formats(formats)
+        query_params["formats"] = formats
+    return [
+        {
+            "context": context,
+            "url": urljoin(endpoint, operation["path"]) + "?" + urlencode(query_params),
+            "title": make_title(operation["title"], formats),
+        }
+        for operation in OPERATIONS
+        for context in CONTEXTS
+    ]
+
+
+def load_config(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def desired_actions(config):
+    """
+    Args:
+        config (dict): A config, as described above
+    Returns:
+        A list of the custom actions for every endpoint and format list in
+        the config
+    """
+    actions = []
+    for endpoint in config["endpoints"]:
+        for formats in endpoint.get("formats") or [None]:
+            actions.extend(endpoint_actions(endpoint["url"], endpoint["b2_storage_id"], endpoint["ll_storage_id"],
+                                            formats))
+    return actions
+
+
+def provision(iconik, actions, app_id, shared_secret, concurrency=None, report=None):
+    """
+    Create custom actions in iconik, a bounded number at a time
+    Args:
+        iconik (Iconik): An iconik client
+        actions (list of dict): The actions, from endpoint_actions or
+                                desired_actions
+        app_id (str): The iconik application id
+        shared_secret (str): The plugin's shared secret
+        concurrency (int): Optional number of actions to create at once
+        report: Optional function called with each result as it completes
+    Returns:
+        A list of results, in the same order as the actions: each is the
+        action, with "id" set if it was created, or "error" if it wasn't
+    """
+    def create(action):
+        try:
+            created = iconik.add_action(action["context"], app_id, action["url"], action["title"], shared_secret)
+            result = dict(action, id=created.get("id"))
+        except Exception as ex:  # noqa
+            result = dict(action, error=repr(ex))
+        if report:
+            report(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency or DEFAULT_CONCURRENCY) as executor:
+        return list(executor.map(create, actions))
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"Failed to create '{result['title']}' action for '{result['context']}': {result['error']}")
+    else:
+        print(f"Created '{result['title']}' action for '{result['context']}'")
+
+
 def main(argv=None):
     load_dotenv()
 
@@ -73,34 +186,37 @@ def main(argv=None):
     parser = argparse.ArgumentParser(
         description="Add custom actions to iconik for the plugin"
     )
-    parser.add_argument("endpoint", type=str,
+    parser.add_argument("endpoint", type=str, nargs='?',
                         help="your function's endpoint url")
-    parser.add_argument("b2_storage_id", type=str,
+    parser.add_argument("b2_storage_id", type=str, nargs='?',
                         help="the ID of the B2 storage in iconik")
-    parser.add_argument("ll_storage_id", type=str,
+    parser.add_argument("ll_storage_id", type=str, nargs='?',
                         help="the ID of the LucidLink storage in iconik")
     parser.add_argument("formats", type=str, nargs='?',
                         help="a comma-separated list of iconik asset formats")
+    parser.add_argument("--config", type=str,
+                        help="a JSON file listing endpoints and format lists, instead of the arguments above")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of actions to create at once")
     args = parser.parse_args(argv)
 
-    query_params = { "b2_storage_id": args.b2_storage_id, "ll_storage_id": args.ll_storage_id }
-    if args.formats:
-        formats = fix_formats(args.formats)
-        query_params["formats"] = formats
+    if args.config:
+        actions = desired_actions(load_config(args.config))
+    elif args.endpoint and args.b2_storage_id and args.ll_storage_id:
+        actions = endpoint_actions(args.endpoint, args.b2_storage_id, args.ll_storage_id, args.formats)
     else:
-        formats = None
+        parser.error("the endpoint and storage IDs, or --config, are required")
 
     iconik = Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"])
 
-    for operation in OPERATIONS:
-        for context in CONTEXTS:
-            title = make_title(operation["title"], formats)
-            print(f"Creating '{title}' action for '{context}'")
-            iconik.add_action(context,
-                              os.environ["ICONIK_ID"],
-                              urljoin(args.endpoint, operation["path"]) + "?" + urlencode(query_params),
-                              title,
-                              os.environ["BZ_SHARED_SECRET"])
+    print(f"Creating {len(actions)} actions")
+    results = provision(iconik, actions, os.environ["ICONIK_ID"], os.environ["BZ_SHARED_SECRET"],
+                        concurrency=args.concurrency, report=print_result)
+    failures = sum(1 for result in results if "error" in result)
+    if failures:
+        print(f"{failures} of {len(actions)} actions could not be created")
+        parser.exit(1)
+    return results
 
 
 if __name__ == "__main__":
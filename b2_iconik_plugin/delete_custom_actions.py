@@ -22,14 +22,152 @@
 
 import argparse
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
 
 from urllib.parse import urlparse, parse_qs
 
 from dotenv import load_dotenv
+from requests import ConnectionError, HTTPError, Timeout
 
 from b2_iconik_plugin.common import fix_formats, formats_match
 from b2_iconik_plugin.iconik import Iconik
 
+# Number of actions deleted at once
+DEFAULT_CONCURRENCY = 8
+
+# How many times to retry a delete, or a page of the listing, that failed
+# with a transient error, and the delay before the first retry, in seconds.
+# The delay doubles each time
+DELETE_RETRIES = 3
+RETRY_DELAY = 1.0
+
+
+def matching_actions(actions, endpoint, formats=None):
+    """
+    Args:
+        actions: An iterable of custom actions, such as iter_custom_actions()
+        endpoint (str): The plugin's endpoint URL
+        formats (str): Optional comma-separated list of formats
+    Returns:
+        A generator of the actions for the endpoint and formats
+    """
+    for action in actions:
+        if action["url"].startswith(endpoint):
+            query_params = parse_qs(urlparse(action["url"]).query)
+            if formats_match(formats, query_params):
+                yield action
+
+
+def is_transient(ex):
+    if isinstance(ex, (ConnectionError, Timeout)):
+        return True
+    return isinstance(ex, HTTPError) and ex.response is not None and ex.response.status_code >= 500
+
+
+def with_retries(function, retries=None, delay=None):
+    """
+    Call a function, retrying transient failures with exponential backoff
+    Returns:
+        What the function returns
+    """
+    retries = DELETE_RETRIES if retries is None else retries
+    delay = RETRY_DELAY if delay is None else delay
+    attempt = 0
+    while True:
+        try:
+            return function()
+        except Exception as ex:  # noqa
+            if not is_transient(ex) or attempt >= retries:
+                raise
+        sleep(delay * 2 ** attempt)
+        attempt += 1
+
+
+def delete_with_retries(iconik, action, retries=None, delay=None):
+    """
+    Delete an action, retrying transient failures with exponential backoff.
+    An action that has already gone counts as deleted.
+    """
+    def delete():
+        try:
+            iconik.delete_action(action)
+        except HTTPError as ex:
+            if ex.response is None or ex.response.status_code != 404:
+                raise
+
+    with_retries(delete, retries, delay)
+
+
+def delete_actions(iconik, actions, concurrency=None, report=None):
+    """
+    Delete actions a bounded number at a time. Deletes start as soon as
+    actions arrive, so actions can be a generator streaming from a listing
+    Args:
+        iconik (Iconik): An iconik client
+        actions: An iterable of custom actions
+        concurrency (int): Optional number of actions to delete at once
+        report: Optional function called with each result as it completes
+    Returns:
+        A list of results, in the same order as the actions: each is the
+        action, with "error" set if it could not be deleted
+    """
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    # Don't read further ahead in the listing than we can usefully queue
+    in_flight = threading.BoundedSemaphore(concurrency * 2)
+
+    def delete(action):
+        try:
+            delete_with_retries(iconik, action)
+            result = dict(action)
+        except Exception as ex:  # noqa
+            result = dict(action, error=repr(ex))
+        finally:
+            in_flight.release()
+        if report:
+            report(result)
+        return result
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for action in actions:
+            in_flight.acquire()
+            futures.append(executor.submit(delete, action))
+    return [future.result() for future in futures]
+
+
+def delete_matching_actions(iconik, endpoint, formats=None, concurrency=None, report=None):
+    """
+    Delete the actions for the endpoint and formats, streaming them from the
+    listing. Deleting actions can shift later pages of the listing, so the
+    actions are listed again until no new matches turn up. Pages of the
+    listing are retried like deletes
+    Returns:
+        A list of results, as delete_actions
+    Raises:
+        Exception: If a page of the listing could not be read. Actions that
+                   were deleted before then have been reported
+    """
+    results = []
+    attempted = set()
+    while True:
+        actions = (action for action in matching_actions(iconik.iter_custom_actions(retry=with_retries),
+                                                         endpoint, formats)
+                   if action["id"] not in attempted)
+        batch = delete_actions(iconik, actions, concurrency=concurrency, report=report)
+        if not batch:
+            return results
+        attempted.update(result["id"] for result in batch)
+        results.extend(batch)
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"Failed to delete '{result['title']}' action for '{result['context']}': {result['error']}")
+    else:
+        print(f"Deleted '{result['title']}' action for '{result['context']}'")
+
 
 def main(argv=None):
     load_dotenv()
@@ -41,6 +179,8 @@ def main(argv=None):
                         help="your function's endpoint url")
     parser.add_argument("formats", type=str, nargs='?',
                         help="a comma-separated list of iconik asset formats")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of actions to delete at once")
     args = parser.parse_args(argv)
 
     if not args.endpoint:
@@ -51,13 +191,23 @@ def main(argv=None):
 
     iconik = Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"])
 
-    for action in iconik.get_custom_actions():
-        if action["url"].startswith(args.endpoint):
-            url = urlparse(action["url"])
-            query_params = parse_qs(url.query)
-            if formats_match(formats, query_params):
-                print(f"Deleting '{action['title']}' action for '{action['context']}'")
-                iconik.delete_action(action)
+    results = []
+
+    def report(result):
+        results.append(result)
+        print_result(result)
+
+    listed = True
+    try:
+        delete_matching_actions(iconik, args.endpoint, formats, concurrency=args.concurrency, report=report)
+    except Exception as ex:  # noqa
+        print(f"Could not list custom actions: {ex!r}")
+        listed = False
+    failures = sum(1 for result in results if "error" in result)
+    print(f"Deleted {len(results) - failures} actions, {failures} failed")
+    if failures or not listed:
+        parser.exit(1)
+    return results
 
 
 if __name__ == "__main__":
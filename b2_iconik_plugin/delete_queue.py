@@ -0,0 +1,307 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Manages iconik's asset delete queue in bulk.
+
+The delete queue is read a page at a time rather than all at once, filtered
+by age or an arbitrary predicate, and purged in chunks that are submitted in
+parallel. A chunk that iconik rejects as too large is split in half and
+retried, and later chunks are sent at the smaller size, so the chunk size
+settles at whatever iconik will accept. Timeouts and other transient failures
+are retried with exponential backoff, and if several chunks in a row still
+fail, the rest of the purge is abandoned rather than sent to a failing server.
+
+As well as purging once, the queue can be compacted continually, purging
+old entries at an interval to keep the queue small during heavy churn:
+
+    python -m b2_iconik_plugin.delete_queue --older-than 86400 --compact --interval 300
+"""
+
+import argparse
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from time import sleep, time
+
+from dotenv import load_dotenv
+from requests import HTTPError
+
+from b2_iconik_plugin.common import check_environment_variables
+from b2_iconik_plugin.delete_custom_actions import is_transient
+from b2_iconik_plugin.iconik import Iconik
+from b2_iconik_plugin.ids import IdSetBuilder
+
+# Number of asset ids sent to iconik in each request
+DEFAULT_CHUNK_SIZE = 500
+
+# Number of requests sent at once
+DEFAULT_CONCURRENCY = 4
+
+# How many times to retry a chunk that failed with a transient error, and
+# the delay before the first retry, in seconds. The delay doubles each time
+RETRIES = 3
+RETRY_DELAY = 1.0
+
+# Number of chunks in a row that can fail with transient errors, after
+# retries, before the rest of a purge is abandoned
+MAX_CONSECUTIVE_FAILURES = 3
+
+# Seconds between compaction passes
+DEFAULT_INTERVAL = 300
+
+
+def deleted_at(entry):
+    """
+    Returns:
+        When the entry was deleted, in seconds since the epoch, or None if
+        iconik didn't say
+    """
+    value = entry.get("date_deleted") or entry.get("date_modified")
+    if not value:
+        return None
+    date = datetime.fromisoformat(value)
+    if not date.tzinfo:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def too_large(ex):
+    return isinstance(ex, HTTPError) and ex.response is not None and ex.response.status_code in (413, 414)
+
+
+class DeleteQueue:
+    def __init__(self, iconik, chunk_size=None, concurrency=None, clock=time):
+        """
+        Args:
+            iconik (Iconik): An iconik client
+            chunk_size (int): Optional number of asset ids per request. This
+                              shrinks if iconik rejects chunks as too large
+            concurrency (int): Optional number of requests to send at once
+            clock: Optional function returning the current time, for testing
+        """
+        self.iconik = iconik
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self.concurrency = concurrency or DEFAULT_CONCURRENCY
+        self.clock = clock
+        # Whether the last add or purge was abandoned after repeated failures
+        self.tripped = False
+        self._failures = 0
+        self._lock = threading.Lock()
+
+    def entries(self, older_than=None, predicate=None):
+        """
+        Args:
+            older_than (float): Optional age in seconds; only entries deleted
+                                longer ago than this are returned
+            predicate: Optional function returning True for entries to return
+        Returns:
+            A generator of delete queue entries, read a page at a time
+        """
+        cutoff = self.clock() - older_than if older_than is not None else None
+        for entry in self.iconik.iter_deleted_objects():
+            if cutoff is not None:
+                when = deleted_at(entry)
+                if when is None or when > cutoff:
+                    continue
+            if predicate and not predicate(entry):
+                continue
+            yield entry
+
+    def add(self, asset_ids):
+        """
+        Add assets to the delete queue
+        Returns:
+            A dict with the number of assets "done" and a list of those "failed"
+        """
+        return self._submit(self.iconik.add_assets_to_delete_queue, asset_ids)
+
+    def purge(self, entries):
+        """
+        Purge entries, or asset ids, from the delete queue
+        Returns:
+            A dict with the number of assets "done" and a list of those "failed"
+        """
+        return self._submit(self.iconik.purge_assets_from_delete_queue,
+                            (entry["id"] if isinstance(entry, dict) else entry for entry in entries))
+
+    def purge_matching(self, older_than=None, predicate=None):
+        """
+        Purge the entries returned by entries(). Purging while paging through
+        the queue can shift later pages, so the queue is read again until it
+        turns up no entries that haven't already been tried
+        Returns:
+            A dict with the number of assets "done" and a list of those "failed"
+        """
+        attempted = IdSetBuilder()
+        total = {"done": 0, "failed": []}
+        while True:
+            result = self.purge(entry for entry in self.entries(older_than, predicate) if attempted.add(entry["id"]))
+            if not result["done"] and not result["failed"]:
+                return total
+            total["done"] += result["done"]
+            total["failed"].extend(result["failed"])
+            if self.tripped:
+                return total
+
+    def compact(self, older_than, interval=None, stop_event=None, report=None):
+        """
+        Purge entries older than older_than every interval seconds, until
+        stop_event is set
+        Args:
+            report: Optional function called with the result of each pass
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            result = self.purge_matching(older_than)
+            if report:
+                report(result)
+            stop_event.wait(interval or DEFAULT_INTERVAL)
+
+    def _submit(self, request, asset_ids):
+        """
+        Send asset ids to iconik in chunks, a bounded number at a time. Chunks
+        are read from asset_ids as they're sent, so it can be a generator.
+        Once MAX_CONSECUTIVE_FAILURES chunks in a row have failed, chunks that
+        haven't been sent fail without being sent, and no more are read
+        """
+        done = 0
+        failed = []
+        self.tripped = False
+        self._failures = 0
+        in_flight = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def send(chunk):
+            nonlocal done
+            try:
+                ok, bad = self._send(request, chunk) if not self._tripped() else (0, chunk)
+                with self._lock:
+                    done += ok
+                    failed.extend(bad)
+            finally:
+                in_flight.release()
+
+        iterator = iter(asset_ids)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                in_flight.acquire()
+                # Read at the current chunk size, which shrinks as iconik rejects chunks as too large
+                chunk = [] if self._tripped() else list(islice(iterator, self.chunk_size))
+                if not chunk:
+                    in_flight.release()
+                    break
+                executor.submit(send, chunk)
+        if self.tripped:
+            self.iconik.logger.log("ERROR", {"message": "Stopped updating delete queue after repeated failures",
+                                             "failed": len(failed)})
+        return {"done": done, "failed": failed}
+
+    def _tripped(self):
+        with self._lock:
+            self.tripped = self.tripped or self._failures >= MAX_CONSECUTIVE_FAILURES
+            return self.tripped
+
+    def _send(self, request, chunk, attempt=0):
+        """
+        Returns:
+            The number of ids sent, and a list of those that couldn't be
+        """
+        try:
+            request(chunk)
+            with self._lock:
+                self._failures = 0
+            return len(chunk), []
+        except Exception as ex:  # noqa
+            if too_large(ex) and len(chunk) > 1:
+                middle = len(chunk) // 2
+                with self._lock:
+                    self.chunk_size = min(self.chunk_size, len(chunk) - middle)
+                first, first_failed = self._send(request, chunk[:middle])
+                second, second_failed = self._send(request, chunk[middle:])
+                return first + second, first_failed + second_failed
+            transient = is_transient(ex)
+            if transient and attempt < RETRIES and not self._tripped():
+                sleep(RETRY_DELAY * 2 ** attempt)
+                return self._send(request, chunk, attempt + 1)
+            if transient:
+                with self._lock:
+                    self._failures += 1
+            self.iconik.logger.log("ERROR", {"message": "Could not update delete queue",
+                                             "asset_ids": len(chunk), "error": repr(ex)})
+            return 0, list(chunk)
+
+
+def print_result(result):
+    print(f"Purged {result['done']} assets, {len(result['failed'])} failed")
+
+
+def main(argv=None):
+    load_dotenv()
+
+    check_environment_variables(['ICONIK_ID', 'ICONIK_TOKEN'])
+
+    parser = argparse.ArgumentParser(
+        description="Purge assets from iconik's delete queue"
+    )
+    parser.add_argument("--older-than", type=float,
+                        help="only purge assets deleted more than this many seconds ago")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="number of assets to purge in each request")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of requests to send at once")
+    parser.add_argument("--compact", action="store_true",
+                        help="keep running, purging old assets every --interval seconds")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between purges in --compact mode")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="count the assets that would be purged without purging them")
+    args = parser.parse_args(argv)
+
+    if args.compact and args.older_than is None:
+        parser.error("--compact requires --older-than")
+
+    iconik = Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"])
+    queue = DeleteQueue(iconik, chunk_size=args.chunk_size, concurrency=args.concurrency)
+
+    if args.dry_run:
+        print(f"Would purge {sum(1 for _ in queue.entries(args.older_than))} assets")
+        return None
+
+    if args.compact:
+        stop_event = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop_event.set())
+        queue.compact(args.older_than, args.interval, stop_event, report=print_result)
+        return None
+
+    result = queue.purge_matching(args.older_than)
+    print_result(result)
+    if result["failed"]:
+        parser.exit(1)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Evicts the least recently used assets from LucidLink when it fills up.
+
+When EVICTION_STATE is set, the plugin records the time at which each asset
+is added to LucidLink, and forgets assets that are removed. The eviction
+daemon totals the size of those assets' files on LucidLink and, once the
+total passes a high watermark, offloads the least recently added assets,
+copying them to B2 and checking the copies before deleting their files
+from LucidLink, until the total is below a low watermark:
+
+    EVICTION_STATE=sqlite:////var/lib/b2-iconik-plugin/eviction.db \\
+    python -m b2_iconik_plugin.eviction --capacity 2T --high 0.9 --low 0.8
+
+The daemon keeps its index of assets in memory, in a heap ordered by access
+time, and reads only the accesses recorded since its last cycle, so picking
+each asset to evict takes O(log n) time.
+"""
+
+import argparse
+import heapq
+import os
+import re
+import signal
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from b2_iconik_plugin import common, sqlitedb
+from b2_iconik_plugin.iconik import Iconik
+from b2_iconik_plugin.ids import IdSet
+from b2_iconik_plugin.logger import Logger
+
+# Where the plugin records when assets were added to LucidLink; empty disables recording
+EVICTION_STATE = os.environ.get("EVICTION_STATE", "")
+
+# Seconds between eviction cycles
+EVICTION_INTERVAL = float(os.environ.get("EVICTION_INTERVAL", "300"))
+
+# Number of assets offloaded in each call to remove_assets
+EVICTION_BATCH_SIZE = int(os.environ.get("EVICTION_BATCH_SIZE", "50"))
+
+# Seconds after an asset is added during which its size is measured again each cycle, since its files are copied to
+# LucidLink in the background
+EVICTION_SETTLE_TIME = float(os.environ.get("EVICTION_SETTLE_TIME", "3600"))
+
+# Seconds before an asset that couldn't be offloaded is tried again; doubles with each failure, up to a day
+EVICTION_RETRY_DELAY = float(os.environ.get("EVICTION_RETRY_DELAY", "3600"))
+MAX_RETRY_DELAY = 86400
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4, "P": 1024 ** 5}
+
+_access_log = None
+_access_log_lock = threading.Lock()
+
+
+def open_access_log(url=None):
+    """
+    Args:
+        url (str): Optional log URL; defaults to the EVICTION_STATE
+                   environment variable
+    Returns:
+        An AccessLog, or None if url is empty
+    """
+    url = EVICTION_STATE if url is None else url
+    if not url:
+        return None
+    return AccessLog(sqlitedb.database_path(url, "EVICTION_STATE"))
+
+
+def access_log():
+    """
+    Returns:
+        This process's access log, or None if EVICTION_STATE isn't set
+    """
+    global _access_log
+    if not EVICTION_STATE:
+        return None
+    with _access_log_lock:
+        if _access_log is None:
+            _access_log = open_access_log()
+        return _access_log
+
+
+def record_added(asset_ids):
+    """
+    Record that assets were added to LucidLink, if EVICTION_STATE is set
+    """
+    log = access_log()
+    if log:
+        log.record(asset_ids)
+
+
+def record_removed(asset_ids):
+    """
+    Record that assets were removed from LucidLink, if EVICTION_STATE is set
+    """
+    log = access_log()
+    if log:
+        log.forget(asset_ids)
+
+
+def parse_size(value):
+    """
+    Args:
+        value (str): A number of bytes, optionally followed by K, M, G, T or
+                     P, for powers of 1024
+    Returns:
+        The number of bytes
+    """
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGTP]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+class AccessLog:
+    """
+    When assets were last added to LucidLink, in a SQLite database that the
+    plugin and the eviction daemon share. Every change is stamped with an
+    increasing version, so the daemon can read just the changes since its
+    last cycle
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.clock = clock
+        self._db = sqlitedb.connect(path, """
+            CREATE TABLE IF NOT EXISTS assets (
+                asset_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL,
+                bytes INTEGER,
+                removed INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS assets_version ON assets (version);
+        """)
+        self._lock = threading.Lock()
+
+    def _write(self, sql, rows):
+        with sqlitedb.transaction(self._db, self._lock) as db:
+            version = db.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM assets").fetchone()[0]
+            db.executemany(sql, [dict(row, version=version) for row in rows])
+
+    def record(self, asset_ids, when=None):
+        """
+        Record that assets were added to LucidLink. Their sizes are worked
+        out afresh, since more of their files may have been copied
+        """
+        when = self.clock() if when is None else when
+        self._write("INSERT INTO assets (asset_id, last_access, bytes, removed, version) "
+                    "VALUES (:asset_id, :when, NULL, 0, :version) "
+                    "ON CONFLICT (asset_id) DO UPDATE SET last_access = excluded.last_access, bytes = NULL, "
+                    "removed = 0, version = excluded.version",
+                    [{"asset_id": asset_id, "when": when} for asset_id in asset_ids])
+
+    def forget(self, asset_ids):
+        """
+        Record that assets were removed from LucidLink
+        """
+        self._write("UPDATE assets SET removed = 1, version = :version WHERE asset_id = :asset_id",
+                    [{"asset_id": asset_id} for asset_id in asset_ids])
+
+    def changes(self, since):
+        """
+        Returns:
+            A tuple of (version, rows), where rows are tuples of (asset_id,
+            last_access, bytes, removed) changed after version since
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT asset_id, last_access, bytes, removed, version FROM assets WHERE version > ? ORDER BY version",
+                (since,)).fetchall()
+        version = rows[-1][4] if rows else since
+        return version, [(asset_id, last_access, bytes_, bool(removed))
+                         for asset_id, last_access, bytes_, removed, _version in rows]
+
+    def set_bytes(self, asset_id, bytes_):
+        # Doesn't change the version, since it's the daemon that works sizes out
+        with self._lock:
+            self._db.execute("UPDATE assets SET bytes = ? WHERE asset_id = ? AND removed = 0", (bytes_, asset_id))
+
+    def purge(self, asset_ids):
+        """
+        Delete the records of assets that have been removed
+        """
+        with self._lock:
+            # Keep the latest version's row, since the next version is one more than it
+            self._db.executemany("DELETE FROM assets WHERE asset_id = ? AND removed = 1 "
+                                 "AND version < (SELECT MAX(version) FROM assets)",
+                                 [(asset_id,) for asset_id in asset_ids])
+
+    def close(self):
+        self._db.close()
+
+
+class LruIndex:
+    """
+    A heap of assets ordered by access time. Touching an asset pushes a new
+    entry rather than moving the old one; entries that no longer match an
+    asset's access time are skipped when they reach the top
+    """
+
+    def __init__(self):
+        self._last_access = {}
+        self._heap = []
+
+    def touch(self, asset_id, last_access):
+        self._last_access[asset_id] = last_access
+        heapq.heappush(self._heap, (last_access, asset_id))
+        # Don't let superseded entries outnumber live ones
+        if len(self._heap) > 2 * len(self._last_access) + 64:
+            self._heap = [(when, id_) for id_, when in self._last_access.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, asset_id):
+        self._last_access.pop(asset_id, None)
+
+    def pop(self):
+        """
+        Returns:
+            A tuple of (asset_id, last_access) for the least recently used
+            asset, or None if there are none
+        """
+        while self._heap:
+            last_access, asset_id = heapq.heappop(self._heap)
+            if self._last_access.get(asset_id) == last_access:
+                del self._last_access[asset_id]
+                return asset_id, last_access
+        return None
+
+    def __contains__(self, asset_id):
+        return asset_id in self._last_access
+
+    def __len__(self):
+        return len(self._last_access)
+
+
+class Evictor:
+    def __init__(self, iconik, log, format_names, b2_storage_id, ll_storage_id, high_watermark, low_watermark,
+                 batch_size=None, settle_time=None, retry_delay=None, logger=None):
+        """
+        Args:
+            iconik (Iconik): An iconik client
+            log (AccessLog): The plugin's record of added assets
+            format_names (list of str): The formats to evict
+            b2_storage_id (str): The B2 storage id
+            ll_storage_id (str): The LucidLink storage id
+            high_watermark (int): Bytes on LucidLink at which to start evicting
+            low_watermark (int): Bytes on LucidLink at which to stop evicting
+            batch_size (int): Optional number of assets to offload at once
+            settle_time (float): Optional seconds after an asset is added
+                                 during which to measure it every cycle
+            retry_delay (float): Optional seconds before an asset that
+                                 couldn't be offloaded is tried again
+            logger (Logger): Optional logger
+        """
+        if low_watermark > high_watermark:
+            raise ValueError("The low watermark must not be above the high watermark")
+        self.iconik = iconik
+        self.log = log
+        self.format_names = format_names
+        self.b2_storage_id = b2_storage_id
+        self.ll_storage_id = ll_storage_id
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size or EVICTION_BATCH_SIZE
+        self.settle_time = EVICTION_SETTLE_TIME if settle_time is None else settle_time
+        self.retry_delay = EVICTION_RETRY_DELAY if retry_delay is None else retry_delay
+        self.logger = logger or Logger()
+        self.index = LruIndex()
+        self.sizes = {}
+        # Assets whose files may still be arriving: asset id -> last access
+        self.unsettled = {}
+        # Assets that couldn't be offloaded, kept out of the index until they are due to be tried again:
+        # asset id -> (last access, when to try again), and asset id -> number of failures
+        self.quarantine = {}
+        self.failures = {}
+        self.usage = 0
+        self.version = 0
+
+    def asset_bytes(self, asset_id):
+        """
+        Returns:
+            The total size of the asset's files of the evicted formats on
+            LucidLink
+        """
+        format_ids = set()
+        for format_name in self.format_names:
+            format_obj = self.iconik.get_format(asset_id, format_name)
+            if format_obj:
+                format_ids.add(format_obj["id"])
+        return sum(file.get("size") or 0 for file in self.iconik.get_asset_files(asset_id)
+                   if file.get("storage_id") == self.ll_storage_id
+                   and file.get("format_id") in format_ids
+                   and file.get("status", "CLOSED") != "DELETED")
+
+    def _set_size(self, asset_id, bytes_):
+        self.usage += bytes_ - self.sizes.get(asset_id, 0)
+        self.sizes[asset_id] = bytes_
+
+    def _drop(self, asset_id):
+        self.index.remove(asset_id)
+        self.unsettled.pop(asset_id, None)
+        self.quarantine.pop(asset_id, None)
+        self.failures.pop(asset_id, None)
+        self.usage -= self.sizes.pop(asset_id, 0)
+
+    def refresh(self, remeasure=True):
+        """
+        Apply the accesses and removals recorded since the last refresh, and
+        measure the assets that have been added since
+        Args:
+            remeasure (bool): Whether to measure again the assets that were
+                              added less than settle_time seconds ago
+        Returns:
+            The number of changes applied
+        """
+        self.version, rows = self.log.changes(self.version)
+        removed = []
+        added = []
+        for asset_id, last_access, bytes_, is_removed in rows:
+            if is_removed:
+                self._drop(asset_id)
+                removed.append(asset_id)
+                continue
+            if asset_id in self.quarantine:
+                self.quarantine[asset_id] = (last_access, self.quarantine[asset_id][1])
+            else:
+                self.index.touch(asset_id, last_access)
+            if bytes_ is None:
+                self.unsettled[asset_id] = last_access
+                added.append(asset_id)
+            else:
+                self.unsettled.pop(asset_id, None)
+                self._set_size(asset_id, bytes_)
+        if removed:
+            self.log.purge(removed)
+        self._measure(list(self.unsettled) if remeasure else added)
+        return len(rows)
+
+    def _measure(self, asset_ids):
+        # A size is only kept in the log once the asset has had time to settle, so that a size measured while the
+        # copy job was still running isn't kept until the asset is added again
+        now = self.log.clock()
+        for asset_id in asset_ids:
+            last_access = self.unsettled.get(asset_id)
+            if last_access is None:
+                # Removed since
+                continue
+            self._set_size(asset_id, self.asset_bytes(asset_id))
+            if now - last_access >= self.settle_time:
+                self.log.set_bytes(asset_id, self.sizes[asset_id])
+                del self.unsettled[asset_id]
+
+    def _hold_back(self, asset_id, last_access):
+        # Back off, rather than putting the asset back at the head of the index, where it would be picked first
+        # every cycle
+        failures = self.failures.get(asset_id, 0) + 1
+        self.failures[asset_id] = failures
+        delay = min(self.retry_delay * 2 ** (failures - 1), MAX_RETRY_DELAY)
+        self.quarantine[asset_id] = (last_access, self.log.clock() + delay)
+
+    def _release(self):
+        now = self.log.clock()
+        for asset_id, (last_access, retry_at) in list(self.quarantine.items()):
+            if retry_at <= now:
+                del self.quarantine[asset_id]
+                self.index.touch(asset_id, last_access)
+
+    def run_once(self):
+        """
+        Run an eviction cycle: if usage is above the high watermark, offload
+        the least recently used assets until it is below the low watermark.
+        Assets that can't be offloaded are skipped, and not tried again until
+        retry_delay has passed
+        Returns:
+            A dict with the "usage" before and after, the number of assets
+            "evicted", and whether any could not be ("failed")
+        """
+        self.refresh()
+        self._release()
+        before = self.usage
+        evicted = 0
+        failed = False
+        if self.usage > self.high_watermark:
+            while self.usage > self.low_watermark and len(self.index):
+                batch = []
+                projected = self.usage
+                while projected > self.low_watermark and len(batch) < self.batch_size:
+                    victim = self.index.pop()
+                    if victim is None:
+                        break
+                    batch.append(victim)
+                    projected -= self.sizes.get(victim[0], 0)
+                not_removed, _remaining = self.iconik.remove_assets(
+                    IdSet(asset_id for asset_id, _last_access in batch), self.format_names, self.b2_storage_id,
+                    self.ll_storage_id)
+                removed = []
+                for asset_id, last_access in batch:
+                    if asset_id in not_removed:
+                        self._hold_back(asset_id, last_access)
+                    else:
+                        self._drop(asset_id)
+                        removed.append(asset_id)
+                if not_removed:
+                    self.logger.log("ERROR", f"{len(not_removed)} assets could not be copied to B2, so they were "
+                                             f"not evicted")
+                    failed = True
+                self.log.forget(removed)
+                evicted += len(removed)
+            # Don't read our own removals back as changes
+            self.refresh(remeasure=False)
+
+        result = {"usage_before": before, "usage_after": self.usage, "evicted": evicted, "failed": failed}
+        self.logger.log("INFO", {"message": "Eviction cycle complete", **result})
+        return result
+
+    def run(self, interval=None, stop_event=None):
+        """
+        Run eviction cycles every interval seconds until stop_event is set
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as ex:  # noqa
+                self.logger.log("ERROR", f"Eviction error: {ex!r}")
+            stop_event.wait(EVICTION_INTERVAL if interval is None else interval)
+
+
+def main(argv=None):
+    load_dotenv()
+
+    common.check_environment_variables(['ICONIK_ID', 'ICONIK_TOKEN', 'B2_STORAGE_ID', 'LL_STORAGE_ID'])
+
+    parser = argparse.ArgumentParser(
+        description="Offload the least recently used assets from LucidLink to B2 when LucidLink fills up"
+    )
+    parser.add_argument("--capacity", type=str, required=True,
+                        help="space on LucidLink for the plugin's assets, in bytes, or with a K, M, G, T or P suffix")
+    parser.add_argument("--high", type=float, default=0.9,
+                        help="fraction of the capacity at which to start evicting")
+    parser.add_argument("--low", type=float, default=0.8,
+                        help="fraction of the capacity at which to stop evicting")
+    parser.add_argument("--interval", type=float, default=EVICTION_INTERVAL,
+                        help="seconds between eviction cycles")
+    parser.add_argument("--once", action="store_true",
+                        help="run a single eviction cycle and exit")
+    args = parser.parse_args(argv)
+
+    if not 0 < args.low <= args.high <= 1:
+        parser.error("--low and --high must be fractions, with --low no more than --high")
+    try:
+        capacity = parse_size(args.capacity)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    log = open_access_log()
+    if log is None:
+        parser.error("set EVICTION_STATE to a SQLite database URL, such as "
+                     "sqlite:////var/lib/b2-iconik-plugin/eviction.db")
+
+    format_names = [name.strip() for name in os.environ.get("FORMAT_NAMES", common.DEFAULT_FORMAT_NAMES).split(',')]
+    evictor = Evictor(Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"]), log, format_names,
+                      os.environ["B2_STORAGE_ID"], os.environ["LL_STORAGE_ID"],
+                      int(capacity * args.high), int(capacity * args.low))
+
+    if args.once:
+        return evictor.run_once()
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+    evictor.run(args.interval, stop_event)
+    return None
+
+
+if __name__ == "__main__":
+    main()
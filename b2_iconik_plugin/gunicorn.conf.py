@@ -29,6 +29,10 @@ workers = 4
 # Iconik jobs can take a long time to complete!
 timeout = 3600
 
+# On shutdown or reload, workers ask running actions to stop at their next chunk of assets, and hand the remaining
+# work on to the next generation of workers. This must be longer than DRAIN_TIMEOUT.
+graceful_timeout = 60
+
 # Use asynchronous workers via gevent
 worker_class = 'gevent'
 
@@ -45,3 +49,21 @@ capture_output = True
 
 # How verbose the Gunicorn error logs should be
 loglevel = "debug"
+
+
+# Set PROMETHEUS_MULTIPROC_DIR to an empty directory to aggregate /metrics across workers
+def child_exit(server, worker):  # noqa
+    from b2_iconik_plugin import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+# Hand unfinished actions on to the next generation of workers, whether the worker is stopping gracefully (SIGTERM,
+# SIGHUP) or quickly (SIGINT, SIGQUIT)
+def worker_int(worker):  # noqa
+    from b2_iconik_plugin import scheduler, workqueue
+    scheduler.drain_all(handoff=workqueue.open_handoff_queue())
+
+
+def worker_exit(server, worker):  # noqa
+    from b2_iconik_plugin import scheduler, workqueue
+    scheduler.drain_all(handoff=workqueue.open_handoff_queue())
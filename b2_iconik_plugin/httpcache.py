@@ -0,0 +1,304 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A cache of iconik GET responses, so that the listings, formats and file sets
+that an action reads more than once are only fetched once.
+
+Responses are kept in memory, evicting the least recently used, and, if
+ICONIK_CACHE_DIR is set, in a SQLite database in that directory, so that
+they outlive the process and are shared by the subprocesses that perform
+actions. Each response is cached for a time that depends on its endpoint;
+job status, custom actions and the delete queue are never cached. A write
+to iconik forgets the cached responses for the resource it changes, before
+it is sent and again once it completes, both in this process's memory and
+on disk. Other processes keep serving the copies in their own memory until
+those expire.
+
+Once a response expires, it is kept for up to ICONIK_CACHE_MAX_STALE
+seconds longer. If iconik sent an ETag or Last-Modified header with it, the
+next request for it is conditional, and a 304 Not Modified reply, which has
+no body, renews the cached response.
+
+The cache is off unless ICONIK_CACHE_ENTRIES is set:
+
+    ICONIK_CACHE_ENTRIES=10000               Responses kept in memory
+    ICONIK_CACHE_DIR=/var/cache/b2-iconik    Also keep them on disk
+    ICONIK_CACHE_TTL=60                      Default seconds to cache a response
+    ICONIK_CACHE_LONG_TTL=600                Seconds to cache storages, the user and settings
+    ICONIK_CACHE_MAX_STALE=86400             Seconds to keep expired responses for revalidation
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from b2_iconik_plugin import metrics, sqlitedb
+
+# Number of responses kept in memory; 0 disables the cache
+CACHE_ENTRIES = int(os.environ.get("ICONIK_CACHE_ENTRIES", "0"))
+
+# Directory for the on-disk cache; empty for memory only
+CACHE_DIR = os.environ.get("ICONIK_CACHE_DIR", "")
+
+# Seconds to cache a response from an endpoint that isn't in ENDPOINT_TTLS
+DEFAULT_TTL = float(os.environ.get("ICONIK_CACHE_TTL", "60"))
+
+# Seconds to cache a response from an endpoint whose responses rarely change
+LONG_TTL = float(os.environ.get("ICONIK_CACHE_LONG_TTL", "600"))
+
+# Seconds to keep a response after it expires, so that it can be revalidated with a conditional request
+MAX_STALE = float(os.environ.get("ICONIK_CACHE_MAX_STALE", "86400"))
+
+# Seconds to cache responses, by endpoint name as reported by metrics.endpoint_name. The first match wins
+ENDPOINT_TTLS = [
+    # Polled for changes, or changed by other clients
+    (re.compile(r"^/API/jobs/"), 0),
+    (re.compile(r"/custom_actions/"), 0),
+    (re.compile(r"/delete_queue/"), 0),
+    # Rarely change
+    (re.compile(r"^/API/files/v1/storages/\{id\}/$"), LONG_TTL),
+    (re.compile(r"^/API/users/v1/users/current/$"), LONG_TTL),
+    (re.compile(r"^/API/settings/v1/system/current/$"), LONG_TTL),
+]
+
+# Only these responses are cached; a 404 tells us, for example, that an asset doesn't have a format
+CACHEABLE_STATUS_CODES = (200, 404)
+
+# Response headers kept with the cached body
+CACHED_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+DB_FILENAME = "iconik-responses.db"
+
+# Every so many writes to the on-disk cache, entries too stale to revalidate are removed
+PRUNE_INTERVAL = 1000
+
+UUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache():
+    """
+    Returns:
+        This process's cache, as configured by the environment, or None if
+        caching is off
+    """
+    global _shared_cache
+    if not CACHE_ENTRIES:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache(CACHE_ENTRIES, CACHE_DIR or None)
+        return _shared_cache
+
+
+def ttl_for(url):
+    endpoint = metrics.endpoint_name(url)
+    for pattern, ttl in ENDPOINT_TTLS:
+        if pattern.search(endpoint):
+            return ttl
+    return DEFAULT_TTL
+
+
+def make_key(url, params, auth_token):
+    """
+    Args:
+        url (str): The request URL
+        params (dict): Optional query parameters
+        auth_token (str): The token the request is sent with, since different
+                          users may see different responses
+    Returns:
+        A cache key
+    """
+    token_hash = hashlib.sha256((auth_token or "").encode()).hexdigest()[:16]
+    query = json.dumps(sorted((params or {}).items()), default=str)
+    return f"{token_hash} {url} {query}"
+
+
+def invalidation_prefix(url):
+    """
+    Returns:
+        The URL of the resource that a write to url changes: everything up to
+        and including its first id, or the URL itself if it has none
+    """
+    match = UUID_PATTERN.search(url)
+    return url[:match.end()] + "/" if match else url.split("?", 1)[0]
+
+
+class CachedResponse:
+    """A cached response; small and picklable, unlike requests.Response"""
+
+    __slots__ = ("url", "status_code", "headers", "body", "expires")
+
+    def __init__(self, url, status_code, headers, body, expires):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+
+    @classmethod
+    def from_response(cls, response, ttl, clock=time.time):
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        return cls(response.url, response.status_code, headers, response.content, clock() + ttl)
+
+    def is_fresh(self, now):
+        return now < self.expires
+
+    def validators(self):
+        """
+        Returns:
+            Headers that make a request conditional on the response having
+            changed, or None if iconik didn't send any validators
+        """
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers or None
+
+    def revalidated(self, response, ttl, now):
+        """
+        Args:
+            response: A 304 Not Modified response to a conditional request
+        Returns:
+            A copy of this response, with any new validators, cached afresh
+        """
+        headers = dict(self.headers)
+        headers.update({name: response.headers[name] for name in ("ETag", "Last-Modified")
+                        if name in response.headers})
+        return CachedResponse(self.url, self.status_code, headers, self.body, now + ttl)
+
+    def to_response(self):
+        response = Response()
+        response.url = self.url
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        response.encoding = "utf-8"
+        return response
+
+
+class ResponseCache:
+    def __init__(self, max_entries, directory=None, clock=time.time):
+        """
+        Args:
+            max_entries (int): Number of responses kept in memory
+            directory (str): Optional directory for the on-disk cache
+            clock: Optional function returning the current time, for testing
+        """
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            path = os.path.join(directory, DB_FILENAME)
+            # Responses may hold anything the token can read
+            self._db = sqlitedb.connect(path, """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status_code INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    expires REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_url ON responses (url);
+            """)
+
+    def get(self, key, stale=False):
+        """
+        Args:
+            key (str): A key from make_key
+            stale (bool): Return expired responses that may be revalidated
+        Returns:
+            The cached response for key, or None if there is none or it has
+            expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db:
+                row = self._db.execute(
+                    "SELECT url, status_code, headers, body, expires FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    entry = CachedResponse(row[0], row[1], json.loads(row[2]), row[3], row[4])
+                    self._remember(key, entry)
+        if entry is None:
+            return None
+        now = self.clock()
+        if entry.is_fresh(now) or (stale and entry.validators() and now < entry.expires + MAX_STALE):
+            return entry
+        return None
+
+    def put(self, key, entry):
+        with self._lock:
+            self._remember(key, entry)
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, url, status_code, headers, body, expires) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, entry.url, entry.status_code, json.dumps(entry.headers), entry.body, entry.expires))
+                self._writes += 1
+                if self._writes % PRUNE_INTERVAL == 0:
+                    self._db.execute("DELETE FROM responses WHERE expires <= ?", (self.clock() - MAX_STALE,))
+
+    def invalidate(self, prefix):
+        """
+        Forget every cached response whose URL starts with prefix
+        """
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.url.startswith(prefix)]:
+                del self._entries[key]
+            if self._db:
+                # A range on the indexed column, rather than LIKE, which would need escaping
+                self._db.execute("DELETE FROM responses WHERE url >= ? AND url < ?", (prefix, prefix + "\uffff"))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db:
+                self._db.execute("DELETE FROM responses")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -20,16 +20,25 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from time import sleep
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from time import perf_counter, sleep, time
 
 from requests import Session
 
+from b2_iconik_plugin import httpcache, metrics, tracing
+from b2_iconik_plugin.ids import IdSet, IdSetBuilder
 from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.tenants import TokenBucket
 
 ASSET_OBJECT_TYPE = "assets"
 COLLECTION_OBJECT_TYPE = "collections"
 
-ICONIK_API_BASE = "https://app.iconik.io"
+# Override the API base to point the plugin at a local stand-in, such as the benchmark simulator
+ICONIK_API_BASE = os.environ.get("ICONIK_API_BASE", "https://app.iconik.io")
 ICONIK_ASSETS_API = ICONIK_API_BASE + "/API/assets/v1"
 ICONIK_FILES_API = ICONIK_API_BASE + "/API/files/v1"
 ICONIK_JOBS_API = ICONIK_API_BASE + "/API/jobs/v1"
@@ -48,7 +57,57 @@ DONE_STATUS_LIST = [
     "ABORTED"
 ]
 
+# Seconds between polls while waiting for a job to complete
+JOB_POLL_INTERVAL = float(os.environ.get("ICONIK_JOB_POLL_INTERVAL", "1"))
 
+# Whether /add checks which assets already have each format on LucidLink. The check expands
+# collections and reads each asset's format and file sets, around 2N+1 calls for N assets, so
+# by default collections are copied whole, with one bulk job per format
+CHECK_PRESENCE = os.environ.get("CHECK_PRESENCE", "false").lower() in ("true", "1", "yes")
+
+# Number of assets in each bulk copy that /remove submits. A failed batch is retried an
+# asset at a time, so a bad asset only holds back its own deletion
+REMOVE_BATCH_SIZE = int(os.environ.get("REMOVE_BATCH_SIZE", "50"))
+
+# Most B2 copy jobs that a single /remove keeps running at once
+REMOVE_MAX_JOBS = int(os.environ.get("REMOVE_MAX_JOBS", "8"))
+
+# Number of assets whose copies are verified at once before deleting from LucidLink
+VERIFY_CONCURRENCY = int(os.environ.get("VERIFY_CONCURRENCY", "8"))
+
+# How many times to retry a request that iconik throttled with 429 Too Many Requests
+MAX_THROTTLE_RETRIES = 5
+
+# Longest time to wait before retrying a throttled request, whatever Retry-After says
+MAX_RETRY_DELAY = float(os.environ.get("ICONIK_MAX_RETRY_DELAY", "60"))
+
+
+def retry_delay(retry_after, retries):
+    """
+    Args:
+        retry_after (str): The Retry-After header of a throttled response, as
+                           seconds or an HTTP date, or None
+        retries (int): The number of retries so far
+    Returns:
+        Seconds to wait before retrying, honoring Retry-After if it is valid,
+        otherwise backing off exponentially, and at most MAX_RETRY_DELAY
+    """
+    delay = 2 ** retries
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                delay = retry_at.timestamp() - time()
+            except (TypeError, ValueError):
+                pass
+    return min(max(delay, 0), MAX_RETRY_DELAY)
+
+
+@tracing.trace_methods
 class Iconik:
     """The iconik object implements just enough of the iconik API for the plugin to work
     """
@@ -71,17 +130,115 @@ class Iconik:
             "Auth-Token": auth_token
         })
 
-    def __request(self, method, url, json=None, params=None, raise_for_status=True):
+        # Listings read while planning an action, keyed by URL, so that executing
+        # the plan doesn't read them again. See planner.py
+        self.listings = {}
+        self.record_listings = False
+
+        # Number of HTTP requests sent to iconik, including retries
+        self.request_count = 0
+
+        # Limits the rate of requests to iconik, if set
+        self.rate_limiter = None
+
+        # Caches GET responses across clients in this process, if configured. See httpcache.py
+        self.cache = httpcache.shared_cache()
+
+        # Formats and file sets read while checking which assets need copying,
+        # so that each is read once per client. File sets are forgotten when
+        # one of the asset's file sets is deleted
+        self._formats = {}
+        self._asset_file_sets = {}
+
+    def __getstate__(self):
+        # Clients are pickled with queued actions and for subprocesses; the cache belongs to the process
+        state = self.__dict__.copy()
+        state["cache"] = None
+        # Rate limiters are shared by the process's jobs, and given to subprocesses explicitly
+        state["rate_limiter"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cache = httpcache.shared_cache()
+
+    def __request(self, method, url, json=None, params=None, raise_for_status=True, headers=None):
         self.logger.log("DEBUG", {"method": method, "url": url, "json": json, "params": params})
-        response = self.session.request(method, url, json=json, params=params)
+        if self.cache is not None and method != 'GET':
+            self.cache.invalidate(httpcache.invalidation_prefix(url))
+            try:
+                return self.__send(method, url, json, params, raise_for_status, headers)
+            finally:
+                # A read that ran while the write was in flight may have cached the old response again
+                self.cache.invalidate(httpcache.invalidation_prefix(url))
+        return self.__send(method, url, json, params, raise_for_status, headers)
+
+    def __send(self, method, url, json, params, raise_for_status, headers):
+        endpoint = metrics.endpoint_name(url)
+        start_time = perf_counter()
+        with tracing.span(f"{method} {endpoint}", kind="client",
+                          **{"http.request.method": method, "url.full": url}) as span:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            response = self.session.request(method, url, json=json, params=params, headers=headers)
+            self.request_count += 1
+            retries = 0
+            while response.status_code == 429 and retries < MAX_THROTTLE_RETRIES:
+                delay = retry_delay(response.headers.get("Retry-After"), retries)
+                self.logger.log("DEBUG", {"status_code": 429, "retry_in": delay})
+                metrics.ICONIK_RESPONSES.labels(method, endpoint, response.status_code).inc()
+                metrics.ICONIK_RETRIES.labels(method, endpoint).inc()
+                sleep(delay)
+                retries += 1
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                response = self.session.request(method, url, json=json, params=params, headers=headers)
+                self.request_count += 1
+            if span:
+                span.set_attribute("http.response.status_code", response.status_code)
+                span.set_attribute("http.request.resend_count", retries)
+        metrics.ICONIK_REQUEST_LATENCY.labels(method, endpoint).observe(perf_counter() - start_time)
+        metrics.ICONIK_RESPONSES.labels(method, endpoint, response.status_code).inc()
         payload = response.json() if response.text else None
         self.logger.log("DEBUG", {"status_code": response.status_code, "payload": payload})
         if raise_for_status:
             response.raise_for_status()
         return response
 
+    def set_rate_limit(self, rate):
+        """
+        Args:
+            rate (float): Maximum requests per second, or None for no limit
+        """
+        self.rate_limiter = TokenBucket(rate) if rate else None
+
     def __get(self, url, params=None, raise_for_status=True):
-        return self.__request('GET', url, None, params, raise_for_status)
+        ttl = httpcache.ttl_for(url) if self.cache is not None else 0
+        if not ttl:
+            return self.__request('GET', url, None, params, raise_for_status)
+
+        key = httpcache.make_key(url, params, self.session.headers.get("Auth-Token"))
+        endpoint = metrics.endpoint_name(url)
+        cached = self.cache.get(key, stale=True)
+        if cached and cached.is_fresh(self.cache.clock()):
+            metrics.ICONIK_CACHE_LOOKUPS.labels(endpoint, "hit").inc()
+            response = cached.to_response()
+        else:
+            # Ask iconik to send the body only if it has changed since we cached it
+            validators = cached.validators() if cached else None
+            response = self.__request('GET', url, None, params, False, headers=validators)
+            if validators and response.status_code == 304:
+                metrics.ICONIK_CACHE_LOOKUPS.labels(endpoint, "revalidated").inc()
+                cached = cached.revalidated(response, ttl, self.cache.clock())
+                self.cache.put(key, cached)
+                response = cached.to_response()
+            else:
+                metrics.ICONIK_CACHE_LOOKUPS.labels(endpoint, "miss").inc()
+                if response.status_code in httpcache.CACHEABLE_STATUS_CODES:
+                    self.cache.put(key, httpcache.CachedResponse.from_response(response, ttl, self.cache.clock))
+        if raise_for_status:
+            response.raise_for_status()
+        return response
 
     def __delete(self, url, params=None, raise_for_status=True):
         return self.__request('DELETE', url, None, params, raise_for_status)
@@ -92,6 +249,9 @@ class Iconik:
     def __patch(self, url, json=None, params=None, raise_for_status=True):
         return self.__request('PATCH', url, json, params, raise_for_status)
 
+    def __put(self, url, json=None, params=None, raise_for_status=True):
+        return self.__request('PUT', url, json, params, raise_for_status)
+
     def get_objects(self, first_url, params=None):
         """
         Gets a list of objects from the iconik API. GETs the first_url and then
@@ -102,18 +262,61 @@ class Iconik:
         Returns:
             A list of objects
         """
-        objects = []
-        url = first_url
-        while True:
-            response = self.__get(url, params=params).json()
-            objects.extend(response["objects"])
-            # Next URL is a path relative to ICONIK_API_BASE
-            url = ICONIK_API_BASE + response["next_url"] if response.get("next_url") else None
-            if not url:
-                break
+        if params is None and first_url in self.listings:
+            return list(self.listings[first_url])
 
+        objects = list(self.iter_objects(first_url, params))
+
+        if self.record_listings and params is None:
+            self.listings[first_url] = list(objects)
         return objects
 
+    def iter_objects(self, first_url, params=None, retry=None):
+        """
+        Like get_objects, but yields each object as its page arrives, rather
+        than reading every page before returning. Listings are not recorded.
+        Args:
+            first_url (str): The initial URL to GET
+            params: Parameters to pass down to the underlying get()
+            retry: Optional function that calls the function it is given,
+                   retrying it as it sees fit, through which each page is read
+        Returns:
+            A generator of objects
+        """
+        url = first_url
+        pages = 0
+        retry = retry or (lambda read_page: read_page())
+        try:
+            while url:
+                response = retry(lambda: self.__get(url, params=params).json())
+                pages += 1
+                yield from response["objects"]
+                # Next URL is a path relative to ICONIK_API_BASE
+                url = ICONIK_API_BASE + response["next_url"] if response.get("next_url") else None
+        finally:
+            metrics.PAGINATION_DEPTH.labels(metrics.endpoint_name(first_url)).observe(pages)
+
+    def forget_listings(self, prefix, suffix=""):
+        """
+        Discard recorded listings whose URL starts with the given prefix and
+        ends with the given suffix, since they no longer reflect what is in iconik.
+        Cached responses under the prefix are discarded too
+        """
+        # Iterate over a snapshot, and tolerate URLs that are already gone, in
+        # case another thread is forgetting listings too
+        for url in [url for url in list(self.listings) if url.startswith(prefix) and url.endswith(suffix)]:
+            self.listings.pop(url, None)
+        if self.cache is not None:
+            self.cache.invalidate(prefix)
+
+    def forget_presence(self):
+        """
+        Discard the formats and file sets read while checking which assets
+        need copying, for a client that is used for more than one action
+        """
+        self._formats = {}
+        self._asset_file_sets = {}
+
     def get_storage(self, id_=None, name=None):
         """
         Get a storage from its name or id. Note - if there are multiple storages
@@ -179,11 +382,21 @@ class Iconik:
         Returns:
             A format
         """
-        response = self.__get(f"{ICONIK_FILES_API}/assets/{asset_id}/formats/{name}/", raise_for_status=False)
+        url = f"{ICONIK_FILES_API}/assets/{asset_id}/formats/{name}/"
+        if url in self.listings:
+            return self.listings[url]
+        if url in self._formats:
+            return self._formats[url]
+        response = self.__get(url, raise_for_status=False)
         if response.status_code == 404:
-            return None
-        response.raise_for_status()
-        return response.json()
+            format_ = None
+        else:
+            response.raise_for_status()
+            format_ = response.json()
+        self._formats[url] = format_
+        if self.record_listings:
+            self.listings[url] = format_
+        return format_
 
     def get_file_sets(self, asset_id, format_id, storage_id):
         """
@@ -207,6 +420,32 @@ class Iconik:
         """
         self.__delete(f"{ICONIK_FILES_API}/assets/{asset_id}/file_sets/{file_set_id}/")
         self.__delete(f"{ICONIK_FILES_API}/assets/{asset_id}/file_sets/{file_set_id}/purge/")
+        self.forget_listings(f"{ICONIK_FILES_API}/assets/{asset_id}/formats/", "/file_sets/")
+        self.forget_listings(f"{ICONIK_FILES_API}/assets/{asset_id}/file_sets/")
+        self._asset_file_sets.pop(asset_id, None)
+
+    def is_present(self, asset_id, format_name, storage_id):
+        """
+        Check whether an asset already has a file set of a format on a storage.
+        An asset without the format is treated as present, since there is
+        nothing to copy.
+        Args:
+            asset_id (str): The asset id
+            format_name (str): The format name
+            storage_id (str): The storage id
+        Returns:
+            True if there is nothing to copy
+        """
+        format_obj = self.get_format(asset_id, format_name)
+        if not format_obj:
+            return True
+        if asset_id not in self._asset_file_sets:
+            # One listing covers every format and storage
+            self._asset_file_sets[asset_id] = self.get_asset_file_sets(asset_id)
+        return any(file_set.get("format_id") == format_obj["id"]
+                   and file_set.get("storage_id") == storage_id
+                   and file_set.get("status") != "DELETED"
+                   for file_set in self._asset_file_sets[asset_id])
 
     def delete_asset_files(self, asset_id, format_names, storage_id):
         """
@@ -220,6 +459,9 @@ class Iconik:
             # Don't want to shadow the format built-in name
             format_obj = self.get_format(asset_id, format_name)
             if format_obj:
+                # Delete the file sets that are there now, not those in a listing recorded by a plan
+                self.forget_listings(
+                    f"{ICONIK_FILES_API}/assets/{asset_id}/formats/{format_obj['id']}/storages/{storage_id}/file_sets/")
                 file_sets = self.get_file_sets(asset_id, format_obj["id"], storage_id)
                 if file_sets:
                     for file_set in file_sets:
@@ -255,6 +497,36 @@ class Iconik:
         for collection_id in request["collection_ids"]:
             self.delete_collection_files(collection_id, format_names, storage_id)
 
+    def get_request_asset_ids(self, request, visited=None):
+        """
+        List the unique assets that a custom action request refers to, directly
+        or via collections and their subcollections
+        Args:
+            request (dict): A request containing a list of asset ids and/or
+                            a list of collection ids
+            visited (IdSetBuilder): Optional set to which the ids of the
+                                    collections that were read are added
+        Returns:
+            An IdSet of asset ids, in the order they were found
+        """
+        asset_ids = IdSetBuilder()
+        asset_ids.update(request.get("asset_ids") or [])
+        visited = IdSetBuilder() if visited is None else visited
+
+        def expand_collection(collection_id):
+            if not visited.add(collection_id):
+                return
+            for obj in self.get_collection_contents(collection_id, [COLLECTION_OBJECT_TYPE, ASSET_OBJECT_TYPE]):
+                if obj["object_type"] == COLLECTION_OBJECT_TYPE:
+                    expand_collection(obj["id"])
+                elif obj["object_type"] == ASSET_OBJECT_TYPE:
+                    asset_ids.add(obj["id"])
+
+        for collection_id in request.get("collection_ids") or []:
+            expand_collection(collection_id)
+
+        return asset_ids.build()
+
     @staticmethod
     def job_succeeded(job):
         return job["status"] in SUCCESS_STATUS_LIST
@@ -263,65 +535,280 @@ class Iconik:
     def job_done(job):
         return job["status"] in DONE_STATUS_LIST
 
-    def copy_files(self, request, format_names, target_storage_id, sync=False):
+    def copy_files(self, request, format_names, target_storage_id, sync=False, check_presence=True):
         """
-        Copy files of a given format to a storage for a custom action request
+        Copy files of the given formats to a storage for a custom action
+        request. When checking presence, collections are expanded to their
+        assets, and assets that already have the format on the storage are
+        left out, so nothing is submitted when every asset is already there.
+        Otherwise the request's assets and collections are submitted as they
+        are.
         Args:
             request (dict): A request containing a list of asset ids and/or
                             a list of collection ids
             format_names (list of str): The format names
             target_storage_id (str): The target storage id
-            sync (bool):
+            sync (bool): Wait for the copy jobs to complete
+            check_presence (bool): Leave out assets already on the storage
+        Returns:
+            False if any copy job failed
         """
         job_ids = []
 
-        for format_name in format_names:
-            job_ids.extend(self.copy_files_for_format(request, format_name, target_storage_id))
+        if check_presence:
+            asset_ids = self.get_request_asset_ids(request)
+            for format_name in format_names:
+                missing = IdSet(asset_id for asset_id in asset_ids
+                                if not self.is_present(asset_id, format_name, target_storage_id))
+                if missing:
+                    job_ids.append(self.copy_assets(missing, format_name, target_storage_id))
+        else:
+            for format_name in format_names:
+                job_ids.extend(self.copy_files_for_format(request, format_name, target_storage_id))
 
         if sync:
             # Wait for jobs to complete
             for job_id in job_ids:
+                start_time = perf_counter()
                 while True:
-                    sleep(1)
-                    response = self.__get(f"{ICONIK_JOBS_API}/jobs/{job_id}/")
-                    job = response.json()
+                    sleep(JOB_POLL_INTERVAL)
+                    job = self.get_job(job_id)
                     if self.job_done(job):
                         break
+                metrics.JOB_WAIT.labels(job["status"]).observe(perf_counter() - start_time)
                 if not self.job_succeeded(job):
                     return False
 
         return True
 
     def copy_files_for_format(self, request, format_name, target_storage_id):
+        """
+        Submit bulk copies of a format of a request's assets and collections,
+        without expanding the collections
+        Returns:
+            The ids of the copy jobs
+        """
         job_ids = []
-        if request.get("asset_ids") and len(request["asset_ids"]) > 0:
-            payload = {
-                "object_ids": request["asset_ids"],
-                "object_type": "assets",
-                "format_name": format_name
-            }
-            response = self.__post(f"{ICONIK_FILES_API}/storages/{target_storage_id}/bulk/",
-                                   json=payload)
-            job_ids.append(response.json()["job_id"])
-        if request.get("collection_ids") and len(request["collection_ids"]) > 0:
-            payload = {
-                "object_ids": request["collection_ids"],
-                "object_type": "collections",
-                "format_name": format_name
-            }
-
-            response = self.__post(f"{ICONIK_FILES_API}/storages/{target_storage_id}/bulk/",
-                                   json=payload)
-            job_ids.append(response.json()["job_id"])
+        if request.get("asset_ids"):
+            job_ids.append(self.copy_assets(request["asset_ids"], format_name, target_storage_id))
+        if request.get("collection_ids"):
+            job_ids.append(self.__bulk_copy(request["collection_ids"], COLLECTION_OBJECT_TYPE, format_name,
+                                            target_storage_id))
         return job_ids
 
+    def copy_assets(self, asset_ids, format_name, target_storage_id):
+        """
+        Submit a bulk copy of a format of the given assets to a storage
+        Args:
+            asset_ids (iterable of str): The asset ids
+            format_name (str): The format name
+            target_storage_id (str): The target storage id
+        Returns:
+            The id of the copy job
+        """
+        return self.__bulk_copy(asset_ids, ASSET_OBJECT_TYPE, format_name, target_storage_id)
+
+    def __bulk_copy(self, object_ids, object_type, format_name, target_storage_id):
+        payload = {
+            "object_ids": list(object_ids),
+            "object_type": object_type,
+            "format_name": format_name
+        }
+        response = self.__post(f"{ICONIK_FILES_API}/storages/{target_storage_id}/bulk/", json=payload)
+        return response.json()["job_id"]
+
+    def get_job(self, job_id):
+        return self.__get(f"{ICONIK_JOBS_API}/jobs/{job_id}/").json()
+
+    def remove_files(self, request, format_names, b2_storage_id, ll_storage_id, batch_size=None):
+        """
+        Copy the first format of a custom action request's assets to B2, and
+        delete all the given formats from LucidLink. See remove_assets
+        Args:
+            request (dict): A request containing a list of asset ids and/or
+                            a list of collection ids
+            format_names (list of str): The format names
+            b2_storage_id (str): The B2 storage id
+            ll_storage_id (str): The LucidLink storage id
+            batch_size (int): Optional number of assets per bulk copy
+        Returns:
+            True if every asset was copied and its files deleted
+        """
+        failed, _remaining = self.remove_assets(self.get_request_asset_ids(request), format_names,
+                                                b2_storage_id, ll_storage_id, batch_size)
+        return not failed
+
+    def remove_assets(self, asset_ids, format_names, b2_storage_id, ll_storage_id, batch_size=None,
+                      should_yield=None):
+        """
+        Copy the first format of the given assets to B2, and delete all the
+        given formats from LucidLink. The assets are taken a batch at a time:
+        those whose first format is already in B2 are deleted straight away,
+        and the rest are copied, with up to REMOVE_MAX_JOBS copy jobs running
+        and the next batch taken as soon as one finishes, so a slow job holds
+        back only its own batch. Each batch's files are deleted as soon as its
+        copy job succeeds. When a batch fails, its assets are copied again one
+        at a time, so only the assets that can't be copied keep their files on
+        LucidLink. Either way, an asset's files are only deleted once
+        verify_copies confirms that B2 holds a complete copy.
+        Args:
+            asset_ids (IdSet): The asset ids
+            format_names (list of str): The format names
+            b2_storage_id (str): The B2 storage id
+            ll_storage_id (str): The LucidLink storage id
+            batch_size (int): Optional number of assets per bulk copy
+            should_yield (callable): Optional function that returns True
+                                     when no more batches should be taken.
+                                     Running copy jobs are seen through first
+        Returns:
+            A tuple of (IdSet of the assets that were taken but couldn't be
+            copied or verified, so kept their files, IdSet of the assets that
+            weren't taken)
+        """
+        batch_size = batch_size or REMOVE_BATCH_SIZE
+        asset_ids = asset_ids if isinstance(asset_ids, IdSet) else IdSet(asset_ids)
+
+        # Job id -> (asset ids, time submitted)
+        pending = {}
+        # Assets to copy again one at a time, after their batch failed
+        retries = deque()
+        failed = IdSetBuilder()
+
+        def submit(batch):
+            pending[self.copy_assets(batch, format_names[0], b2_storage_id)] = (batch, perf_counter())
+
+        def verify_and_delete(batch):
+            verified = self.verify_copies(batch, format_names[0], ll_storage_id, b2_storage_id)
+            for asset_id in batch:
+                if asset_id in verified:
+                    self.delete_asset_files(asset_id, format_names, ll_storage_id)
+                else:
+                    self.logger.log("ERROR", {"asset_id": asset_id, "error": "Copy in B2 is incomplete"})
+                    failed.add(asset_id)
+
+        def take_batch(start):
+            # Assets that are already in B2 don't need to wait for a copy
+            batch = asset_ids[start:start + batch_size]
+            present = IdSetBuilder()
+            missing = IdSetBuilder()
+            for asset_id in batch:
+                if self.is_present(asset_id, format_names[0], b2_storage_id):
+                    present.add(asset_id)
+                else:
+                    missing.add(asset_id)
+            missing = missing.build()
+            if missing:
+                submit(missing)
+            verify_and_delete(present.build())
+
+        taken = 0
+        while True:
+            yielding = taken > 0 and should_yield is not None and should_yield()
+            while not yielding and len(pending) < REMOVE_MAX_JOBS and (retries or taken < len(asset_ids)):
+                if retries:
+                    submit(retries.popleft())
+                else:
+                    take_batch(taken)
+                    taken += batch_size
+            if not pending:
+                break
+
+            sleep(JOB_POLL_INTERVAL)
+            for job_id in list(pending):
+                job = self.get_job(job_id)
+                if not self.job_done(job):
+                    continue
+                batch, start_time = pending.pop(job_id)
+                metrics.JOB_WAIT.labels(job["status"]).observe(perf_counter() - start_time)
+                if self.job_succeeded(job):
+                    verify_and_delete(batch)
+                elif len(batch) > 1:
+                    self.logger.log("WARNING", {"job_id": job_id, "status": job["status"],
+                                                "retrying_assets": len(batch)})
+                    retries.extend([asset_id] for asset_id in batch)
+                else:
+                    self.logger.log("ERROR", {"job_id": job_id, "status": job["status"], "asset_id": batch[0]})
+                    failed.add(batch[0])
+
+        remaining = IdSet([asset_id for batch in retries for asset_id in batch] + list(asset_ids[taken:]))
+        return failed.build(), remaining
+
+    def verify_copies(self, asset_ids, format_name, source_storage_id, target_storage_id):
+        """
+        Check that a storage holds complete copies of a format of the given
+        assets, reading the assets' file listings concurrently
+        Args:
+            asset_ids (list of str): The asset ids
+            format_name (str): The format name
+            source_storage_id (str): The storage that was copied from
+            target_storage_id (str): The storage that was copied to
+        Returns:
+            The set of asset ids whose copies are complete
+        """
+        if not asset_ids:
+            return set()
+        # The listings must reflect the copies. Forget recorded ones here, rather than in
+        # each thread, so that the threads only read the client's shared state
+        for asset_id in asset_ids:
+            self.forget_listings(f"{ICONIK_FILES_API}/assets/{asset_id}/files/")
+        with ThreadPoolExecutor(max_workers=min(VERIFY_CONCURRENCY, len(asset_ids))) as executor:
+            results = executor.map(
+                tracing.propagated(
+                    lambda asset_id: self.is_copy_complete(asset_id, format_name, source_storage_id,
+                                                           target_storage_id, fresh=False)),
+                asset_ids)
+            return {asset_id for asset_id, complete in zip(asset_ids, results) if complete}
+
+    def is_copy_complete(self, asset_id, format_name, source_storage_id, target_storage_id, fresh=True):
+        """
+        Compare an asset's files of a format on two storages. The copy is
+        complete if every source file has a closed file on the target storage
+        at the same path, with the same size and, where iconik reports
+        checksums for both, the same checksum.
+        Args:
+            asset_id (str): The asset id
+            format_name (str): The format name
+            source_storage_id (str): The storage that was copied from
+            target_storage_id (str): The storage that was copied to
+            fresh (bool): Forget any recorded listing of the asset's files
+                          first; the caller may have done so already
+        Returns:
+            True if the copy is complete
+        """
+        format_obj = self.get_format(asset_id, format_name)
+        if not format_obj:
+            # Nothing to copy
+            return True
+
+        # A single listing covers both storages. It must reflect the copy, so
+        # don't use one recorded before it
+        if fresh:
+            self.forget_listings(f"{ICONIK_FILES_API}/assets/{asset_id}/files/")
+        files = [file for file in self.get_asset_files(asset_id) if file.get("format_id") == format_obj["id"]]
+        target_files = {}
+        for file in files:
+            if file.get("storage_id") == target_storage_id and file.get("status", "CLOSED") == "CLOSED":
+                target_files.setdefault((file.get("directory_path") or "", file.get("original_name")), []).append(file)
+
+        for file in files:
+            if file.get("storage_id") != source_storage_id:
+                continue
+            copies = target_files.get((file.get("directory_path") or "", file.get("original_name")), [])
+            if not any(copy.get("size") == file.get("size")
+                       and (not copy.get("checksum") or not file.get("checksum")
+                            or copy.get("checksum") == file.get("checksum"))
+                       for copy in copies):
+                return False
+        return True
+
     def delete_action(self, action):
         return self.__delete(
             f"{ICONIK_ASSETS_API}/custom_actions/{action['context']}/{action['id']}"
         )
 
-    def add_action(self, context, app_id, url, title, shared_secret):
-        action = {
+    @staticmethod
+    def __custom_action(context, app_id, url, title, shared_secret):
+        return {
             "type": "POST",
             "context": context,
             "title": title,
@@ -331,9 +818,22 @@ class Iconik:
             },
             "app_id": app_id
         }
+
+    def add_action(self, context, app_id, url, title, shared_secret):
         return self.__post(
             f"{ICONIK_ASSETS_API}/custom_actions/{context}/",
-            json=action
+            json=self.__custom_action(context, app_id, url, title, shared_secret)
+        ).json()
+
+    def update_action(self, action, app_id, url, title, shared_secret):
+        """
+        Replace an existing custom action's URL, title and secret
+        Args:
+            action (dict): The existing action, as returned by get_custom_actions
+        """
+        return self.__put(
+            f"{ICONIK_ASSETS_API}/custom_actions/{action['context']}/{action['id']}/",
+            json=self.__custom_action(action['context'], app_id, url, title, shared_secret)
         ).json()
 
     def create_asset(self, title, type_, collection_id=None, apply_default_acls=True):
@@ -397,6 +897,16 @@ class Iconik:
     def get_asset_file_sets(self, asset_id):
         return self.get_objects(f"{ICONIK_FILES_API}/assets/{asset_id}/file_sets/")
 
+    def get_asset_files(self, asset_id):
+        """
+        Get all of an asset's files, across all formats and storages
+        Args:
+            asset_id (str): The asset id
+        Returns:
+            A list of files
+        """
+        return self.get_objects(f"{ICONIK_FILES_API}/assets/{asset_id}/files/")
+
     def create_file(self, asset_id, original_name, size, type_, storage_id, file_set_id, format_id, directory_path=""):
         """
         Create file and associate to asset
@@ -485,6 +995,9 @@ class Iconik:
     def get_deleted_objects(self):
         return self.get_objects(f"{ICONIK_ASSETS_API}/delete_queue/assets/")
 
+    def iter_deleted_objects(self):
+        yield from self.iter_objects(f"{ICONIK_ASSETS_API}/delete_queue/assets/")
+
     def purge_assets_from_delete_queue(self, asset_ids):
         assets = {
             "ids" : asset_ids
@@ -502,3 +1015,6 @@ class Iconik:
 
     def get_custom_actions(self):
         return self.get_objects(f"{ICONIK_ASSETS_API}/custom_actions/")
+
+    def iter_custom_actions(self, retry=None):
+        yield from self.iter_objects(f"{ICONIK_ASSETS_API}/custom_actions/", retry=retry)
@@ -0,0 +1,227 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Compact storage for the iconik ids in large custom action requests.
+
+iconik ids are UUIDs. As Python strings, each costs around 85 bytes, plus 8
+for its slot in a list; an IdSet stores each id in 16 bytes of a single
+buffer, converting to and from strings only at its edges.
+"""
+
+import uuid
+from bisect import bisect_left
+
+ID_BYTES = 16
+
+
+def id_bytes(id_):
+    """
+    Returns:
+        The 16 bytes of a UUID string
+    Raises:
+        ValueError if the id is not a UUID
+    """
+    if not isinstance(id_, str):
+        raise ValueError(f"Invalid id: {id_!r}")
+    return uuid.UUID(id_).bytes
+
+
+def id_string(data):
+    """
+    Returns:
+        The canonical string form of a 16-byte UUID
+    """
+    h = data.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+class IdSet:
+    """
+    An immutable, ordered set of UUID strings, stored as 16 bytes each.
+    Duplicates are dropped, keeping the first occurrence. Membership tests
+    use binary search over a sorted copy of the buffer, made on first use.
+    """
+    __slots__ = ("_data", "_sorted")
+
+    def __init__(self, ids=()):
+        """
+        Args:
+            ids: Iterable of UUID strings
+        Raises:
+            ValueError if any of the ids is not a UUID
+        """
+        builder = IdSetBuilder()
+        builder.update(ids)
+        self._data = bytes(builder.data())
+        self._sorted = None
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Returns:
+            An IdSet over a buffer of distinct 16-byte UUIDs
+        """
+        if len(data) % ID_BYTES:
+            raise ValueError(f"Buffer length {len(data)} is not a multiple of {ID_BYTES}")
+        id_set = cls.__new__(cls)
+        id_set._data = bytes(data)
+        id_set._sorted = None
+        return id_set
+
+    def to_bytes(self):
+        return self._data
+
+    def to_list(self):
+        """
+        Returns:
+            The ids as a list of strings, for sending to an HTTP API
+        """
+        return list(self)
+
+    def keys(self):
+        """
+        Yields:
+            The ids as 16-byte UUIDs
+        """
+        data = self._data
+        for offset in range(0, len(data), ID_BYTES):
+            yield data[offset:offset + ID_BYTES]
+
+    def __len__(self):
+        return len(self._data) // ID_BYTES
+
+    def __iter__(self):
+        data = self._data
+        for offset in range(0, len(data), ID_BYTES):
+            yield id_string(data[offset:offset + ID_BYTES])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("IdSet slices must be contiguous")
+            return IdSet.from_bytes(self._data[start * ID_BYTES:max(start, stop) * ID_BYTES])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("IdSet index out of range")
+        return id_string(self._data[index * ID_BYTES:(index + 1) * ID_BYTES])
+
+    def __contains__(self, id_):
+        try:
+            key = id_bytes(id_)
+        except ValueError:
+            return False
+        if self._sorted is None:
+            self._sorted = b"".join(sorted(self.keys()))
+        return self._sorted_index(key) is not None
+
+    def _sorted_index(self, key):
+        keys = _SortedKeys(self._sorted)
+        index = bisect_left(keys, key)
+        return index if index < len(keys) and keys[index] == key else None
+
+    def __eq__(self, other):
+        if isinstance(other, IdSet):
+            return self._data == other._data
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._data)
+
+    def __reduce__(self):
+        return IdSet.from_bytes, (self._data,)
+
+    def __repr__(self):
+        return f"IdSet({self.to_list()!r})"
+
+
+class IdSetBuilder:
+    """
+    Collects distinct ids, in the order they are added, for an IdSet. Each id
+    is kept once as 16 bytes in the buffer, and once as a 16-byte key in a
+    set for hashed membership tests. Also serves as a compact visited set.
+    """
+    __slots__ = ("_data", "_seen")
+
+    def __init__(self):
+        self._data = bytearray()
+        self._seen = set()
+
+    def add(self, id_):
+        """
+        Returns:
+            True if the id had not already been added
+        Raises:
+            ValueError if the id is not a UUID
+        """
+        return self._add_key(id_bytes(id_))
+
+    def _add_key(self, key):
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        self._data += key
+        return True
+
+    def update(self, ids):
+        if isinstance(ids, IdSet):
+            # Already in binary form
+            for key in ids.keys():
+                self._add_key(key)
+        else:
+            for id_ in ids:
+                self.add(id_)
+
+    def data(self):
+        return self._data
+
+    def build(self):
+        return IdSet.from_bytes(self._data)
+
+    def __contains__(self, id_):
+        try:
+            return id_bytes(id_) in self._seen
+        except ValueError:
+            return False
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class _SortedKeys:
+    """
+    A read-only sequence view of the 16-byte keys in a sorted buffer, for bisect
+    """
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __len__(self):
+        return len(self._data) // ID_BYTES
+
+    def __getitem__(self, index):
+        return self._data[index * ID_BYTES:(index + 1) * ID_BYTES]
@@ -21,6 +21,7 @@
 # SOFTWARE.
 import os
 
+from b2_iconik_plugin import tracing
 from b2_iconik_plugin.common import IconikHandler, SHARED_SECRET_NAME, DEFAULT_FORMAT_NAMES
 from b2_iconik_plugin.gcp import GcpLogger, get_project_id, get_secret
 
@@ -50,6 +51,7 @@ def gcp_iconik_handler(req):
         Response object using `make_response`
         <http://flask.pocoo.org/docs/1.0/api/#flask.Flask.make_response>.
     """
+    tracing.configure()
     project_id = get_project_id()
     format_names = os.environ.get("FORMAT_NAMES", DEFAULT_FORMAT_NAMES).split(',')
     handler = IconikHandler(GcpLogger(project_id), get_secret(project_id, SHARED_SECRET_NAME),
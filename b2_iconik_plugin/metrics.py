@@ -0,0 +1,185 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Prometheus metrics for the plugin and its iconik client.
+
+When the plugin runs under Gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty,
+writable directory so that the counters from every worker process, and from
+the subprocesses that perform the actions, are aggregated by /metrics. See
+https://prometheus.github.io/client_python/multiprocess/
+"""
+
+import os
+import re
+from urllib.parse import urlparse
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+
+PROMETHEUS_MULTIPROC_DIR = "PROMETHEUS_MULTIPROC_DIR"
+
+OPERATIONS = ["/add", "/remove"]
+
+UUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+# iconik calls take tens of milliseconds; actions can take hours
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+ACTION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0)
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+HANDLER_LATENCY = Histogram(
+    "b2_iconik_plugin_handler_seconds",
+    "Time to validate a custom action request and hand it off for processing",
+    ["operation", "status_code"],
+    buckets=REQUEST_BUCKETS)
+
+PROCESS_LATENCY = Histogram(
+    "b2_iconik_plugin_process_seconds",
+    "Time to copy and/or delete the files for a custom action",
+    ["action"],
+    buckets=ACTION_BUCKETS)
+
+ICONIK_REQUEST_LATENCY = Histogram(
+    "b2_iconik_plugin_iconik_request_seconds",
+    "Latency of iconik API calls, including any retries",
+    ["method", "endpoint"],
+    buckets=REQUEST_BUCKETS)
+
+ICONIK_RESPONSES = Counter(
+    "b2_iconik_plugin_iconik_responses",
+    "iconik API responses by status code",
+    ["method", "endpoint", "status_code"])
+
+ICONIK_RETRIES = Counter(
+    "b2_iconik_plugin_iconik_retries",
+    "iconik API calls retried after being throttled",
+    ["method", "endpoint"])
+
+ICONIK_CACHE_LOOKUPS = Counter(
+    "b2_iconik_plugin_iconik_cache_lookups",
+    "iconik GET requests looked up in the response cache, by result",
+    ["endpoint", "result"])
+
+PAGINATION_DEPTH = Histogram(
+    "b2_iconik_plugin_iconik_pages",
+    "Number of pages read from a paginated iconik listing",
+    ["endpoint"],
+    buckets=PAGE_BUCKETS)
+
+JOB_WAIT = Histogram(
+    "b2_iconik_plugin_job_wait_seconds",
+    "Time spent waiting for iconik jobs to complete",
+    ["status"],
+    buckets=ACTION_BUCKETS)
+
+QUEUE_DEPTH = Gauge(
+    "b2_iconik_plugin_queue_depth",
+    "Actions accepted but not yet complete",
+    multiprocess_mode="livesum")
+
+ACTIONS_IN_PROGRESS = Gauge(
+    "b2_iconik_plugin_actions_in_progress",
+    "Actions currently copying and/or deleting files",
+    multiprocess_mode="livesum")
+
+SCHEDULED_ACTIONS = Counter(
+    "b2_iconik_plugin_scheduled_actions",
+    "Actions, and remainders of preempted actions, queued by priority class",
+    ["priority"])
+
+PREEMPTIONS = Counter(
+    "b2_iconik_plugin_preemptions",
+    "Running actions asked to yield to higher priority actions, by priority class",
+    ["priority"])
+
+DEAD_ACTIONS = Counter(
+    "b2_iconik_plugin_dead_actions",
+    "Actions abandoned after their leases on the shared work queue expired WORK_QUEUE_MAX_ATTEMPTS times")
+
+ACTION_SLOTS = Gauge(
+    "b2_iconik_plugin_action_slots",
+    "Actions that may run at once; divide b2_iconik_plugin_actions_in_progress by this for saturation",
+    multiprocess_mode="livesum")
+
+AUTOSCALE_EVENTS = Counter(
+    "b2_iconik_plugin_autoscale_events",
+    "Changes in the number of action slots, by direction",
+    ["direction"])
+
+REQUESTS_IN_PROGRESS = Gauge(
+    "b2_iconik_plugin_requests_in_progress",
+    "HTTP requests currently being handled; divide by b2_iconik_plugin_workers for worker utilization",
+    multiprocess_mode="livesum")
+
+WORKERS = Gauge(
+    "b2_iconik_plugin_workers",
+    "Number of live worker processes serving HTTP requests",
+    multiprocess_mode="livesum")
+
+
+def endpoint_name(url):
+    """
+    Reduce an iconik API URL to a low-cardinality endpoint name by removing the
+    scheme, host and query, and replacing object ids with a placeholder
+    Args:
+        url (str): An iconik API URL
+    Returns:
+        An endpoint name, such as /API/files/v1/assets/{id}/file_sets/
+    """
+    return UUID_PATTERN.sub("{id}", urlparse(url).path)
+
+
+def operation_name(path):
+    """
+    Returns:
+        The request path if it is a plugin operation, otherwise "other", so that
+        stray requests cannot create unlimited label values
+    """
+    return path if path in OPERATIONS else "other"
+
+
+def is_multiprocess():
+    return bool(os.environ.get(PROMETHEUS_MULTIPROC_DIR))
+
+
+def mark_process_dead(pid):
+    """
+    Remove the live gauges of a worker or action subprocess that has exited
+    """
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
+def generate():
+    """
+    Render the current value of every metric, aggregated across processes if
+    PROMETHEUS_MULTIPROC_DIR is set
+    Returns:
+        A tuple of (body, content type)
+    """
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
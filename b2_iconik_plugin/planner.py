@@ -0,0 +1,265 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Dry-run planning for custom actions.
+
+A plan performs only the read traversal that an action would perform -
+collection contents, formats and file sets - and reports the bulk jobs that
+the action would submit, the file sets it would delete, the bytes involved,
+and an estimate of the number of iconik API calls.
+
+The listings that the planner reads are kept with the plan. If the same
+action is requested within PLAN_TTL seconds, it reuses those listings rather
+than reading them again. Plans are held in memory, so only an action handled
+by the same process as its dry run reuses them; under Gunicorn with several
+workers, or with more than one plugin node, the action is usually handled
+elsewhere and reads the listings afresh. That costs API calls but not
+correctness. Nor do stale listings: the file sets that an action deletes are
+always read again first, as are the files that verify a copy.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from b2_iconik_plugin.iconik import ASSET_OBJECT_TYPE, CHECK_PRESENCE, COLLECTION_OBJECT_TYPE, REMOVE_BATCH_SIZE
+from b2_iconik_plugin.ids import IdSet, IdSetBuilder
+
+# Seconds for which a plan's listings may be reused by the action that follows it
+PLAN_TTL = float(os.environ.get("PLAN_TTL", "60"))
+
+
+class Plan:
+    def __init__(self, action, format_names, copy_format_names, target_storage_id, delete_storage_id):
+        self.action = action
+        self.format_names = format_names
+        self.copy_format_names = copy_format_names
+        self.target_storage_id = target_storage_id
+        self.delete_storage_id = delete_storage_id
+        self.bulk_jobs = []
+        self.file_sets = []
+        self.asset_ids = IdSet()
+        self.collection_count = 0
+        self.copy_bytes = 0
+        self.delete_bytes = 0
+        # Calls that executing the action would make to read listings
+        self.listing_reads = 0
+        # Calls made while planning, including reading file sizes
+        self.planning_calls = 0
+        self.listings = {}
+        self.created = time.monotonic()
+
+    def estimated_calls(self):
+        """
+        Returns:
+            The number of iconik API calls, by type, that executing the plan
+            would make. Job polls are a lower bound, since jobs may take
+            several polls to complete.
+        """
+        calls = {
+            "bulk_posts": len(self.bulk_jobs),
+            # Only removal waits for its jobs to complete
+            "job_polls": len(self.bulk_jobs) if self.action == "remove" else 0,
+            "deletes": 2 * len(self.file_sets),
+            # Removal reads each asset's files to verify its copy before deleting
+            "verify_reads": len(self.asset_ids) if self.action == "remove" else 0,
+            "listing_reads": self.listing_reads,
+        }
+        calls["total"] = sum(calls.values())
+        return calls
+
+    def to_dict(self):
+        return {
+            "action": self.action,
+            "formats": self.format_names,
+            "target_storage_id": self.target_storage_id,
+            "delete_storage_id": self.delete_storage_id,
+            "assets": len(self.asset_ids),
+            "collections": self.collection_count,
+            "bulk_jobs": self.bulk_jobs,
+            "file_sets_to_delete": self.file_sets,
+            "copy_bytes": self.copy_bytes,
+            "delete_bytes": self.delete_bytes,
+            "estimated_api_calls": self.estimated_calls(),
+            "planning_api_calls": self.planning_calls,
+        }
+
+
+def format_bytes(files, format_id, exclude_storage_id):
+    """
+    Returns:
+        The size of the largest copy of a format that is not on the given storage
+    """
+    file_set_sizes = {}
+    for file in files:
+        if file.get("format_id") == format_id and file.get("storage_id") != exclude_storage_id:
+            file_set_id = file.get("file_set_id")
+            file_set_sizes[file_set_id] = file_set_sizes.get(file_set_id, 0) + (file.get("size") or 0)
+    return max(file_set_sizes.values(), default=0)
+
+
+def plan_action(iconik, request, format_names, b2_storage_id, ll_storage_id):
+    """
+    Plan a custom action without changing anything in iconik
+    Args:
+        iconik (Iconik): An iconik client for the request's auth token
+        request (dict): The custom action request, with "action" set to
+                        "add" or "remove"
+        format_names (list of str): The format names
+        b2_storage_id (str): The B2 storage id
+        ll_storage_id (str): The LucidLink storage id
+    Returns:
+        A Plan
+    """
+    if request["action"] == "add":
+        plan = Plan("add", format_names, format_names, ll_storage_id, None)
+    else:
+        plan = Plan("remove", format_names, [format_names[0]], b2_storage_id, ll_storage_id)
+
+    start_count = iconik.request_count
+    iconik.record_listings = True
+    try:
+        # The same traversal as Iconik.remove_files
+        visited = IdSetBuilder()
+        plan.asset_ids = iconik.get_request_asset_ids(request, visited)
+        plan.collection_count = len(visited)
+
+        # The assets that Iconik.copy_files and Iconik.remove_files would copy,
+        # skipping those that are already on the target storage if they check
+        check_presence = plan.action == "remove" or CHECK_PRESENCE
+        copy_asset_ids = {}
+        for format_name in plan.copy_format_names:
+            copy_asset_ids[format_name] = IdSet(
+                asset_id for asset_id in plan.asset_ids
+                if not (check_presence and iconik.is_present(asset_id, format_name, plan.target_storage_id)))
+
+        if not check_presence:
+            # The request's assets and collections, as they are, per format
+            for format_name in plan.copy_format_names:
+                for object_type, field in ((ASSET_OBJECT_TYPE, "asset_ids"),
+                                           (COLLECTION_OBJECT_TYPE, "collection_ids")):
+                    if request.get(field):
+                        plan.bulk_jobs.append({
+                            "storage_id": plan.target_storage_id,
+                            "object_type": object_type,
+                            "object_count": len(request[field]),
+                            "format_name": format_name
+                        })
+        else:
+            # One bulk job per format for /add, batches for /remove
+            batch_size = max(len(plan.asset_ids), 1) if plan.action == "add" else REMOVE_BATCH_SIZE
+            for format_name, asset_ids in copy_asset_ids.items():
+                for i in range(0, len(asset_ids), batch_size):
+                    plan.bulk_jobs.append({
+                        "storage_id": plan.target_storage_id,
+                        "object_type": ASSET_OBJECT_TYPE,
+                        "object_count": len(asset_ids[i:i + batch_size]),
+                        "format_name": format_name
+                    })
+
+        if plan.delete_storage_id:
+            for asset_id in plan.asset_ids:
+                for format_name in format_names:
+                    format_obj = iconik.get_format(asset_id, format_name)
+                    if format_obj:
+                        for file_set in iconik.get_file_sets(asset_id, format_obj["id"], plan.delete_storage_id):
+                            plan.file_sets.append({
+                                "asset_id": asset_id,
+                                "format_name": format_name,
+                                "file_set_id": file_set["id"]
+                            })
+
+        plan.listing_reads = iconik.request_count - start_count
+
+        # iconik reports sizes on files rather than file sets
+        deleted_file_set_ids = {file_set["file_set_id"] for file_set in plan.file_sets}
+        for asset_id in plan.asset_ids:
+            files = iconik.get_asset_files(asset_id)
+            for format_name, asset_ids in copy_asset_ids.items():
+                format_obj = iconik.get_format(asset_id, format_name) if asset_id in asset_ids else None
+                if format_obj:
+                    plan.copy_bytes += format_bytes(files, format_obj["id"], plan.target_storage_id)
+            plan.delete_bytes += sum(file.get("size") or 0 for file in files
+                                     if file.get("file_set_id") in deleted_file_set_ids)
+    finally:
+        iconik.record_listings = False
+
+    plan.planning_calls = iconik.request_count - start_count
+    plan.listings = dict(iconik.listings)
+    return plan
+
+
+def plan_key(request, format_names, b2_storage_id, ll_storage_id):
+    """
+    Returns:
+        A key that identifies an action, for matching it with its plan. The auth
+        token is included, hashed, so that one user's plan is never applied to
+        another user's action.
+    """
+    key = json.dumps([
+        request["action"],
+        hashlib.sha256((request.get("auth_token") or "").encode()).hexdigest(),
+        sorted(request.get("asset_ids") or []),
+        sorted(request.get("collection_ids") or []),
+        format_names,
+        b2_storage_id,
+        ll_storage_id
+    ])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class PlanCache:
+    """
+    Holds recent plans until the actions they describe are executed
+    """
+
+    def __init__(self, ttl=PLAN_TTL):
+        self._ttl = ttl
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def put(self, key, plan):
+        with self._lock:
+            self._expire()
+            self._plans[key] = plan
+
+    def take(self, key):
+        """
+        Returns:
+            The plan for the given key, if there is a fresh one, removing it
+            from the cache, or None
+        """
+        with self._lock:
+            self._expire()
+            return self._plans.pop(key, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [key for key, plan in self._plans.items() if now - plan.created > self._ttl]:
+            del self._plans[key]
+
+
+# Plans made by this process. Other workers and nodes can't see them
+plans = PlanCache()
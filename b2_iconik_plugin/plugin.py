@@ -30,12 +30,15 @@ import multiprocessing as mp
 
 # Never put credentials in your code!
 from dotenv import load_dotenv
-from flask import Flask, request as flask_request
+from flask import Flask, Response, abort, request as flask_request
 from flask_restx import Resource, Api
 
 import b2_iconik_plugin
-from b2_iconik_plugin.common import IconikHandler, DEFAULT_FORMAT_NAMES, check_environment_variables
+from b2_iconik_plugin import autoscaler, metrics, prefetch, profiling, scheduler, sync, tracing, workqueue
+from b2_iconik_plugin.common import IconikHandler, DEFAULT_FORMAT_NAMES, X_BZ_SHARED_SECRET, check_environment_variables
 from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.scheduler import EXECUTE_ACTIONS, Job, Scheduler
+from b2_iconik_plugin.tenants import TenantResolver
 
 dictConfig({
     'version': 1,
@@ -59,27 +62,117 @@ dictConfig({
 
 
 # target for Process must be in the global scope, since multiprocessing uses pickle
-def process_request(handler, request, iconik, b2_storage, ll_storage, format_names):
-    handler.do_process(request, iconik, b2_storage, ll_storage, format_names)
+def process_request(handler, request, iconik, b2_storage, ll_storage, format_names, yield_event=None, conn=None,
+                    rate_limiter=None):
+    # This is a fresh interpreter, so it needs its own exporter
+    tracing.configure()
+    handler.set_yield_event(yield_event)
+    if rate_limiter:
+        iconik.rate_limiter = rate_limiter
+    continuation = None
+    try:
+        continuation = handler.do_process(request, iconik, b2_storage, ll_storage, format_names)
+    finally:
+        if conn:
+            # Hand any remaining work back to the scheduler
+            conn.send(continuation)
+            conn.close()
+        # This subprocess is about to exit, so its live gauges no longer apply
+        metrics.mark_process_dead(os.getpid())
+        tracing.shutdown()
+
+
+class ProcessHandle:
+    """
+    A scheduled action running in a subprocess
+    """
+    def __init__(self, process, yield_event, conn):
+        self._process = process
+        self._yield_event = yield_event
+        self._conn = conn
+        self._continuation = None
+
+    def done(self):
+        # Read the result as soon as it is sent, so a large one can't block the subprocess
+        if self._conn and self._conn.poll():
+            try:
+                self._continuation = self._conn.recv()
+            except EOFError:
+                # The subprocess exited without sending a result
+                pass
+            self._conn.close()
+            self._conn = None
+        return not self._process.is_alive()
+
+    def preempt(self):
+        self._yield_event.set()
+
+    def terminate(self):
+        self._process.terminate()
+        self._process.join()
+        metrics.mark_process_dead(self._process.pid)
+
+    def continuation(self):
+        return self._continuation
+
+
+def spawn_runner(handler):
+    """
+    Returns:
+        A scheduler runner that processes each job in a subprocess
+    """
+    def run(job):
+        # We use the 'spawn' context to allow the subprocess to run after the request is handled
+        # See https://github.com/benoitc/gunicorn/issues/2322#issuecomment-619910669
+        ctx = mp.get_context('spawn')
+        yield_event = ctx.Event()
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        p = ctx.Process(
+            target=process_request,
+            args=(handler, job.request, *job.args, yield_event, child_conn, job.rate_limiter),
+        )
+        p.start()
+        child_conn.close()
+        return ProcessHandle(p, yield_event, parent_conn)
+    return run
 
 
 class FlaskIconikHandler(IconikHandler):
     """
-    Process the request in a subprocess
+    Process the request in a subprocess, in priority order
     """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = None
+        self.tenants = TenantResolver()
+        if not self.is_testing():
+            self.scheduler = Scheduler(spawn_runner(self), logger=self._logger, queue=workqueue.open_work_queue(),
+                                       autoscaler=autoscaler.from_environment(),
+                                       rate_limit_context=mp.get_context('spawn'))
+            scheduler.schedulers.append(self.scheduler)
+            if EXECUTE_ACTIONS:
+                handoff = workqueue.open_handoff_queue()
+                if handoff and not self.scheduler.queue.shared:
+                    self.scheduler.adopt(handoff)
+                self.scheduler.start()
+            elif not self.scheduler.queue.shared:
+                self._logger.log("WARNING", "EXECUTE_ACTIONS is false, but WORK_QUEUE is not set; "
+                                            "actions will not be run")
+
+    def __getstate__(self):
+        # The scheduler and tenants stay in the worker; subprocesses only need the handler
+        state = self.__dict__.copy()
+        state["scheduler"] = None
+        state["tenants"] = None
+        return state
+
     def start_process(self, request, iconik, b2_storage, ll_storage, format_names):
         if self.is_testing():
             # Process request synchronously so we can check results
             self.do_process(request, iconik, b2_storage, ll_storage, format_names)
         else:
-            # Start a subprocess.  We use the 'spawn' context to allow the subprocess to run after the request is handled
-            # See https://github.com/benoitc/gunicorn/issues/2322#issuecomment-619910669
-            ctx = mp.get_context('spawn')
-            p = ctx.Process(
-                target=process_request,
-                args=(self, request, iconik, b2_storage, ll_storage, format_names),
-            )
-            p.start()
+            self.scheduler.submit(Job(request, (iconik, b2_storage, ll_storage, format_names),
+                                      tenant=self.tenants.resolve(iconik, request)))
 
 
 class Plugin(Resource):
@@ -122,11 +215,61 @@ def create_app(test_config=None):
     if test_config:
         app.config.from_mapping(test_config)
 
+    tracing.configure()
+
     # Helpful message at root
     @app.route("/")
     def hello():
         return "<p>The b2-iconik-plugin is ready for requests</p>"
 
+    # Prometheus metrics
+    @app.route("/metrics")
+    def prometheus_metrics():
+        body, content_type = metrics.generate()
+        return Response(body, content_type=content_type)
+
+    # Profiling is available only if PROFILE_DIR is set
+    @app.route("/admin/profile", methods=["GET", "POST", "DELETE"])
+    def admin_profile():
+        if not profiling.enabled():
+            abort(404)
+        if flask_request.headers.get(X_BZ_SHARED_SECRET) != os.environ['BZ_SHARED_SECRET']:
+            abort(401)
+        if flask_request.method == "POST":
+            try:
+                return profiling.start(
+                    float(flask_request.args.get("seconds", profiling.DEFAULT_PROFILE_SECONDS)),
+                    float(flask_request.args.get("sample_rate", 1.0)))
+            except ValueError as ex:
+                return {"message": str(ex)}, 400
+        elif flask_request.method == "DELETE":
+            return profiling.stop()
+        return profiling.status()
+
+    # iconik webhooks for collection changes, if sync is configured. See sync.py
+    sync_state = sync.open_sync_state()
+
+    @app.route("/sync/events", methods=["POST"])
+    def sync_events():
+        return sync.handle_event(flask_request, sync_state, os.environ['BZ_SHARED_SECRET'])
+
+    # Prefetch requests, if prefetching is configured. See prefetch.py
+    prefetch_store = prefetch.open_prefetch_store()
+
+    @app.route("/prefetch", methods=["GET", "POST"])
+    def prefetch_request():
+        return prefetch.handle_request(flask_request, prefetch_store, os.environ['BZ_SHARED_SECRET'])
+
+    @app.before_request
+    def request_started():
+        metrics.REQUESTS_IN_PROGRESS.inc()
+
+    @app.teardown_request
+    def request_finished(_exception):
+        metrics.REQUESTS_IN_PROGRESS.dec()
+
+    metrics.WORKERS.set(1)
+
     api = Api(app, doc=False)  # noqa
 
     format_names = os.environ.get("FORMAT_NAMES", DEFAULT_FORMAT_NAMES).split(',')
@@ -0,0 +1,576 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Stages assets onto LucidLink ahead of a deadline, such as the start of an
+editing session, rather than when someone selects 'Add to LucidLink'.
+
+A prefetch is requested with a POST to the plugin's /prefetch endpoint,
+naming collections and/or assets and a deadline:
+
+    {"collection_ids": ["..."], "deadline": "2026-10-20T09:00:00Z"}
+
+The plugin records the request in the SQLite database at PREFETCH_STATE,
+and the prefetch daemon, run with `python -m b2_iconik_plugin.prefetch`,
+picks requests up in deadline order. For each one it measures the files of
+each format that aren't on LucidLink yet, ranks them by size and packs them
+into bulk copy jobs, largest first. It then schedules the jobs on the
+fewest concurrent iconik jobs, up to PREFETCH_MAX_JOBS, that are projected
+to finish by the deadline, submitting each job as an earlier one finishes.
+This spreads the copies over the time available instead of competing with
+editors for bandwidth all at once. As jobs finish, the projection is
+revised with the measured copy rate, and concurrency is raised if the
+prefetch falls behind. A GET to /prefetch?id=<id> reports progress and the
+projected completion time against the deadline.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from flask import abort
+
+from b2_iconik_plugin import sqlitedb
+from b2_iconik_plugin.common import DEFAULT_FORMAT_NAMES, X_BZ_SHARED_SECRET, check_environment_variables, \
+    read_json_body
+from b2_iconik_plugin.iconik import Iconik, JOB_POLL_INTERVAL, VERIFY_CONCURRENCY
+from b2_iconik_plugin.ids import IdSet
+from b2_iconik_plugin.logger import Logger
+
+# Where the plugin records prefetch requests for the daemon; empty disables prefetching
+PREFETCH_STATE = os.environ.get("PREFETCH_STATE", "")
+
+# Maximum number of iconik copy jobs that a prefetch runs at once
+PREFETCH_MAX_JOBS = int(os.environ.get("PREFETCH_MAX_JOBS", "4"))
+
+# Bytes per second that a single copy job is expected to copy, until a prefetch measures it
+PREFETCH_JOB_RATE = float(os.environ.get("PREFETCH_JOB_RATE", str(50 * 1024 ** 2)))
+
+# Most bytes and assets in a single bulk copy job
+PREFETCH_BATCH_BYTES = int(os.environ.get("PREFETCH_BATCH_BYTES", str(20 * 1024 ** 3)))
+PREFETCH_BATCH_ASSETS = int(os.environ.get("PREFETCH_BATCH_ASSETS", "50"))
+
+# Seconds between checks for new prefetch requests
+PREFETCH_INTERVAL = float(os.environ.get("PREFETCH_INTERVAL", "60"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def open_prefetch_store(url=None):
+    """
+    Args:
+        url (str): Optional store URL; defaults to the PREFETCH_STATE
+                   environment variable
+    Returns:
+        A PrefetchStore, or None if url is empty
+    """
+    url = PREFETCH_STATE if url is None else url
+    if not url:
+        return None
+    return PrefetchStore(sqlitedb.database_path(url, "PREFETCH_STATE"))
+
+
+def parse_time(value):
+    """
+    Args:
+        value (str): An ISO 8601 date and time; UTC if it has no offset
+    Returns:
+        Seconds since the epoch
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class PrefetchStore:
+    """
+    Prefetch requests and their progress, in a SQLite database that the
+    plugin and the prefetch daemon share
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.clock = clock
+        self._db = sqlitedb.connect(path, """
+            CREATE TABLE IF NOT EXISTS prefetches (
+                id TEXT PRIMARY KEY,
+                request TEXT NOT NULL,
+                deadline REAL NOT NULL,
+                created REAL NOT NULL,
+                status TEXT NOT NULL,
+                report TEXT
+            );
+            CREATE INDEX IF NOT EXISTS prefetches_status ON prefetches (status, deadline);
+        """)
+        self._lock = threading.Lock()
+
+    def add(self, asset_ids, collection_ids, deadline):
+        """
+        Returns:
+            The new prefetch's id
+        """
+        prefetch_id = str(uuid.uuid4())
+        request = json.dumps({"asset_ids": list(asset_ids), "collection_ids": list(collection_ids)})
+        with self._lock:
+            self._db.execute("INSERT INTO prefetches (id, request, deadline, created, status) VALUES (?, ?, ?, ?, ?)",
+                             (prefetch_id, request, deadline, self.clock(), PENDING))
+        return prefetch_id
+
+    def get(self, prefetch_id):
+        """
+        Returns:
+            A dict describing the prefetch, or None if there is no such
+            prefetch
+        """
+        with self._lock:
+            row = self._db.execute("SELECT id, request, deadline, created, status, report FROM prefetches "
+                                   "WHERE id = ?", (prefetch_id,)).fetchone()
+        if not row:
+            return None
+        prefetch_id, request, deadline, created, status, report = row
+        return dict(json.loads(request), id=prefetch_id, deadline=format_time(deadline),
+                    created=format_time(created), status=status, report=json.loads(report) if report else None)
+
+    def claim(self):
+        """
+        Mark the pending prefetch with the earliest deadline as running
+        Returns:
+            A tuple of (id, request, deadline), or None if none are pending
+        """
+        with sqlitedb.transaction(self._db, self._lock) as db:
+            row = db.execute("SELECT id, request, deadline FROM prefetches WHERE status = ? "
+                             "ORDER BY deadline, created LIMIT 1", (PENDING,)).fetchone()
+            if row:
+                db.execute("UPDATE prefetches SET status = ? WHERE id = ?", (RUNNING, row[0]))
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def update(self, prefetch_id, status, report):
+        with self._lock:
+            self._db.execute("UPDATE prefetches SET status = ?, report = ? WHERE id = ?",
+                             (status, json.dumps(report), prefetch_id))
+
+    def requeue_running(self):
+        """
+        Return prefetches that were running when a daemon stopped to the
+        queue. Files that were copied already are skipped when they're run
+        again
+        Returns:
+            The number of prefetches requeued
+        """
+        with self._lock:
+            return self._db.execute("UPDATE prefetches SET status = ? WHERE status = ?",
+                                    (PENDING, RUNNING)).rowcount
+
+    def close(self):
+        self._db.close()
+
+
+class Batch:
+    """
+    The assets copied by a single bulk copy job
+    """
+    __slots__ = ("format_name", "asset_ids", "bytes")
+
+    def __init__(self, format_name, asset_ids, bytes_):
+        self.format_name = format_name
+        self.asset_ids = asset_ids
+        self.bytes = bytes_
+
+    def __repr__(self):
+        return f"Batch({self.format_name!r}, {self.asset_ids!r}, {self.bytes!r})"
+
+
+def make_batches(items, batch_bytes=None, batch_assets=None):
+    """
+    Rank the files to copy by size, largest first, and pack them into
+    batches of a single format
+    Args:
+        items (list of tuple): (asset_id, format_name, bytes) tuples
+        batch_bytes (int): Optional most bytes in a batch
+        batch_assets (int): Optional most assets in a batch
+    Returns:
+        A list of Batches, largest first
+    """
+    batch_bytes = batch_bytes or PREFETCH_BATCH_BYTES
+    batch_assets = batch_assets or PREFETCH_BATCH_ASSETS
+    batches = []
+    open_batches = {}
+    for asset_id, format_name, bytes_ in sorted(items, key=lambda item: -item[2]):
+        batch = open_batches.get(format_name)
+        if batch is None or len(batch.asset_ids) >= batch_assets or batch.bytes + bytes_ > batch_bytes:
+            batch = open_batches[format_name] = Batch(format_name, [], 0)
+            batches.append(batch)
+        batch.asset_ids.append(asset_id)
+        batch.bytes += bytes_
+    batches.sort(key=lambda batch: -batch.bytes)
+    return batches
+
+
+def schedule(batches, lanes, job_rate):
+    """
+    Project when each batch will start and finish, submitting each one as
+    soon as a job finishes
+    Args:
+        batches (list of Batch): The batches, in submission order
+        lanes (list of float): The times at which each of the concurrent
+                               jobs will be free
+        job_rate (float): Bytes per second copied by each job
+    Returns:
+        A tuple of (list of (batch, start, finish) tuples, projected
+        completion time)
+    """
+    heap = list(lanes)
+    heapq.heapify(heap)
+    completion = max(heap)
+    projected = []
+    for batch in batches:
+        start = heapq.heappop(heap)
+        finish = start + batch.bytes / job_rate
+        heapq.heappush(heap, finish)
+        projected.append((batch, start, finish))
+        completion = max(completion, finish)
+    return projected, completion
+
+
+class Plan:
+    def __init__(self, batches, concurrency, start, completion, deadline):
+        self.batches = batches
+        self.concurrency = concurrency
+        self.start = start
+        self.completion = completion
+        self.deadline = deadline
+
+    def report(self):
+        return {
+            "assets": len({asset_id for batch in self.batches for asset_id in batch.asset_ids}),
+            "jobs": len(self.batches),
+            "bytes": sum(batch.bytes for batch in self.batches),
+            "concurrency": self.concurrency,
+            "deadline": format_time(self.deadline),
+            "projected_completion": format_time(self.completion),
+            "on_time": self.completion <= self.deadline,
+            "slack_seconds": round(self.deadline - self.completion, 3),
+        }
+
+
+class Prefetcher:
+    def __init__(self, iconik, format_names, ll_storage_id, max_jobs=None, job_rate=None, batch_bytes=None,
+                 batch_assets=None, clock=time.time, sleep=time.sleep, logger=None):
+        """
+        Args:
+            iconik (Iconik): An iconik client
+            format_names (list of str): The formats to copy
+            ll_storage_id (str): The LucidLink storage id
+            max_jobs (int): Optional most concurrent copy jobs
+            job_rate (float): Optional bytes per second expected of each job
+            batch_bytes (int): Optional most bytes in a copy job
+            batch_assets (int): Optional most assets in a copy job
+            clock (callable): Optional source of the time
+            sleep (callable): Optional sleep function
+            logger (Logger): Optional logger
+        """
+        self.iconik = iconik
+        self.format_names = format_names
+        self.ll_storage_id = ll_storage_id
+        self.max_jobs = max_jobs or PREFETCH_MAX_JOBS
+        self.job_rate = job_rate or PREFETCH_JOB_RATE
+        self.batch_bytes = batch_bytes
+        self.batch_assets = batch_assets
+        self.clock = clock
+        self.sleep = sleep
+        self.logger = logger or Logger()
+
+    def format_bytes(self, asset_id, format_name):
+        """
+        Returns:
+            The size of the files of a format that would be copied to
+            LucidLink, or None if it's there already
+        """
+        if self.iconik.is_present(asset_id, format_name, self.ll_storage_id):
+            return None
+        format_obj = self.iconik.get_format(asset_id, format_name)
+        # Copies come from whichever storage has the format, so go by the largest
+        per_storage = {}
+        for file in self.iconik.get_asset_files(asset_id):
+            if file.get("format_id") == format_obj["id"] and file.get("status", "CLOSED") == "CLOSED":
+                per_storage[file.get("storage_id")] = per_storage.get(file.get("storage_id"), 0) \
+                                                      + (file.get("size") or 0)
+        return max(per_storage.values(), default=0)
+
+    def measure(self, asset_ids):
+        """
+        Returns:
+            A list of (asset_id, format_name, bytes) tuples for the formats
+            that aren't on LucidLink yet
+        """
+        pairs = [(asset_id, format_name) for asset_id in asset_ids for format_name in self.format_names]
+        if not pairs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(VERIFY_CONCURRENCY, len(pairs))) as executor:
+            sizes = executor.map(lambda pair: self.format_bytes(*pair), pairs)
+            return [(asset_id, format_name, bytes_)
+                    for (asset_id, format_name), bytes_ in zip(pairs, sizes) if bytes_ is not None]
+
+    def plan(self, request, deadline):
+        """
+        Measure and batch a prefetch request's assets, and choose the fewest
+        concurrent jobs that are projected to finish by the deadline
+        Args:
+            request (dict): A request containing a list of asset ids and/or
+                            a list of collection ids
+            deadline (float): When the assets are needed, in seconds since
+                              the epoch
+        Returns:
+            A Plan
+        """
+        # The client outlives each request, so don't go by what was on LucidLink for an earlier one
+        self.iconik.forget_presence()
+        batches = make_batches(self.measure(self.iconik.get_request_asset_ids(request)),
+                               self.batch_bytes, self.batch_assets)
+        now = self.clock()
+        for concurrency in range(1, self.max_jobs + 1):
+            projected, completion = schedule(batches, [now] * concurrency, self.job_rate)
+            if completion <= deadline:
+                break
+        return Plan([batch for batch, _start, _finish in sorted(projected, key=lambda p: p[1])],
+                    concurrency, now, completion, deadline)
+
+    def run(self, plan, progress=None):
+        """
+        Submit a plan's copy jobs, keeping up to its concurrency running and
+        revising the projected completion as jobs finish
+        Args:
+            plan (Plan): The plan
+            progress (callable): Optional function called with the report
+                                 whenever a job finishes
+        Returns:
+            The final report
+        """
+        pending = deque(plan.batches)
+        in_flight = {}
+        concurrency = plan.concurrency
+        copied_bytes = 0
+        copied_jobs = 0
+        failed_assets = []
+        job_seconds = 0.0
+        job_bytes = 0
+
+        def job_rate():
+            return job_bytes / job_seconds if job_seconds > 0 else self.job_rate
+
+        def report():
+            now = self.clock()
+            lanes = [max(now, submitted + batch.bytes / job_rate()) for batch, submitted in in_flight.values()]
+            lanes += [now] * (concurrency - len(lanes))
+            _projected, plan.completion = schedule(pending, lanes, job_rate())
+            return dict(plan.report(), concurrency=concurrency, copied_bytes=copied_bytes,
+                        completed_jobs=copied_jobs, failed_assets=failed_assets)
+
+        while pending or in_flight:
+            while pending and len(in_flight) < concurrency:
+                batch = pending.popleft()
+                job_id = self.iconik.copy_assets(batch.asset_ids, batch.format_name, self.ll_storage_id)
+                in_flight[job_id] = (batch, self.clock())
+            self.sleep(JOB_POLL_INTERVAL)
+
+            finished = False
+            for job_id in list(in_flight):
+                job = self.iconik.get_job(job_id)
+                if not self.iconik.job_done(job):
+                    continue
+                batch, submitted = in_flight.pop(job_id)
+                finished = True
+                if self.iconik.job_succeeded(job):
+                    copied_bytes += batch.bytes
+                    copied_jobs += 1
+                    job_seconds += self.clock() - submitted
+                    job_bytes += batch.bytes
+                else:
+                    failed_assets.extend(batch.asset_ids)
+                    self.logger.log("ERROR", {"job_id": job_id, "status": job["status"],
+                                              "format_name": batch.format_name, "assets": len(batch.asset_ids)})
+            if not finished:
+                continue
+
+            current = report()
+            if not current["on_time"] and pending and concurrency < self.max_jobs:
+                concurrency += 1
+                self.logger.log("WARNING", f"Prefetch is behind schedule; running {concurrency} jobs at once")
+                current = report()
+            if progress:
+                progress(current)
+
+        return report()
+
+    def run_request(self, store, prefetch_id, request, deadline):
+        """
+        Plan and run a prefetch from the store, recording its progress
+        """
+        try:
+            plan = self.plan(request, deadline)
+            report = plan.report()
+            self.logger.log("INFO", dict(report, message="Prefetch planned", id=prefetch_id))
+            store.update(prefetch_id, RUNNING, report)
+            report = self.run(plan, lambda current: store.update(prefetch_id, RUNNING, current))
+        except Exception as ex:  # noqa
+            self.logger.log("ERROR", f"Prefetch {prefetch_id} error: {ex!r}")
+            store.update(prefetch_id, FAILED, {"error": repr(ex)})
+            return None
+        store.update(prefetch_id, FAILED if report["failed_assets"] else DONE, report)
+        self.logger.log("INFO", dict(report, message="Prefetch complete", id=prefetch_id))
+        return report
+
+    def serve(self, store, interval=None, stop_event=None):
+        """
+        Run prefetches from the store, earliest deadline first, until
+        stop_event is set
+        """
+        stop_event = stop_event or threading.Event()
+        requeued = store.requeue_running()
+        if requeued:
+            self.logger.log("INFO", f"Requeued {requeued} interrupted prefetches")
+        while not stop_event.is_set():
+            claimed = store.claim()
+            if claimed:
+                self.run_request(store, *claimed)
+            else:
+                stop_event.wait(PREFETCH_INTERVAL if interval is None else interval)
+
+
+def handle_request(req, store, shared_secret, clock=time.time):
+    """
+    Handle a request to the /prefetch endpoint. A POST with a JSON body
+    containing asset_ids and/or collection_ids and a deadline queues a
+    prefetch; a GET with an id query parameter reports on one
+    Args:
+        req (flask.Request): The request
+        store (PrefetchStore): The prefetch store, or None if prefetching
+                               isn't configured
+        shared_secret (str): The plugin's shared secret
+        clock (callable): Optional source of the time
+    Returns:
+        A dict describing the prefetch
+    """
+    if store is None:
+        abort(404)
+    if req.method not in ("GET", "POST"):
+        abort(405)
+    if req.headers.get(X_BZ_SHARED_SECRET) != shared_secret:
+        abort(401)
+
+    if req.method == "GET":
+        if not req.args.get("id"):
+            abort(400)
+        prefetch = store.get(req.args["id"])
+        if prefetch is None:
+            abort(404)
+        return prefetch
+
+    _body, body = read_json_body(req)
+    if not isinstance(body, dict):
+        abort(400)
+    asset_ids = body.get("asset_ids") or []
+    collection_ids = body.get("collection_ids") or []
+    if not isinstance(asset_ids, IdSet) and asset_ids or not isinstance(collection_ids, IdSet) and collection_ids:
+        abort(400)
+    if not (asset_ids or collection_ids):
+        abort(400)
+    try:
+        deadline = parse_time(body.get("deadline"))
+    except (AttributeError, TypeError, ValueError):
+        abort(400)
+    if deadline <= clock():
+        abort(400)
+    return store.get(store.add(asset_ids, collection_ids, deadline))
+
+
+def main(argv=None):
+    load_dotenv()
+
+    check_environment_variables(['ICONIK_ID', 'ICONIK_TOKEN', 'LL_STORAGE_ID'])
+
+    parser = argparse.ArgumentParser(
+        description="Copy assets to LucidLink ahead of a deadline, spreading the copies over the time available"
+    )
+    parser.add_argument("--collections", type=str,
+                        help="a comma-separated list of collection ids to prefetch, instead of serving requests "
+                             "from PREFETCH_STATE")
+    parser.add_argument("--deadline", type=str,
+                        help="when the collections are needed, as an ISO 8601 date and time")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report the plan without copying anything")
+    parser.add_argument("--interval", type=float, default=PREFETCH_INTERVAL,
+                        help="seconds between checks for new prefetch requests")
+    args = parser.parse_args(argv)
+
+    format_names = [name.strip() for name in os.environ.get("FORMAT_NAMES", DEFAULT_FORMAT_NAMES).split(',')]
+    prefetcher = Prefetcher(Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"]), format_names,
+                            os.environ["LL_STORAGE_ID"])
+
+    if args.collections:
+        if not args.deadline:
+            parser.error("--deadline is required with --collections")
+        try:
+            deadline = parse_time(args.deadline)
+        except ValueError as ex:
+            parser.error(str(ex))
+        plan = prefetcher.plan({"asset_ids": [], "collection_ids": args.collections.split(",")}, deadline)
+        report = plan.report()
+        print(json.dumps(report, indent=2))
+        if args.dry_run:
+            return report
+        report = prefetcher.run(plan)
+        print(json.dumps(report, indent=2))
+        if report["failed_assets"]:
+            parser.exit(1)
+        return report
+
+    store = open_prefetch_store()
+    if store is None:
+        parser.error("set PREFETCH_STATE to a SQLite database URL, such as "
+                     "sqlite:////var/lib/b2-iconik-plugin/prefetch.db, or use --collections")
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+    prefetcher.serve(store, args.interval, stop_event)
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Opt-in profiling of the request handler and of the subprocesses that process
+actions.
+
+Set PROFILE_DIR to a directory the plugin can write to, then start a profiling
+window via the /admin/profile route. While the window is open, a sampled
+fraction of requests and actions run under cProfile, and each writes a pstats
+file to PROFILE_DIR. The window is recorded in PROFILE_DIR, rather than in
+memory, so that every Gunicorn worker, and every subprocess those workers
+start, sees it.
+
+Inspect the output with, for example:
+
+    python -m pstats $PROFILE_DIR/do_process-remove-1234-1700000000000.pstats
+"""
+
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_DIR_ENV = "PROFILE_DIR"
+WINDOW_FILENAME = "window.json"
+PROFILE_SUFFIX = ".pstats"
+
+DEFAULT_PROFILE_SECONDS = 60
+MAX_PROFILE_SECONDS = 3600
+
+# cProfile allows only one active profiler at a time, so concurrent requests
+# take turns; a request that finds the profiler busy just isn't profiled
+_profiler_lock = threading.Lock()
+
+
+def profile_dir():
+    return os.environ.get(PROFILE_DIR_ENV)
+
+
+def enabled():
+    return bool(profile_dir())
+
+
+def window_path():
+    return os.path.join(profile_dir(), WINDOW_FILENAME)
+
+
+def start(seconds=DEFAULT_PROFILE_SECONDS, sample_rate=1.0):
+    """
+    Open a profiling window
+    Args:
+        seconds (float): How long the window stays open
+        sample_rate (float): Fraction of requests and actions to profile
+    Returns:
+        The window status
+    """
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError(f"seconds must be greater than 0 and at most {MAX_PROFILE_SECONDS}")
+    if not 0 < sample_rate <= 1:
+        raise ValueError("sample_rate must be greater than 0 and at most 1")
+    os.makedirs(profile_dir(), exist_ok=True)
+    window = {"until": time.time() + seconds, "sample_rate": sample_rate}
+    # Write then rename so that readers never see a partial file
+    tmp_path = f"{window_path()}.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(window, f)
+    os.replace(tmp_path, window_path())
+    return status()
+
+
+def stop():
+    """
+    Close the profiling window, if it is open
+    """
+    try:
+        os.remove(window_path())
+    except FileNotFoundError:
+        pass
+    return status()
+
+
+def current_window():
+    """
+    Returns:
+        The open profiling window, or None
+    """
+    if not enabled():
+        return None
+    try:
+        with open(window_path()) as f:
+            window = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return window if window["until"] > time.time() else None
+
+
+def status():
+    window = current_window()
+    return {
+        "active": window is not None,
+        "remaining_seconds": round(window["until"] - time.time(), 3) if window else 0,
+        "sample_rate": window["sample_rate"] if window else 0,
+        "profiles": sorted(name for name in os.listdir(profile_dir()) if name.endswith(PROFILE_SUFFIX))
+        if enabled() and os.path.isdir(profile_dir()) else [],
+    }
+
+
+@contextmanager
+def profile(name):
+    """
+    Run the enclosed code under cProfile if a profiling window is open and this
+    call is sampled, writing the stats to PROFILE_DIR
+    Args:
+        name (str): Prefix for the pstats file name
+    """
+    window = current_window()
+    if not window or random.random() >= window["sample_rate"] or not _profiler_lock.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            filename = f"{name}-{os.getpid()}-{time.time_ns() // 1_000_000}{PROFILE_SUFFIX}"
+            profiler.dump_stats(os.path.join(profile_dir(), filename))
+    finally:
+        _profiler_lock.release()
@@ -0,0 +1,252 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Brings the plugin's custom actions in iconik in line with a desired set.
+
+Rather than deleting and recreating every action, reconcile lists the
+existing actions once, matches them to the desired actions by context, URL
+path and query parameters, and creates, updates or deletes only those that
+differ. Existing actions that belong to one of the desired endpoints but are
+not in the desired set, such as those for a format list that has been
+removed from the config, are deleted. Actions for other endpoints are left
+alone.
+
+Running reconcile a second time with the same config makes no changes.
+"""
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+from dotenv import load_dotenv
+from requests import HTTPError
+
+from b2_iconik_plugin.common import check_environment_variables, fix_formats
+from b2_iconik_plugin.create_custom_actions import DEFAULT_CONCURRENCY, OPERATIONS, desired_actions, \
+    endpoint_actions, load_config
+from b2_iconik_plugin.iconik import Iconik
+
+CREATE = "create"
+UPDATE = "update"
+DELETE = "delete"
+
+
+def action_key(context, url):
+    """
+    Args:
+        context (str): The action's context, for example "ASSET"
+        url (str): The action's URL
+    Returns:
+        A key that is equal for actions with the same context, endpoint, path
+        and query parameters, regardless of the parameters' order or spaces
+        in the format list
+    """
+    parsed = urlparse(url)
+    query_params = parse_qs(parsed.query)
+    if 'formats' in query_params:
+        query_params['formats'] = [fix_formats(formats) for formats in query_params['formats']]
+    return (
+        context,
+        f"{parsed.scheme}://{parsed.netloc}{parsed.path.rstrip('/')}",
+        tuple(sorted((name, tuple(values)) for name, values in query_params.items()))
+    )
+
+
+def endpoint_of(url):
+    """
+    Args:
+        url (str): An action's URL, without query parameters
+    Returns:
+        The plugin endpoint that the URL is one of the operations of, or None
+        if it isn't a plugin operation
+    """
+    for operation in OPERATIONS:
+        if url.endswith(operation["path"]):
+            return url[:-len(operation["path"])]
+    return None
+
+
+def needs_update(existing, desired, app_id, shared_secret):
+    if existing.get("url") != desired["url"] or existing.get("title") != desired["title"]:
+        return True
+    if "app_id" in existing and existing["app_id"] != app_id:
+        return True
+    headers = existing.get("headers")
+    return headers is not None and headers.get("x-bz-secret") != shared_secret
+
+
+def diff(existing_actions, actions, app_id, shared_secret):
+    """
+    Args:
+        existing_actions (list of dict): Actions from get_custom_actions
+        actions (list of dict): The desired actions, from endpoint_actions or
+                                desired_actions
+        app_id (str): The iconik application id
+        shared_secret (str): The plugin's shared secret
+    Returns:
+        A list of changes, each a dict with "change" set to CREATE, UPDATE or
+        DELETE, "action" set to the desired action for a create or update,
+        and "existing" set to the existing action for an update or delete
+    """
+    desired = {}
+    for action in actions:
+        desired.setdefault(action_key(action["context"], action["url"]), action)
+    endpoints = {endpoint_of(key[1]) for key in desired} - {None}
+
+    changes = []
+    matched = set()
+    for existing in existing_actions:
+        if not existing.get("url"):
+            # Not one of ours
+            continue
+        key = action_key(existing.get("context"), existing["url"])
+        if key in desired and key not in matched:
+            matched.add(key)
+            if needs_update(existing, desired[key], app_id, shared_secret):
+                changes.append({"change": UPDATE, "action": desired[key], "existing": existing})
+        elif endpoint_of(key[1]) in endpoints:
+            # Either not wanted any more, or a duplicate of an action we've already matched
+            changes.append({"change": DELETE, "existing": existing})
+    for key, action in desired.items():
+        if key not in matched:
+            changes.append({"change": CREATE, "action": action})
+    return changes
+
+
+def apply(iconik, changes, app_id, shared_secret, concurrency=None, report=None):
+    """
+    Apply changes from diff(), a bounded number at a time
+    Args:
+        iconik (Iconik): An iconik client
+        changes (list of dict): The changes, from diff()
+        app_id (str): The iconik application id
+        shared_secret (str): The plugin's shared secret
+        concurrency (int): Optional number of changes to apply at once
+        report: Optional function called with each result as it completes
+    Returns:
+        A list of results, in the same order as the changes: each is the
+        change, with "id" set to the action's id if it was applied, or
+        "error" if it wasn't
+    """
+    def run(change):
+        try:
+            if change["change"] == CREATE:
+                action = change["action"]
+                created = iconik.add_action(action["context"], app_id, action["url"], action["title"], shared_secret)
+                result = dict(change, id=created.get("id"))
+            elif change["change"] == UPDATE:
+                action = change["action"]
+                iconik.update_action(change["existing"], app_id, action["url"], action["title"], shared_secret)
+                result = dict(change, id=change["existing"]["id"])
+            else:
+                try:
+                    iconik.delete_action(change["existing"])
+                except HTTPError as ex:
+                    # Already gone, so there's nothing to do
+                    if ex.response is None or ex.response.status_code != 404:
+                        raise
+                result = dict(change, id=change["existing"]["id"])
+        except Exception as ex:  # noqa
+            result = dict(change, error=repr(ex))
+        if report:
+            report(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency or DEFAULT_CONCURRENCY) as executor:
+        return list(executor.map(run, changes))
+
+
+def reconcile(iconik, actions, app_id, shared_secret, concurrency=None, report=None, dry_run=False):
+    """
+    Lists the existing custom actions once, then creates, updates and deletes
+    only those that differ from the desired actions
+    Returns:
+        The results from apply(), or the changes from diff() if dry_run is set
+    """
+    changes = diff(iconik.get_custom_actions(), actions, app_id, shared_secret)
+    if dry_run:
+        return changes
+    return apply(iconik, changes, app_id, shared_secret, concurrency=concurrency, report=report)
+
+
+def describe(change):
+    action = change.get("action") or change["existing"]
+    return f"{change['change']} '{action['title']}' action for '{action['context']}'"
+
+
+def print_result(result):
+    if "error" in result:
+        print(f"Failed to {describe(result)}: {result['error']}")
+    else:
+        print(f"Did {describe(result)}")
+
+
+def main(argv=None):
+    load_dotenv()
+
+    check_environment_variables(['ICONIK_ID', 'ICONIK_TOKEN'])
+
+    parser = argparse.ArgumentParser(
+        description="Create, update and delete the plugin's custom actions in iconik to match the desired set"
+    )
+    parser.add_argument("endpoint", type=str, nargs='?',
+                        help="your function's endpoint url")
+    parser.add_argument("b2_storage_id", type=str, nargs='?',
+                        help="the ID of the B2 storage in iconik")
+    parser.add_argument("ll_storage_id", type=str, nargs='?',
+                        help="the ID of the LucidLink storage in iconik")
+    parser.add_argument("formats", type=str, nargs='?',
+                        help="a comma-separated list of iconik asset formats")
+    parser.add_argument("--config", type=str,
+                        help="a JSON file listing endpoints and format lists, instead of the arguments above")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="number of changes to apply at once")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the changes without applying them")
+    args = parser.parse_args(argv)
+
+    if args.config:
+        actions = desired_actions(load_config(args.config))
+    elif args.endpoint and args.b2_storage_id and args.ll_storage_id:
+        actions = endpoint_actions(args.endpoint, args.b2_storage_id, args.ll_storage_id, args.formats)
+    else:
+        parser.error("the endpoint and storage IDs, or --config, are required")
+
+    iconik = Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"])
+
+    results = reconcile(iconik, actions, os.environ["ICONIK_ID"], os.environ["BZ_SHARED_SECRET"],
+                        concurrency=args.concurrency, report=print_result, dry_run=args.dry_run)
+    if args.dry_run:
+        for change in results:
+            print(f"Would {describe(change)}")
+    print(f"{len(results)} changes")
+    failures = sum(1 for result in results if "error" in result)
+    if failures:
+        print(f"{failures} of {len(results)} changes could not be applied")
+        parser.exit(1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Schedules custom actions onto a limited number of action subprocesses.
+
+Each action is given a priority class:
+
+    interactive  A handful of assets, with no collections, such as a user
+                 right-clicking a single clip; someone is usually waiting
+    standard     Everything in between
+    bulk         BULK context, or enough assets or collections that the
+                 action will take a long time
+
+Queued actions start in priority order. Within a class, each tenant - the
+iconik user that sent the actions - has its own queue, and the queues are
+served by weighted fair queuing, so that one tenant's backlog doesn't hold up
+everyone else's. A tenant may only run a limited number of standard and bulk
+actions at once, and its iconik API rate budget is divided between them; see
+tenants.py. Some slots are reserved for interactive actions. If a higher
+priority action is waiting and every slot is busy, the lowest priority running
+action is asked to yield; it stops at the next chunk
+of assets and hands back the rest of its work, which is queued again. The
+waiting action is claimed from the queue first, so that nodes sharing the
+queue don't all preempt their own actions for it, and it takes the first slot
+that comes free.
+
+Queued actions are held in a work queue, which may be shared by several plugin
+nodes; see workqueue.py.
+"""
+
+import os
+import threading
+import time
+
+from b2_iconik_plugin import metrics, tenants, workqueue
+
+INTERACTIVE = 0
+STANDARD = 1
+BULK = 2
+
+PRIORITY_NAMES = {
+    INTERACTIVE: "interactive",
+    STANDARD: "standard",
+    BULK: "bulk",
+}
+
+# Number of actions that may run at once in each worker
+MAX_CONCURRENT_ACTIONS = int(os.environ.get("MAX_CONCURRENT_ACTIONS", "4"))
+
+# Slots that only interactive actions may use
+INTERACTIVE_RESERVED_SLOTS = int(os.environ.get("INTERACTIVE_RESERVED_SLOTS", "1"))
+
+# Actions with at most this many assets, and no collections, are interactive
+INTERACTIVE_MAX_ASSETS = int(os.environ.get("INTERACTIVE_MAX_ASSETS", "10"))
+
+# Actions with more than this many assets and collections are bulk
+BULK_MIN_OBJECTS = int(os.environ.get("BULK_MIN_OBJECTS", "100"))
+
+# Until it is expanded, a collection is assumed to cost as much to process as this many assets
+COLLECTION_COST = 50
+
+# Seconds between checks on running actions
+DISPATCH_INTERVAL = 0.5
+
+# Set to false on nodes that should only accept actions, leaving it to other
+# nodes, or to b2_iconik_plugin.worker, to run them from a shared work queue
+EXECUTE_ACTIONS = os.environ.get("EXECUTE_ACTIONS", "true").lower() in ("1", "true", "yes")
+
+# Seconds that a worker that is shutting down waits for running actions to hand back their remaining work. Keep this
+# below gunicorn's graceful_timeout.
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", "45"))
+
+# The schedulers that run this worker's actions, so that they can be drained on shutdown
+schedulers = []
+
+
+def classify(request):
+    """
+    Returns:
+        The priority class of a custom action request
+    """
+    asset_count = len(request.get("asset_ids") or [])
+    collection_count = len(request.get("collection_ids") or [])
+    if collection_count == 0 and asset_count <= INTERACTIVE_MAX_ASSETS:
+        return INTERACTIVE
+    if request.get("context") == "BULK" or asset_count + collection_count > BULK_MIN_OBJECTS:
+        return BULK
+    return STANDARD
+
+
+def cost(request):
+    """
+    Returns:
+        An estimate of the work in a custom action request, in assets
+    """
+    return max(len(request.get("asset_ids") or []) + COLLECTION_COST * len(request.get("collection_ids") or []), 1)
+
+
+def drain_all(timeout=None, handoff=None):
+    """
+    Drain this worker's schedulers. Called from gunicorn's worker shutdown
+    hooks.
+
+    Args:
+        timeout (float): Optional seconds to wait for running jobs to yield;
+                         defaults to DRAIN_TIMEOUT
+        handoff: Optional queue for the remaining work of local queues
+    """
+    while schedulers:
+        schedulers.pop().drain(DRAIN_TIMEOUT if timeout is None else timeout, handoff)
+
+
+class Job:
+    def __init__(self, request, args, priority=None, tenant=None):
+        """
+        Args:
+            request (dict): The custom action request
+            args (tuple): The remaining arguments for IconikHandler.do_process
+            priority (int): Optional priority class; classified from the
+                            request if omitted
+            tenant (str): Optional tenant; a hash of the request's auth
+                          token if omitted
+        """
+        self.request = request
+        self.args = args
+        self.priority = classify(request) if priority is None else priority
+        self.tenant = tenants.token_hash(request.get("auth_token")) if tenant is None else tenant
+        self.cost = cost(request)
+        self.queued = time.monotonic()
+        # Weighted fair queuing tags, set when the job is queued
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.sequence = 0
+        # Set by the work queue
+        self.id = None
+        # Limits the iconik API requests of all the tenant's running jobs, or None
+        self.rate_limiter = None
+
+    def continue_with(self, request):
+        """
+        Returns:
+            A job for the remaining work of a preempted job, keeping its
+            priority and tenant
+        """
+        return Job(request, self.args, self.priority, self.tenant)
+
+
+class Scheduler:
+    """
+    Takes jobs from a work queue and starts them, via the runner, as slots
+    become free.
+
+    The runner is called with a job, and returns a handle with four methods:
+    done() returns True once the job has finished, preempt() asks the job to
+    yield at its next chunk boundary, continuation() returns the request for
+    the work that a preempted job handed back, or None, and terminate() stops
+    the job.
+    """
+
+    def __init__(self, runner, max_concurrent=None, reserved_slots=None, tenant_max_concurrent=None,
+                 tenant_rate_limit=None, logger=None, queue=None, autoscaler=None, rate_limit_context=None):
+        self._runner = runner
+        self._autoscaler = autoscaler
+        self._max_concurrent = max_concurrent or MAX_CONCURRENT_ACTIONS
+        if autoscaler:
+            self._max_concurrent = autoscaler.clamp(self._max_concurrent)
+        metrics.ACTION_SLOTS.inc(self._max_concurrent)
+        self._reserved_slots = INTERACTIVE_RESERVED_SLOTS if reserved_slots is None else reserved_slots
+        self._tenant_max_concurrent = tenant_max_concurrent or tenants.TENANT_MAX_CONCURRENT
+        self._tenant_rate_limit = tenants.TENANT_RATE_LIMIT if tenant_rate_limit is None else tenant_rate_limit
+        # One bucket per tenant, shared by all of the tenant's jobs in this process; the runner's multiprocessing
+        # context, if any, lets jobs running in subprocesses share them too
+        self._rate_limiters = {}
+        self._rate_limit_context = rate_limit_context
+        self._logger = logger
+        self.queue = queue or workqueue.LocalWorkQueue(self._tenant_max_concurrent)
+        # (job, handle, preempted)
+        self._running = []
+        # Jobs taken from the queue that are waiting for a preempted job to free a slot
+        self._claimed = []
+        self._last_heartbeat = time.monotonic()
+        self.draining = False
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def submit(self, job):
+        with self._lock:
+            self.queue.put(job)
+            metrics.QUEUE_DEPTH.inc()
+            metrics.SCHEDULED_ACTIONS.labels(PRIORITY_NAMES[job.priority]).inc()
+        self._wakeup.set()
+
+    def queued(self, priority=None):
+        return self.queue.queued(priority) + sum(1 for job in self._claimed
+                                                 if priority is None or job.priority == priority)
+
+    def running(self):
+        with self._lock:
+            return [job for job, _handle, _preempted in self._running]
+
+    def slots(self):
+        """
+        Returns:
+            The number of jobs that may run at once
+        """
+        return self._max_concurrent
+
+    def start(self):
+        """
+        Dispatch jobs from a background thread
+        """
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self.draining:
+            self._wakeup.wait(DISPATCH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.dispatch()
+            except Exception as ex:  # noqa
+                if self._logger:
+                    self._logger.log("ERROR", f"Scheduler error: {ex!r}")
+
+    def dispatch(self):
+        """
+        Reap finished jobs, queueing the remaining work of any that yielded,
+        renew the leases on running jobs, resize the pool of slots if there
+        is an autoscaler, then start queued jobs in free slots, preempting
+        lower priority jobs if higher priority jobs can't start
+        """
+        with self._lock:
+            self._reap()
+            self._heartbeat()
+            self._autoscale()
+            while not self.draining:
+                job = self._next_job()
+                if not job:
+                    break
+                self._running.append((job, self._start(job), False))
+            self._preempt()
+
+    def _start(self, job):
+        if self._tenant_rate_limit:
+            job.rate_limiter = self._rate_limiter(job.tenant)
+        return self._runner(job)
+
+    def _rate_limiter(self, tenant):
+        limiter = self._rate_limiters.get(tenant)
+        if not limiter:
+            limiter = tenants.TokenBucket(self._tenant_rate_limit, context=self._rate_limit_context)
+            self._rate_limiters[tenant] = limiter
+        return limiter
+
+    def drain(self, timeout, handoff=None):
+        """
+        Stop starting jobs and the dispatch thread, ask running jobs to yield,
+        and wait for them to hand back their remaining work. The scheduler
+        doesn't start any more jobs once it has drained. Jobs that are still
+        running after the timeout are stopped, and will be run again from the start; assets
+        that they have already copied are skipped. Jobs that can't be stopped
+        aren't run again, since they would run twice at once.
+
+        Work that remains is left on a shared queue for other nodes, or, if
+        the queue is local to this worker, moved to the handoff queue for the
+        next worker to adopt. If there is neither, running jobs are left to
+        finish, and queued jobs are started, rather than dropping them.
+
+        Args:
+            timeout (float): Seconds to wait for running jobs to yield
+            handoff: Optional queue for the remaining work of a local queue
+        Returns:
+            The number of jobs handed off
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.draining = True
+            # Claimed jobs haven't started, so they go back to the queue
+            for job in self._claimed:
+                self.queue.release(job)
+                if not self.queue.shared:
+                    self.queue.put(job)
+            self._claimed = []
+            run_to_completion = not self.queue.shared and not handoff
+            if run_to_completion:
+                # Nowhere to hand work on to, so run everything that was accepted to completion, as the job's
+                # subprocess or thread outlives the scheduler
+                jobs = self.queue.pop_all()
+                for job in jobs:
+                    self._start(job)
+                for _job in jobs + self.running():
+                    metrics.QUEUE_DEPTH.dec()
+                if self._logger and (jobs or self._running):
+                    self._logger.log("WARNING", f"HANDOFF_QUEUE is not set, so leaving {len(self._running)} running "
+                                                f"actions to finish, and starting {len(jobs)} queued actions")
+                self._running = []
+            else:
+                for index, (job, handle, preempted) in enumerate(self._running):
+                    if not preempted:
+                        handle.preempt()
+                        self._running[index] = (job, handle, True)
+        # Stop the dispatch thread, so that it doesn't restart yielded work
+        # or claim new jobs while we wait
+        self._stop_thread(timeout)
+        if run_to_completion:
+            return 0
+        while True:
+            with self._lock:
+                self._reap()
+                if not self._running or time.monotonic() >= deadline:
+                    break
+            time.sleep(DISPATCH_INTERVAL)
+
+        with self._lock:
+            for job, handle, _preempted in self._running:
+                if self._logger:
+                    self._logger.log("WARNING", f"Action {job.id} did not yield in time; stopping it")
+                handle.terminate()
+                if not handle.done():
+                    # The job can't be stopped, so it mustn't run anywhere else at the same time. On a shared queue,
+                    # its lease expires once this worker exits.
+                    metrics.QUEUE_DEPTH.dec()
+                    if self._logger:
+                        self._logger.log("ERROR", f"Action {job.id} is still running, so it won't be handed off")
+                    continue
+                self.queue.release(job)
+                if self.queue.shared:
+                    metrics.QUEUE_DEPTH.dec()
+                else:
+                    # Still counted in the queue depth until it's popped below
+                    self.queue.put(job.continue_with(job.request))
+            self._running = []
+            if self.queue.shared:
+                return 0
+            jobs = self.queue.pop_all()
+            for job in jobs:
+                metrics.QUEUE_DEPTH.dec()
+                if handoff:
+                    handoff.put(job)
+            if jobs and self._logger:
+                self._logger.log("INFO" if handoff else "ERROR",
+                                 f"Handed off {len(jobs)} actions" if handoff else f"Dropped {len(jobs)} actions")
+            return len(jobs)
+
+    def _stop_thread(self, timeout):
+        self._wakeup.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def adopt(self, handoff):
+        """
+        Queue the work that previous workers handed off
+
+        Returns:
+            The number of jobs adopted
+        """
+        jobs = handoff.pop_all()
+        for job in jobs:
+            job.queued = time.monotonic()
+            self.submit(job)
+        if jobs and self._logger:
+            self._logger.log("INFO", f"Adopted {len(jobs)} actions")
+        return len(jobs)
+
+    def _reap(self):
+        still_running = []
+        for job, handle, preempted in self._running:
+            if not handle.done():
+                still_running.append((job, handle, preempted))
+                continue
+            metrics.QUEUE_DEPTH.dec()
+            continuation = handle.continuation()
+            if not self.queue.complete(job):
+                # Another node took the job over after our lease expired
+                if self._logger:
+                    self._logger.log("WARNING", f"Lost the lease on action {job.id}")
+                continue
+            if continuation:
+                self.submit(job.continue_with(continuation))
+        self._running = still_running
+
+    def _heartbeat(self):
+        if time.monotonic() - self._last_heartbeat >= workqueue.LEASE_SECONDS / 3:
+            self.queue.heartbeat(self.running() + self._claimed)
+            self._last_heartbeat = time.monotonic()
+
+    def _autoscale(self):
+        if not self._autoscaler or self.draining:
+            return
+        waiting = self.queue.waiting() + len(self._claimed)
+        demand = len(self._running) + waiting + self._reserved_slots
+        slots = self._autoscaler.resize(self._max_concurrent, demand)
+        if slots != self._max_concurrent:
+            if self._logger:
+                self._logger.log("INFO", f"Resizing from {self._max_concurrent} to {slots} action slots "
+                                         f"with {len(self._running)} running and {waiting} waiting")
+            metrics.ACTION_SLOTS.inc(slots - self._max_concurrent)
+            self._max_concurrent = slots
+
+    def _free_slots(self, priority):
+        free = self._max_concurrent - len(self._running)
+        if priority != INTERACTIVE:
+            free -= self._reserved_slots
+        return free
+
+    def _next_job(self):
+        for priority in PRIORITY_NAMES:
+            if self._free_slots(priority) <= 0:
+                continue
+            claimed = [job for job in self._claimed if job.priority == priority]
+            if claimed:
+                self._claimed.remove(claimed[0])
+                return claimed[0]
+            job = self.queue.take(priority)
+            if job:
+                return job
+        return None
+
+    def _preempt(self):
+        # Ask lower priority jobs to yield, lowest first, one for each higher priority job that could start if there
+        # were a free slot. Each such job is claimed from the queue, so it is only preempted for once, even if the
+        # queue is shared with other nodes
+        preempted = sum(1 for _job, _handle, preempted in self._running if preempted)
+        for priority in PRIORITY_NAMES:
+            while True:
+                candidates = sorted((entry for entry in self._running
+                                     if not entry[2] and entry[0].priority > priority),
+                                    key=lambda entry: (-entry[0].priority, -entry[0].queued))
+                if not candidates:
+                    break
+                if preempted >= len(self._claimed):
+                    job = self.queue.take(priority)
+                    if not job:
+                        break
+                    self._claimed.append(job)
+                job, handle, _preempted = candidates[0]
+                handle.preempt()
+                metrics.PREEMPTIONS.labels(PRIORITY_NAMES[job.priority]).inc()
+                self._running[self._running.index(candidates[0])] = (job, handle, True)
+                preempted += 1
@@ -0,0 +1,91 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+The SQLite databases that the plugin keeps its state in: the shared work
+queue, the on-disk response cache, and the eviction, prefetch and sync state.
+Each is named by a sqlite:/// URL, created readable only by the plugin's user,
+since it may hold auth tokens or anything they can read, and shared between
+threads, with writes that span several statements made in transactions.
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+
+SQLITE_PREFIX = "sqlite:///"
+
+
+def database_path(url, name):
+    """
+    Args:
+        url (str): A database URL, such as sqlite:////var/lib/plugin/state.db
+        name (str): The setting the URL came from, for the error message
+    Returns:
+        The database file's path
+    Raises:
+        ValueError: If the URL isn't a sqlite:/// URL
+    """
+    if url.startswith(SQLITE_PREFIX):
+        return url[len(SQLITE_PREFIX):]
+    raise ValueError(f"Unsupported {name}: {url}")
+
+
+def connect(path, schema, journal_mode="WAL"):
+    """
+    Open a database, creating it if need be
+    Args:
+        path (str): The database file's path
+        schema (str): SQL statements that create the database's tables if
+                      they don't exist
+        journal_mode (str): WAL, or DELETE for a database that processes on
+                            different hosts share, since WAL relies on shared
+                            memory
+    Returns:
+        A connection in autocommit mode that any thread may use, under a lock
+    """
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+    db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    db.execute(f"PRAGMA journal_mode={journal_mode}")
+    db.executescript(schema)
+    return db
+
+
+@contextmanager
+def transaction(db, lock):
+    """
+    Run the body of a with statement in a write transaction, holding lock,
+    and roll it back if the body raises
+    Args:
+        db (sqlite3.Connection): A connection from connect()
+        lock: The lock that guards the connection
+    Returns:
+        A context manager yielding the connection
+    """
+    with lock:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
@@ -0,0 +1,393 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Keeps the assets in a set of "hot" collections on LucidLink, and offloads
+assets to B2 when they leave those collections.
+
+Each cycle, the syncer reads each hot collection and its subcollections,
+and lists the contents only of those whose modification time has changed,
+or that an iconik webhook has reported as changed, since the last cycle.
+The collection tree and the assets that the syncer has put on LucidLink are
+kept in a SQLite database, so only the assets that have joined or left the
+hot collections are copied or offloaded. Assets are copied with copy_files
+and offloaded with remove_files, which copies them to B2 and checks the
+copies before deleting them from LucidLink.
+
+    SYNC_STATE=sqlite:////var/lib/b2-iconik-plugin/sync.db \\
+    python -m b2_iconik_plugin.sync --collections <collection id>,<collection id>
+
+Set SYNC_STATE for the plugin too, and point an iconik webhook for
+collection changes at the plugin's /sync/events endpoint, to have changed
+collections listed on the next cycle without waiting for their modification
+times. With --events-only, the syncer relies on the webhook alone, and
+doesn't read unchanged collections at all.
+"""
+
+import argparse
+import os
+import signal
+import threading
+
+from dotenv import load_dotenv
+from flask import abort
+
+from b2_iconik_plugin import sqlitedb
+from b2_iconik_plugin.common import DEFAULT_FORMAT_NAMES, X_BZ_SHARED_SECRET, check_environment_variables, \
+    read_json_body
+from b2_iconik_plugin.iconik import ASSET_OBJECT_TYPE, COLLECTION_OBJECT_TYPE, Iconik
+from b2_iconik_plugin.ids import IdSet
+from b2_iconik_plugin.logger import Logger
+
+# Where the syncer keeps the collection tree and the assets it has synced; empty disables sync
+SYNC_STATE = os.environ.get("SYNC_STATE", "")
+
+# Seconds between sync cycles
+SYNC_INTERVAL = float(os.environ.get("SYNC_INTERVAL", "300"))
+
+
+def open_sync_state(url=None):
+    """
+    Args:
+        url (str): Optional state URL; defaults to the SYNC_STATE environment
+                   variable
+    Returns:
+        A SyncState, or None if url is empty
+    """
+    url = SYNC_STATE if url is None else url
+    if not url:
+        return None
+    return SyncState(sqlitedb.database_path(url, "SYNC_STATE"))
+
+
+class SyncState:
+    """
+    The hot collections' tree, as last listed, and the assets that the
+    syncer has put on LucidLink, in a SQLite database that the plugin and the
+    syncer share
+    """
+
+    def __init__(self, path):
+        self._db = sqlitedb.connect(path, """
+            CREATE TABLE IF NOT EXISTS collections (
+                id TEXT PRIMARY KEY,
+                date_modified TEXT,
+                dirty INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS members (
+                collection_id TEXT NOT NULL,
+                object_id TEXT NOT NULL,
+                object_type TEXT NOT NULL,
+                PRIMARY KEY (collection_id, object_id)
+            );
+            CREATE INDEX IF NOT EXISTS members_object_type ON members (object_type, object_id);
+            CREATE TABLE IF NOT EXISTS synced_assets (
+                asset_id TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS changed_assets (
+                asset_id TEXT PRIMARY KEY
+            );
+        """)
+        self._lock = threading.Lock()
+
+    def collection(self, collection_id):
+        """
+        Returns:
+            A tuple of (date_modified, dirty) for a collection that has been
+            listed, otherwise None. dirty counts the changes that webhooks
+            have reported since the collection was last listed
+        """
+        with self._lock:
+            row = self._db.execute("SELECT date_modified, dirty FROM collections WHERE id = ?",
+                                   (collection_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set_contents(self, collection_id, date_modified, asset_ids, collection_ids, dirty=0):
+        """
+        Record a collection's contents, as just listed
+        Args:
+            dirty (int): The collection's dirty count from before it was
+                         listed. The collection stays dirty if a webhook has
+                         reported a change since then, as the listing may
+                         have missed it
+        """
+        with sqlitedb.transaction(self._db, self._lock) as db:
+            db.execute("""
+                INSERT INTO collections (id, date_modified, dirty) VALUES (?, ?, 0)
+                ON CONFLICT (id) DO UPDATE SET
+                    date_modified = excluded.date_modified,
+                    dirty = CASE WHEN dirty = ? THEN 0 ELSE dirty END
+            """, (collection_id, date_modified, dirty))
+            listed = set(asset_ids)
+            before = {row[0] for row in db.execute(
+                "SELECT object_id FROM members WHERE collection_id = ? AND object_type = ?",
+                (collection_id, ASSET_OBJECT_TYPE))}
+            db.executemany("INSERT OR IGNORE INTO changed_assets (asset_id) VALUES (?)",
+                           [(asset_id,) for asset_id in listed ^ before])
+            db.execute("DELETE FROM members WHERE collection_id = ?", (collection_id,))
+            db.executemany(
+                "INSERT OR IGNORE INTO members (collection_id, object_id, object_type) VALUES (?, ?, ?)",
+                [(collection_id, asset_id, ASSET_OBJECT_TYPE) for asset_id in asset_ids]
+                + [(collection_id, child_id, COLLECTION_OBJECT_TYPE) for child_id in collection_ids])
+
+    def subcollections(self, collection_id):
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT object_id FROM members WHERE collection_id = ? AND object_type = ?",
+                (collection_id, COLLECTION_OBJECT_TYPE))]
+
+    def mark_dirty(self, collection_ids):
+        """
+        Have collections listed on the next cycle, whatever their
+        modification times. Collections that aren't hot are ignored
+        Returns:
+            The number of hot collections marked
+        """
+        with self._lock:
+            return self._db.executemany("UPDATE collections SET dirty = dirty + 1 WHERE id = ?",
+                                        [(collection_id,) for collection_id in collection_ids]).rowcount
+
+    def retain(self, collection_ids):
+        """
+        Forget every collection that isn't in collection_ids, such as those
+        that have been removed from a hot collection
+        """
+        keep = set(collection_ids)
+        with sqlitedb.transaction(self._db, self._lock) as db:
+            stale = [(row[0],) for row in db.execute("SELECT id FROM collections") if row[0] not in keep]
+            db.executemany("""
+                INSERT OR IGNORE INTO changed_assets (asset_id)
+                SELECT object_id FROM members WHERE collection_id = ? AND object_type = ?
+            """, [(collection_id, ASSET_OBJECT_TYPE) for collection_id, in stale])
+            db.executemany("DELETE FROM collections WHERE id = ?", stale)
+            db.executemany("DELETE FROM members WHERE collection_id = ?", stale)
+
+    def changes(self):
+        """
+        Only the assets that have joined or left a hot collection since they
+        were last synced are checked, rather than every hot and synced asset
+        Returns:
+            A tuple of IdSets of the assets that are hot but not synced, and
+            of those that are synced but no longer hot
+        """
+        hot = "EXISTS (SELECT 1 FROM members WHERE object_type = ? AND object_id = changed_assets.asset_id)"
+        synced = "EXISTS (SELECT 1 FROM synced_assets WHERE synced_assets.asset_id = changed_assets.asset_id)"
+        with sqlitedb.transaction(self._db, self._lock) as db:
+            # Assets that left and rejoined, or joined and left, need nothing
+            db.execute(f"DELETE FROM changed_assets WHERE {hot} = {synced}", (ASSET_OBJECT_TYPE,))
+            to_add = IdSet(row[0] for row in db.execute(
+                f"SELECT asset_id FROM changed_assets WHERE {hot}", (ASSET_OBJECT_TYPE,)))
+            to_offload = IdSet(row[0] for row in db.execute(
+                f"SELECT asset_id FROM changed_assets WHERE NOT {hot}", (ASSET_OBJECT_TYPE,)))
+        return to_add, to_offload
+
+    def synced_assets(self):
+        with self._lock:
+            return IdSet(row[0] for row in self._db.execute("SELECT asset_id FROM synced_assets"))
+
+    def set_synced(self, asset_ids, synced):
+        params = [(asset_id,) for asset_id in asset_ids]
+        with sqlitedb.transaction(self._db, self._lock) as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO synced_assets (asset_id) VALUES (?)" if synced
+                else "DELETE FROM synced_assets WHERE asset_id = ?", params)
+            db.executemany("DELETE FROM changed_assets WHERE asset_id = ?", params)
+
+    def close(self):
+        self._db.close()
+
+
+class Syncer:
+    def __init__(self, iconik, state, collection_ids, format_names, b2_storage_id, ll_storage_id,
+                 events_only=False, logger=None):
+        """
+        Args:
+            iconik (Iconik): An iconik client
+            state (SyncState): Where to keep the collection tree and synced
+                               assets
+            collection_ids (list of str): The hot collections
+            format_names (list of str): The formats to keep on LucidLink
+            b2_storage_id (str): The B2 storage id
+            ll_storage_id (str): The LucidLink storage id
+            events_only (bool): Only list collections that have never been
+                                listed, or that webhooks report as changed
+            logger (Logger): Optional logger
+        """
+        self.iconik = iconik
+        self.state = state
+        self.collection_ids = list(collection_ids)
+        self.format_names = format_names
+        self.b2_storage_id = b2_storage_id
+        self.ll_storage_id = ll_storage_id
+        self.events_only = events_only
+        self.logger = logger or Logger()
+
+    def refresh(self):
+        """
+        Bring the state's collection tree up to date, listing only the
+        collections that have changed
+        Returns:
+            The number of collections listed
+        """
+        listed = 0
+        visited = set()
+        stack = list(reversed(self.collection_ids))
+        while stack:
+            collection_id = stack.pop()
+            if collection_id in visited:
+                continue
+            known = self.state.collection(collection_id)
+            if known is None or known[1] or not self.events_only:
+                collection = self.iconik.get_collection(collection_id)
+                if collection is None:
+                    # Deleted, so its assets are no longer hot
+                    continue
+                date_modified = collection.get("date_modified")
+                if known is None or known[1] or not date_modified or date_modified != known[0]:
+                    contents = self.iconik.get_collection_contents(collection_id,
+                                                                   [COLLECTION_OBJECT_TYPE, ASSET_OBJECT_TYPE])
+                    self.state.set_contents(
+                        collection_id, date_modified,
+                        [obj["id"] for obj in contents if obj["object_type"] == ASSET_OBJECT_TYPE],
+                        [obj["id"] for obj in contents if obj["object_type"] == COLLECTION_OBJECT_TYPE],
+                        known[1] if known else 0)
+                    listed += 1
+            visited.add(collection_id)
+            stack.extend(reversed(self.state.subcollections(collection_id)))
+        self.state.retain(visited)
+        return listed
+
+    def run_once(self):
+        """
+        Run a sync cycle: refresh the collection tree, copy assets that have
+        joined the hot collections to LucidLink, and offload assets that have
+        left them to B2
+        Returns:
+            A dict with the number of collections "listed", and of assets
+            "added" and "offloaded", and whether any copies "failed"
+        """
+        listed = self.refresh()
+        to_add, to_offload = self.state.changes()
+        failed = False
+
+        if to_add:
+            if self.iconik.copy_files({"asset_ids": to_add, "collection_ids": []}, self.format_names,
+                                      self.ll_storage_id, sync=True):
+                self.state.set_synced(to_add, True)
+            else:
+                # Copies that succeeded are skipped when the assets are tried again next cycle
+                self.logger.log("ERROR", "Some assets could not be copied to LucidLink")
+                failed = True
+
+        if to_offload:
+            if self.iconik.remove_files({"asset_ids": to_offload, "collection_ids": []}, self.format_names,
+                                        self.b2_storage_id, self.ll_storage_id):
+                self.state.set_synced(to_offload, False)
+            else:
+                self.logger.log("ERROR", "Some assets could not be copied to B2, so their files were not deleted")
+                failed = True
+
+        result = {"listed": listed, "added": len(to_add), "offloaded": len(to_offload), "failed": failed}
+        self.logger.log("INFO", {"message": "Sync cycle complete", **result})
+        return result
+
+    def run(self, interval=None, stop_event=None):
+        """
+        Run sync cycles every interval seconds until stop_event is set
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as ex:  # noqa
+                self.logger.log("ERROR", f"Sync error: {ex!r}")
+            stop_event.wait(SYNC_INTERVAL if interval is None else interval)
+
+
+def handle_event(req, state, shared_secret):
+    """
+    Handle an iconik webhook for collection changes, marking the collection
+    to be listed on the next sync cycle
+    Args:
+        req (flask.Request): The request
+        state (SyncState): The sync state, or None if sync isn't configured
+        shared_secret (str): The plugin's shared secret
+    Returns:
+        A dict with the number of hot collections marked
+    """
+    if state is None:
+        abort(404)
+    if req.method != "POST":
+        abort(405)
+    if req.headers.get(X_BZ_SHARED_SECRET) != shared_secret:
+        abort(401)
+    _body, event = read_json_body(req)
+    if not isinstance(event, dict):
+        abort(400)
+    marked = 0
+    # iconik webhooks identify the kind of object in event_type, with the
+    # collection's id in object_id whether its contents or the collection
+    # itself changed
+    if event.get("event_type") == COLLECTION_OBJECT_TYPE and event.get("object_id"):
+        marked = state.mark_dirty([event["object_id"]])
+    return {"marked": marked}
+
+
+def main(argv=None):
+    load_dotenv()
+
+    check_environment_variables(['ICONIK_ID', 'ICONIK_TOKEN', 'B2_STORAGE_ID', 'LL_STORAGE_ID'])
+
+    parser = argparse.ArgumentParser(
+        description="Keep the assets in hot collections on LucidLink, offloading others to B2"
+    )
+    parser.add_argument("--collections", type=str, required=True,
+                        help="a comma-separated list of hot collection ids")
+    parser.add_argument("--interval", type=float, default=SYNC_INTERVAL,
+                        help="seconds between sync cycles")
+    parser.add_argument("--once", action="store_true",
+                        help="run a single sync cycle and exit")
+    parser.add_argument("--events-only", action="store_true",
+                        help="rely on webhooks, rather than modification times, to find changed collections")
+    args = parser.parse_args(argv)
+
+    state = open_sync_state()
+    if state is None:
+        parser.error("set SYNC_STATE to a SQLite database URL, such as sqlite:////var/lib/b2-iconik-plugin/sync.db")
+
+    format_names = [name.strip() for name in os.environ.get("FORMAT_NAMES", DEFAULT_FORMAT_NAMES).split(',')]
+    syncer = Syncer(Iconik(os.environ["ICONIK_ID"], os.environ["ICONIK_TOKEN"]), state,
+                    [collection_id.strip() for collection_id in args.collections.split(',')], format_names,
+                    os.environ["B2_STORAGE_ID"], os.environ["LL_STORAGE_ID"], events_only=args.events_only)
+
+    if args.once:
+        return syncer.run_once()
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+    syncer.run(args.interval, stop_event)
+    return None
+
+
+if __name__ == "__main__":
+    main()
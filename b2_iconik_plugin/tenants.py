@@ -0,0 +1,140 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Tenants share a plugin deployment: each iconik user that sends custom actions
+is a tenant. The scheduler gives each tenant a weighted fair share of the
+action slots, limits how many of its actions run at once, and divides its
+iconik API rate budget between those actions.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+# Seconds for which a token's user is remembered
+TENANT_CACHE_TTL = float(os.environ.get("TENANT_CACHE_TTL", "3600"))
+
+# Number of standard and bulk actions that each tenant may run at once
+TENANT_MAX_CONCURRENT = int(os.environ.get("TENANT_MAX_CONCURRENT", "2"))
+
+# iconik API requests per second for each tenant, across all of its actions; 0 for no limit
+TENANT_RATE_LIMIT = float(os.environ.get("TENANT_RATE_LIMIT", "0"))
+
+
+def parse_weights(value):
+    """
+    Parse tenant weights from a string such as "<user id>=2,<user id>=0.5"
+    Returns:
+        A dict of tenant to weight
+    """
+    weights = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            tenant, weight = item.split("=")
+            weights[tenant.strip()] = float(weight)
+    return weights
+
+
+# Tenants with a larger or smaller share of the action slots than the default weight of 1
+TENANT_WEIGHTS = parse_weights(os.environ.get("TENANT_WEIGHTS"))
+
+
+def weight(tenant):
+    return TENANT_WEIGHTS.get(tenant, 1.0)
+
+
+def token_hash(auth_token):
+    return hashlib.sha256((auth_token or "").encode()).hexdigest()[:16]
+
+
+class TenantResolver:
+    """
+    Finds the iconik user that owns an auth token, remembering the answer so
+    that iconik is asked at most once per token every TENANT_CACHE_TTL seconds
+    """
+
+    def __init__(self, ttl=TENANT_CACHE_TTL):
+        self._ttl = ttl
+        # Token hash -> (tenant, time resolved)
+        self._tenants = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, iconik, request):
+        """
+        Args:
+            iconik (Iconik): An iconik client for the request's auth token
+            request (dict): The custom action request
+        Returns:
+            The user id that owns the request's auth token, or a hash of the
+            token if iconik can't say
+        """
+        key = token_hash(request.get("auth_token"))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._tenants.get(key)
+            if cached and now - cached[1] < self._ttl:
+                return cached[0]
+        try:
+            tenant = iconik.get_current_user().get("id") or key
+        except Exception:  # noqa
+            # Scheduling shouldn't fail just because the user lookup did
+            tenant = key
+        with self._lock:
+            self._tenants[key] = (tenant, now)
+        return tenant
+
+
+class TokenBucket:
+    """
+    Limits the rate of calls to acquire(), allowing short bursts
+    """
+
+    def __init__(self, rate, burst=None, context=None):
+        """
+        Args:
+            rate (float): Calls per second
+            burst (float): Optional number of calls allowed at once; defaults
+                           to one second's worth
+            context: Optional multiprocessing context; if given, the bucket
+                     is shared with the subprocesses that it's passed to
+        """
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        # [tokens, updated]
+        if context:
+            self._state = context.Array("d", [self.burst, time.monotonic()])
+            self._lock = self._state.get_lock()
+        else:
+            self._state = [self.burst, time.monotonic()]
+            self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate) - 1
+            self._state[0] = tokens
+            self._state[1] = now
+        delay = -tokens / self.rate if tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
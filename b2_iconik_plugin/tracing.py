@@ -0,0 +1,250 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Optional OpenTelemetry tracing for the plugin and its iconik client.
+
+Tracing is enabled when the OpenTelemetry SDK is installed and
+OTEL_TRACES_EXPORTER is set to one of:
+
+    otlp     Export to an OTLP collector; configure it with the standard
+             OTEL_EXPORTER_OTLP_* environment variables
+    file     Append spans, one JSON object per line, to TRACES_FILE
+             (default traces.jsonl) for offline analysis
+    console  Print spans to stdout
+
+Otherwise, every function in this module is a no-op.
+"""
+
+import functools
+import inspect
+import os
+import re
+from contextlib import nullcontext
+
+import b2_iconik_plugin
+
+try:
+    from opentelemetry import context, propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    from opentelemetry.trace import NonRecordingSpan, SpanContext, SpanKind, TraceFlags
+except ImportError:
+    trace = None
+
+EXPORTER_ENV = "OTEL_TRACES_EXPORTER"
+FILE_ENV = "TRACES_FILE"
+DEFAULT_TRACES_FILE = "traces.jsonl"
+
+# Key for the propagated trace context in a custom action request
+TRACE_CONTEXT_KEY = "trace_context"
+
+# X-Cloud-Trace-Context: TRACE_ID/SPAN_ID;o=OPTIONS
+# See https://cloud.google.com/trace/docs/trace-context#legacy-http-header
+CLOUD_TRACE_PATTERN = re.compile(r"^([0-9a-fA-F]{32})/(\d+)(?:;o=(\d))?")
+
+_provider = None
+
+
+def enabled():
+    return _provider is not None
+
+
+def make_exporter(name):
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    elif name == "file":
+        # Each process appends whole lines, so several processes can share the file
+        out = open(os.environ.get(FILE_ENV, DEFAULT_TRACES_FILE), "a", buffering=1)
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    elif name == "console":
+        return ConsoleSpanExporter()
+    return None
+
+
+def configure(exporter=None):
+    """
+    Set up the tracer provider and exporter for this process, if tracing is
+    configured. Safe to call more than once.
+    Args:
+        exporter: Optional span exporter to use instead of the one named by
+                  OTEL_TRACES_EXPORTER
+    """
+    global _provider
+    if _provider or not trace:
+        return
+    exporter = exporter or make_exporter(os.environ.get(EXPORTER_ENV, "").lower())
+    if not exporter:
+        return
+    _provider = TracerProvider(resource=Resource.create({
+        "service.name": "b2-iconik-plugin",
+        "service.version": b2_iconik_plugin.__version__,
+    }))
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+
+
+def flush():
+    """
+    Export any buffered spans now
+    """
+    if _provider:
+        _provider.force_flush()
+
+
+def shutdown():
+    """
+    Flush any buffered spans. Call before a subprocess exits.
+    """
+    global _provider
+    if _provider:
+        _provider.shutdown()
+        _provider = None
+
+
+def span(name, context=None, kind="internal", **attributes):
+    """
+    Start a span as the current span
+    Args:
+        name (str): Span name
+        context: Optional parent context, for example from extract()
+        kind (str): "internal", "server" or "client"
+        attributes: Span attributes; None values are omitted
+    Returns:
+        A context manager yielding the span, or None if tracing is disabled
+    """
+    if not _provider:
+        return nullcontext()
+    return _provider.get_tracer(__name__).start_as_current_span(
+        name,
+        context=context,
+        kind=getattr(SpanKind, kind.upper()),
+        attributes={key: value for key, value in attributes.items() if value is not None})
+
+
+def traced(name):
+    """
+    Decorator that runs a function in a span with the given name. Generator
+    functions are left alone, since the span would end when the generator is
+    created, before any of its work is done; the iconik requests that they
+    make have spans of their own
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _provider:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(cls):
+    """
+    Class decorator that runs each public method in a span named after the
+    class and method. Static and class methods, and generators, are left
+    alone.
+    """
+    for name, member in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.isfunction(member):
+            setattr(cls, name, traced(f"{cls.__name__}.{name}")(member))
+    return cls
+
+
+def propagated(func):
+    """
+    Wrap a function so that, when it runs in another thread, its spans
+    belong to the span that is current now
+    """
+    if not _provider:
+        return func
+    parent = context.get_current()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = context.attach(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            context.detach(token)
+    return wrapper
+
+
+def inject():
+    """
+    Capture the current trace context so that it can cross a process boundary
+    Returns:
+        A dict of W3C trace context headers, empty if tracing is disabled
+    """
+    carrier = {}
+    if _provider:
+        propagate.inject(carrier)
+    return carrier
+
+
+def extract(carrier):
+    """
+    Returns:
+        The trace context previously captured by inject(), or None
+    """
+    if not _provider or not carrier:
+        return None
+    return propagate.extract(carrier)
+
+
+def request_context(req):
+    """
+    Find the parent trace context for an incoming request, preferring a W3C
+    traceparent header over Google Cloud's X-Cloud-Trace-Context
+    Args:
+        req (flask.Request): The request object.
+    Returns:
+        A trace context, or None
+    """
+    if not _provider:
+        return None
+    if req.headers.get("traceparent"):
+        return propagate.extract(req.headers)
+    return cloud_trace_context(req.headers.get("X-Cloud-Trace-Context"))
+
+
+def cloud_trace_context(header):
+    """
+    Convert an X-Cloud-Trace-Context header value to a trace context
+    """
+    match = CLOUD_TRACE_PATTERN.match(header or "")
+    if not trace or not match or int(match.group(2)) == 0:
+        return None
+    span_context = SpanContext(
+        trace_id=int(match.group(1), 16),
+        span_id=int(match.group(2)) & 0xFFFFFFFFFFFFFFFF,
+        is_remote=True,
+        trace_flags=TraceFlags(TraceFlags.SAMPLED if match.group(3) == "1" else TraceFlags.DEFAULT))
+    return trace.set_span_in_context(NonRecordingSpan(span_context))
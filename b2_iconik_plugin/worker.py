@@ -0,0 +1,81 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Runs actions from a shared work queue, without accepting requests, so that
+action processing can be scaled separately from the plugin's HTTP nodes.
+
+    WORK_QUEUE=sqlite:////shared/queue.db python -m b2_iconik_plugin.worker
+"""
+
+import multiprocessing as mp
+import os
+import signal
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+from b2_iconik_plugin import autoscaler, tracing, workqueue
+from b2_iconik_plugin.common import IconikHandler, DEFAULT_FORMAT_NAMES, check_environment_variables
+from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.plugin import spawn_runner
+from b2_iconik_plugin.scheduler import DISPATCH_INTERVAL, DRAIN_TIMEOUT, Scheduler
+
+
+def main():
+    load_dotenv()
+
+    check_environment_variables(['BZ_SHARED_SECRET', 'ICONIK_ID'])
+
+    queue = workqueue.open_work_queue()
+    if not queue.shared:
+        print("Set WORK_QUEUE to the plugin's shared work queue", file=sys.stderr)
+        sys.exit(1)
+
+    tracing.configure()
+
+    logger = Logger()
+    format_names = os.environ.get("FORMAT_NAMES", DEFAULT_FORMAT_NAMES).split(',')
+    handler = IconikHandler(logger, os.environ['BZ_SHARED_SECRET'], os.environ['ICONIK_ID'], format_names)
+    scheduler = Scheduler(spawn_runner(handler), logger=logger, queue=queue, autoscaler=autoscaler.from_environment(),
+                          rate_limit_context=mp.get_context('spawn'))
+
+    # On shutdown, running actions hand their remaining work back to the queue for other workers
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda _signum, _frame: stopping.set())
+
+    logger.log("INFO", f"Worker {queue.owner} running actions from {os.environ['WORK_QUEUE']}")
+    while not stopping.is_set():
+        try:
+            scheduler.dispatch()
+        except Exception as ex:  # noqa
+            logger.log("ERROR", f"Scheduler error: {ex!r}")
+        stopping.wait(DISPATCH_INTERVAL)
+
+    logger.log("INFO", f"Worker {queue.owner} draining")
+    scheduler.drain(DRAIN_TIMEOUT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Work queues hold scheduled actions until a scheduler takes them to run.
+
+LocalWorkQueue keeps actions in memory, so each worker runs the actions that
+it receives. SqliteWorkQueue keeps them in a SQLite database, so that several
+workers, on one or more plugin nodes sharing the database file, can take
+actions from the same queue. An action taken from a shared queue is leased to
+the node that took it; the node renews the lease while the action runs, and
+if the node dies, the lease expires and another node picks the action up. An
+action whose lease has expired WORK_QUEUE_MAX_ATTEMPTS times, which usually
+means that it kills the nodes that run it, is moved to a table of dead actions
+instead.
+
+The shared database uses SQLite's rollback journal rather than WAL, since WAL
+relies on shared memory that only works between processes on one host. Nodes
+on different hosts need a network filesystem with working POSIX locks, and
+clocks synchronized, with NTP for example, to well within the lease, since
+lease expiry compares times taken on different hosts.
+
+Both queues order actions by priority class, then by weighted fair queuing
+between tenants, and apply the per-tenant concurrency limit. Set WORK_QUEUE to
+choose a queue:
+
+    WORK_QUEUE=                              In memory (the default)
+    WORK_QUEUE=sqlite:///path/to/queue.db    Shared via SQLite
+"""
+
+import os
+import pickle
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+
+from b2_iconik_plugin import metrics, sqlitedb, tenants
+from b2_iconik_plugin.logger import Logger
+
+# Seconds for which a node owns an action it took from a shared queue, unless it renews the lease
+LEASE_SECONDS = float(os.environ.get("WORK_QUEUE_LEASE_SECONDS", "60"))
+
+# Number of times an action can be taken from a shared queue without being completed or released before it is
+# abandoned
+MAX_ATTEMPTS = int(os.environ.get("WORK_QUEUE_MAX_ATTEMPTS", "5"))
+
+# Where a worker with an in-memory queue leaves its unfinished actions when it shuts down, for the next generation of
+# workers to pick up. Off by default, since every plugin process that names the same file adopts its actions.
+HANDOFF_QUEUE = os.environ.get("HANDOFF_QUEUE", "")
+
+# The interactive priority class, as in scheduler.py
+INTERACTIVE = 0
+
+
+def count_startable(counts, running, tenant_max_concurrent):
+    """
+    Args:
+        counts: Iterable of (priority, tenant, number of queued jobs), in
+                priority order
+        running (dict): Tenant -> number of standard and bulk jobs running
+        tenant_max_concurrent (int): The per-tenant limit on standard and bulk
+                                     jobs
+    Returns:
+        The number of the jobs that could start now, counting no more of each
+        tenant's standard and bulk jobs than it has concurrency left for
+    """
+    left = {}
+    total = 0
+    for priority, tenant, count in counts:
+        if priority == INTERACTIVE:
+            total += count
+            continue
+        free = left.get(tenant, max(tenant_max_concurrent - running.get(tenant, 0), 0))
+        startable = min(count, free)
+        left[tenant] = free - startable
+        total += startable
+    return total
+
+
+def node_id():
+    """
+    Returns:
+        A name for this process that is unique across plugin nodes
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def open_work_queue(url=None, tenant_max_concurrent=None):
+    """
+    Args:
+        url (str): Optional queue URL; defaults to the WORK_QUEUE environment
+                   variable
+        tenant_max_concurrent (int): Optional per-tenant limit on standard and
+                                     bulk actions
+    Returns:
+        A work queue
+    """
+    url = os.environ.get("WORK_QUEUE", "") if url is None else url
+    if not url:
+        return LocalWorkQueue(tenant_max_concurrent)
+    return SqliteWorkQueue(sqlitedb.database_path(url, "WORK_QUEUE"), tenant_max_concurrent)
+
+
+def open_handoff_queue():
+    """
+    The handoff queue holds pickled jobs, including their auth tokens, so
+    it must not be a file that another user could have created.
+
+    Returns:
+        The queue named by HANDOFF_QUEUE, or None if it is empty
+    Raises:
+        PermissionError: If the queue's file is owned by another user
+    """
+    if not HANDOFF_QUEUE:
+        return None
+    path = sqlitedb.database_path(HANDOFF_QUEUE, "HANDOFF_QUEUE")
+    if os.path.exists(path) and os.stat(path).st_uid != os.getuid():
+        raise PermissionError(f"HANDOFF_QUEUE {path} is not owned by this user")
+    return SqliteWorkQueue(path)
+
+
+class LocalWorkQueue:
+    """
+    An in-memory work queue, with a queue per priority and tenant
+    """
+    shared = False
+
+    def __init__(self, tenant_max_concurrent=None):
+        self._tenant_max_concurrent = tenant_max_concurrent or tenants.TENANT_MAX_CONCURRENT
+        # Priority -> tenant -> jobs
+        self._queues = {}
+        # Weighted fair queuing state, per priority: the virtual time, and
+        # each tenant's latest finish tag
+        self._virtual_time = {}
+        self._last_finish = {}
+        self._sequence = 0
+        # Jobs that have been taken and not yet completed
+        self._taken = {}
+        self._lock = threading.RLock()
+
+    def put(self, job):
+        with self._lock:
+            # The job's share of service starts when the tenant's previous job
+            # finishes, or now, if the tenant has nothing queued
+            last_finish = self._last_finish.setdefault(job.priority, {})
+            job.start_tag = max(self._virtual_time.get(job.priority, 0.0), last_finish.get(job.tenant, 0.0))
+            job.finish_tag = job.start_tag + job.cost / tenants.weight(job.tenant)
+            self._sequence += 1
+            job.sequence = self._sequence
+            job.id = str(job.sequence)
+            last_finish[job.tenant] = job.finish_tag
+            self._queues.setdefault(job.priority, {}).setdefault(job.tenant, deque()).append(job)
+
+    def _eligible(self, priority, tenant):
+        if priority == INTERACTIVE:
+            return True
+        running = sum(1 for job in self._taken.values() if job.tenant == tenant and job.priority != INTERACTIVE)
+        return running < self._tenant_max_concurrent
+
+    def take(self, priority):
+        """
+        Returns:
+            The next job of the given priority whose tenant is within its
+            concurrency limit, or None
+        """
+        with self._lock:
+            queues = self._queues.get(priority, {})
+            eligible = [jobs for tenant, jobs in queues.items() if self._eligible(priority, tenant)]
+            if not eligible:
+                return None
+            # Serve the tenant whose next job has the earliest finish tag
+            jobs = min(eligible, key=lambda jobs: (jobs[0].finish_tag, jobs[0].sequence))
+            job = jobs.popleft()
+            if not jobs:
+                del queues[job.tenant]
+            virtual_time = max(self._virtual_time.get(priority, 0.0), job.start_tag)
+            self._virtual_time[priority] = virtual_time
+            # Tenants whose work has all been served no longer need their tags
+            last_finish = self._last_finish[priority]
+            for tenant in [tenant for tenant, tag in last_finish.items()
+                           if tag <= virtual_time and tenant not in queues]:
+                del last_finish[tenant]
+            self._taken[job.id] = job
+            return job
+
+    def waiting(self, priority=None):
+        """
+        Returns:
+            The number of jobs of the given priority, or of any priority, that
+            could start now. See count_startable
+        """
+        with self._lock:
+            running = {}
+            for job in self._taken.values():
+                if job.priority != INTERACTIVE:
+                    running[job.tenant] = running.get(job.tenant, 0) + 1
+            counts = [(p, tenant, len(jobs)) for p, queues in sorted(self._queues.items())
+                      if priority is None or p == priority for tenant, jobs in queues.items()]
+            return count_startable(counts, running, self._tenant_max_concurrent)
+
+    def queued(self, priority=None):
+        with self._lock:
+            return sum(len(jobs) for p, queues in self._queues.items() if priority is None or p == priority
+                       for jobs in queues.values())
+
+    def pop_all(self):
+        """
+        Remove every queued job
+
+        Returns:
+            The jobs, in the order they were queued
+        """
+        with self._lock:
+            jobs = sorted((job for queues in self._queues.values() for jobs in queues.values() for job in jobs),
+                          key=lambda job: job.sequence)
+            self._queues = {}
+            return jobs
+
+    def heartbeat(self, jobs):
+        pass
+
+    def complete(self, job):
+        """
+        Returns:
+            True if the job was still held by this queue's owner
+        """
+        with self._lock:
+            return self._taken.pop(job.id, None) is not None
+
+    def release(self, job):
+        """
+        Give up a job that was taken but not completed. The job is forgotten;
+        the caller is responsible for queueing it elsewhere.
+        """
+        self.complete(job)
+
+    def close(self):
+        pass
+
+
+class SqliteWorkQueue:
+    """
+    A work queue shared through a SQLite database. Jobs, including the iconik
+    client that holds the request's auth token, are stored pickled, so the
+    database file must only be accessible to the plugin.
+    """
+    shared = True
+
+    def __init__(self, path, tenant_max_concurrent=None, lease_seconds=None, owner=None, max_attempts=None,
+                 logger=None):
+        self._tenant_max_concurrent = tenant_max_concurrent or tenants.TENANT_MAX_CONCURRENT
+        self._lease_seconds = lease_seconds or LEASE_SECONDS
+        self._max_attempts = max_attempts or MAX_ATTEMPTS
+        self.owner = owner or node_id()
+        self._logger = logger or Logger()
+        self._lock = threading.RLock()
+        # WAL only works between processes on one host, and nodes may share the file over a network
+        self._db = sqlitedb.connect(path, """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                priority INTEGER NOT NULL,
+                tenant TEXT NOT NULL,
+                start_tag REAL NOT NULL,
+                finish_tag REAL NOT NULL,
+                job BLOB NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS jobs_order ON jobs (priority, finish_tag, id);
+            CREATE TABLE IF NOT EXISTS tenant_tags (
+                priority INTEGER NOT NULL,
+                tenant TEXT NOT NULL,
+                last_finish REAL NOT NULL,
+                PRIMARY KEY (priority, tenant)
+            );
+            CREATE TABLE IF NOT EXISTS virtual_time (
+                priority INTEGER PRIMARY KEY,
+                value REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dead_jobs (
+                id INTEGER PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                tenant TEXT NOT NULL,
+                job BLOB NOT NULL,
+                attempts INTEGER NOT NULL,
+                died REAL NOT NULL
+            );
+        """, journal_mode="DELETE")
+
+    def _transaction(self):
+        """
+        Run the body of a with statement in a write transaction
+        """
+        return sqlitedb.transaction(self._db, self._lock)
+
+    def _virtual_time(self, db, priority):
+        row = db.execute("SELECT value FROM virtual_time WHERE priority = ?", (priority,)).fetchone()
+        return row[0] if row else 0.0
+
+    def put(self, job):
+        with self._transaction() as db:
+            row = db.execute("SELECT last_finish FROM tenant_tags WHERE priority = ? AND tenant = ?",
+                             (job.priority, job.tenant)).fetchone()
+            job.start_tag = max(self._virtual_time(db, job.priority), row[0] if row else 0.0)
+            job.finish_tag = job.start_tag + job.cost / tenants.weight(job.tenant)
+            db.execute("INSERT OR REPLACE INTO tenant_tags (priority, tenant, last_finish) VALUES (?, ?, ?)",
+                       (job.priority, job.tenant, job.finish_tag))
+            cursor = db.execute("INSERT INTO jobs (priority, tenant, start_tag, finish_tag, job) VALUES (?, ?, ?, ?, ?)",
+                                (job.priority, job.tenant, job.start_tag, job.finish_tag, b""))
+            job.sequence = cursor.lastrowid
+            job.id = str(job.sequence)
+            db.execute("UPDATE jobs SET job = ? WHERE id = ?", (pickle.dumps(job), job.sequence))
+
+    def _running_by_tenant(self, db, now):
+        return dict(db.execute(
+            "SELECT tenant, COUNT(*) FROM jobs WHERE owner IS NOT NULL AND lease_expires >= ? AND priority != ? "
+            "GROUP BY tenant", (now, INTERACTIVE)).fetchall())
+
+    def _available(self, db, priority, now):
+        """
+        Yields:
+            (id, tenant, job) for jobs of the given priority that are queued,
+            or whose lease has expired, whose tenants are within their
+            concurrency limit, in weighted fair queuing order
+        """
+        running = self._running_by_tenant(db, now)
+        for id_, tenant, job in db.execute(
+                "SELECT id, tenant, job FROM jobs WHERE priority = ? AND (owner IS NULL OR lease_expires < ?) "
+                "AND attempts < ? ORDER BY finish_tag, id", (priority, now, self._max_attempts)):
+            if priority == INTERACTIVE or running.get(tenant, 0) < self._tenant_max_concurrent:
+                yield id_, tenant, job
+
+    def _bury(self, db, now):
+        """
+        Move jobs whose leases have expired too many times to dead_jobs
+        """
+        dead = db.execute("SELECT id, tenant, attempts FROM jobs WHERE attempts >= ? "
+                          "AND (owner IS NULL OR lease_expires < ?)", (self._max_attempts, now)).fetchall()
+        for id_, tenant, attempts in dead:
+            db.execute("INSERT OR REPLACE INTO dead_jobs (id, priority, tenant, job, attempts, died) "
+                       "SELECT id, priority, tenant, job, attempts, ? FROM jobs WHERE id = ?", (now, id_))
+            db.execute("DELETE FROM jobs WHERE id = ?", (id_,))
+            metrics.DEAD_ACTIONS.inc()
+            self._logger.log("ERROR", {"message": "Abandoning action after repeated attempts", "action": str(id_),
+                                       "tenant": tenant, "attempts": attempts})
+
+    def take(self, priority):
+        now = time.time()
+        with self._transaction() as db:
+            self._bury(db, now)
+            for id_, _tenant, data in self._available(db, priority, now):
+                job = pickle.loads(data)
+                db.execute("UPDATE jobs SET owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                           (self.owner, now + self._lease_seconds, id_))
+                db.execute("INSERT OR REPLACE INTO virtual_time (priority, value) VALUES (?, ?)",
+                           (priority, max(self._virtual_time(db, priority), job.start_tag)))
+                db.execute("DELETE FROM tenant_tags WHERE priority = ? AND last_finish <= ? AND tenant NOT IN "
+                           "(SELECT tenant FROM jobs WHERE priority = ?)",
+                           (priority, self._virtual_time(db, priority), priority))
+                return job
+        return None
+
+    def waiting(self, priority=None):
+        """
+        Returns:
+            The number of jobs of the given priority, or of any priority, that
+            could start now, across every node. See count_startable
+        """
+        now = time.time()
+        with self._lock:
+            query = ("SELECT priority, tenant, COUNT(*) FROM jobs WHERE (owner IS NULL OR lease_expires < ?) "
+                     "AND attempts < ?")
+            params = [now, self._max_attempts]
+            if priority is not None:
+                query += " AND priority = ?"
+                params.append(priority)
+            counts = self._db.execute(query + " GROUP BY priority, tenant ORDER BY priority", params).fetchall()
+            return count_startable(counts, self._running_by_tenant(self._db, now), self._tenant_max_concurrent)
+
+    def queued(self, priority=None):
+        with self._lock:
+            query = "SELECT COUNT(*) FROM jobs WHERE (owner IS NULL OR lease_expires < ?) AND attempts < ?"
+            params = [time.time(), self._max_attempts]
+            if priority is not None:
+                query += " AND priority = ?"
+                params.append(priority)
+            return self._db.execute(query, params).fetchone()[0]
+
+    def pop_all(self):
+        """
+        Remove every job that isn't leased to a running node
+
+        Returns:
+            The jobs, in the order they were queued
+        """
+        with self._transaction() as db:
+            rows = db.execute("SELECT id, job FROM jobs WHERE owner IS NULL OR lease_expires < ? ORDER BY id",
+                              (time.time(),)).fetchall()
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(id_,) for id_, _job in rows])
+            return [pickle.loads(job) for _id, job in rows]
+
+    def heartbeat(self, jobs):
+        """
+        Renew the leases on jobs that this node is running
+        """
+        if not jobs:
+            return
+        with self._transaction() as db:
+            db.executemany("UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ?",
+                           [(time.time() + self._lease_seconds, job.sequence, self.owner) for job in jobs])
+
+    def complete(self, job):
+        with self._transaction() as db:
+            return db.execute("DELETE FROM jobs WHERE id = ? AND owner = ?", (job.sequence, self.owner)).rowcount > 0
+
+    def release(self, job):
+        """
+        Give up the lease on a job that was taken but not completed, so that
+        another node can take it straight away. Giving it up doesn't count as
+        a failed attempt
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET owner = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0) "
+                       "WHERE id = ? AND owner = ?", (job.sequence, self.owner))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,135 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A minimal in-process client for ASGI apps, so that the ASGI app can be tested
+and benchmarked without an ASGI server.
+"""
+
+import asyncio
+import threading
+from json import dumps, loads
+from urllib.parse import urlsplit
+
+
+class AsgiResponse:
+    def __init__(self, status_code, headers, body):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = body
+
+    @property
+    def json(self):
+        return loads(self.data)
+
+
+class AsgiClient:
+    """
+    Runs an ASGI app on an event loop in a background thread, sending it the
+    lifespan startup event on entry and the shutdown event on exit
+    """
+    def __init__(self, app):
+        self._app = app
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="asgi-client", daemon=True)
+        self._lifespan_in = None
+        self._lifespan_out = None
+        self._lifespan_task = None
+
+    def __enter__(self):
+        self._thread.start()
+        started = self._call(self._start_lifespan())
+        assert "lifespan.startup.complete" == started
+        return self
+
+    def __exit__(self, *exc_info):
+        self._call(self._stop_lifespan())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start_lifespan(self):
+        self._lifespan_in = asyncio.Queue()
+        self._lifespan_out = asyncio.Queue()
+        self._lifespan_task = asyncio.create_task(self._app({"type": "lifespan"}, self._lifespan_in.get,
+                                                            self._lifespan_out.put))
+        await self._lifespan_in.put({"type": "lifespan.startup"})
+        return (await self._lifespan_out.get())["type"]
+
+    async def _stop_lifespan(self):
+        await self._lifespan_in.put({"type": "lifespan.shutdown"})
+        message = await self._lifespan_out.get()
+        await self._lifespan_task
+        return message["type"]
+
+    def run(self, coroutine):
+        """
+        Run a coroutine on the app's event loop
+        """
+        return self._call(coroutine)
+
+    def request(self, method, url, json=None, data=None, headers=None):
+        """
+        Send a request, taking the same arguments as Flask's test client
+        """
+        parts = urlsplit(url)
+        body = dumps(json).encode() if json is not None else (data or "").encode()
+        header_list = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                       for name, value in (headers or {}).items()]
+        if json is not None:
+            header_list.append((b"content-type", b"application/json"))
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": parts.path,
+            "query_string": parts.query.encode("latin-1"),
+            "root_path": "",
+            "headers": header_list,
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 12345),
+        }
+        return self._call(self._request(scope, body))
+
+    async def _request(self, scope, body):
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        await self._app(scope, receive, send)
+        start = sent[0]
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in start["headers"]}
+        return AsgiResponse(start["status"], headers, b"".join(message.get("body", b"") for message in sent[1:]))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
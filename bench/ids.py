@@ -0,0 +1,122 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Compare the memory and pickling costs of holding a large action's asset ids
+as a list of strings, a set of strings, and an IdSet.
+
+Run with, for example:
+
+    python -m bench.ids --count 100000
+"""
+
+import argparse
+import json
+import pickle
+import time
+import tracemalloc
+import uuid
+
+from b2_iconik_plugin.ids import IdSet, IdSetBuilder
+
+
+def measure(build):
+    """
+    Returns:
+        The container that build returns, and the bytes it allocated
+    """
+    tracemalloc.start()
+    try:
+        container = build()
+        size, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return container, size
+
+
+def run(args):
+    ids = [str(uuid.uuid4()) for _ in range(args.count)]
+    # Containers of strings hold a fresh copy of each id, as decoded from JSON
+    builders = {
+        "list of str": lambda: [id_.encode().decode() for id_ in ids],
+        "set of str": lambda: {id_.encode().decode() for id_ in ids},
+        "IdSet": lambda: IdSet(ids),
+        "IdSetBuilder": lambda: _builder(ids),
+    }
+    report = {"count": args.count}
+    for name, build in builders.items():
+        container, size = measure(build)
+        start = time.perf_counter()
+        data = pickle.dumps(container) if name != "IdSetBuilder" else b""
+        pickle_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        if data:
+            pickle.loads(data)
+        unpickle_seconds = time.perf_counter() - start
+        # The first lookup in an IdSet sorts it
+        _ = ids[0] in container
+        start = time.perf_counter()
+        hits = sum(1 for id_ in ids[:args.lookups] if id_ in container)
+        lookup_seconds = time.perf_counter() - start
+        assert hits == min(args.lookups, args.count)
+        report[name] = {
+            "bytes": size,
+            "bytes_per_id": round(size / args.count, 1) if args.count else 0,
+            "pickled_bytes": len(data),
+            "pickle_seconds": round(pickle_seconds, 4),
+            "unpickle_seconds": round(unpickle_seconds, 4),
+            "lookup_microseconds": round(lookup_seconds / max(args.lookups, 1) * 1e6, 2),
+        }
+    return report
+
+
+def _builder(ids):
+    builder = IdSetBuilder()
+    builder.update(ids)
+    return builder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark containers for asset ids")
+    parser.add_argument("--count", type=int, default=100000,
+                        help="number of ids")
+    parser.add_argument("--lookups", type=int, default=1000,
+                        help="number of membership tests to time")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['count']} ids")
+        for name, result in report.items():
+            if name != "count":
+                print(f"  {name}:")
+                for key, value in result.items():
+                    print(f"    {key:>20}: {value}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
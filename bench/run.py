@@ -0,0 +1,234 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Benchmark the plugin's /add and /remove actions against the local iconik
+simulator.
+
+The plugin runs in-process, in one of three server modes:
+
+    sync   The Flask app in testing mode, so each action is processed
+           synchronously and its latency includes all the iconik calls,
+           including waiting for bulk jobs
+    spawn  The Flask app as it runs in gunicorn, scheduling each action in a
+           subprocess
+    asgi   The ASGI app, scheduling each action as an asyncio task
+
+In the spawn and asgi modes, latency is the time to accept each action, and
+the elapsed time runs until every action has been processed.
+
+Run with, for example:
+
+    python -m bench.run --action remove --depth 2 --fanout 3 --assets-per-collection 10 --latency 0.005
+    python -m bench.run --server asgi --actions 20 --concurrency 20
+"""
+
+import argparse
+import json
+import math
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from bench.asgi_client import AsgiClient
+from bench.simulator import IconikSimulator, IconikState, SimulatorConfig, make_id
+
+APP_ID = "BENCHMARK"
+AUTH_TOKEN = "BENCHMARK_TOKEN"
+SHARED_SECRET = "benchmark_secret"
+B2_STORAGE_ID = make_id("storage", "b2")
+LL_STORAGE_ID = make_id("storage", "ll")
+FORMAT_NAMES = ["ORIGINAL", "PPRO_PROXY"]
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def build_state(args):
+    """
+    Build one collection tree per action, so that every action has the same
+    amount of work to do
+    """
+    state = IconikState([B2_STORAGE_ID, LL_STORAGE_ID], FORMAT_NAMES, args.file_size)
+    # /add copies from B2 to LucidLink, /remove copies to B2 and deletes from LucidLink
+    source_storage_id = B2_STORAGE_ID if args.action == "add" else LL_STORAGE_ID
+    collection_ids = [
+        state.build_tree(source_storage_id, args.depth, args.fanout, args.assets_per_collection, name=f"action-{i}")
+        for i in range(args.actions)
+    ]
+    return state, collection_ids
+
+
+def assets_per_action(args):
+    collections = sum(args.fanout ** level for level in range(args.depth + 1))
+    return collections * args.assets_per_collection
+
+
+def run(args):
+    state, collection_ids = build_state(args)
+    config = SimulatorConfig(page_size=args.page_size,
+                             latency=args.latency,
+                             throttle_rate=args.throttle_rate,
+                             job_steps=args.job_steps,
+                             failure_rate=args.failure_rate,
+                             seed=args.seed)
+
+    with IconikSimulator(state, config) as simulator:
+        # The iconik module reads these when it is imported
+        os.environ["ICONIK_API_BASE"] = simulator.url
+        os.environ["ICONIK_JOB_POLL_INTERVAL"] = str(args.poll_interval)
+        os.environ["ICONIK_ID"] = APP_ID
+        os.environ["BZ_SHARED_SECRET"] = SHARED_SECRET
+        os.environ.setdefault("APP_LOG_LEVEL", "WARNING")
+        # Don't pick up actions left behind by a plugin on this machine
+        os.environ["HANDOFF_QUEUE"] = ""
+
+        from b2_iconik_plugin import scheduler
+        testing = args.server == "sync"
+
+        with ExitStack() as stack:
+            if args.server == "asgi":
+                from b2_iconik_plugin.asgi import create_app
+                client = stack.enter_context(AsgiClient(create_app({"TESTING": testing})))
+            else:
+                from b2_iconik_plugin.plugin import create_app
+                client = create_app({"TESTING": testing}).test_client()
+
+            def do_action(collection_id):
+                start = time.perf_counter()
+                try:
+                    response = client.post(
+                        f"/{args.action}?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}",
+                        json={
+                            "context": "COLLECTION",
+                            "asset_ids": [],
+                            "collection_ids": [collection_id],
+                            "auth_token": AUTH_TOKEN,
+                        },
+                        headers={"x-bz-secret": SHARED_SECRET})
+                    status_code = response.status_code
+                except Exception as ex:  # noqa
+                    # The test client propagates exceptions from the plugin; count them as failed actions
+                    print(f"Action on collection {collection_id} failed: {ex!r}")
+                    status_code = 500
+                return time.perf_counter() - start, status_code
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results = list(executor.map(do_action, collection_ids))
+            # Wait for the scheduled actions to be processed
+            while any(s.queued() or s.running() for s in scheduler.schedulers):
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+
+        latencies = [latency for latency, _ in results]
+        failures = sum(1 for _, status_code in results if status_code != 200)
+        total_assets = args.actions * assets_per_action(args)
+
+        return {
+            "server": args.server,
+            "action": args.action,
+            "actions": args.actions,
+            "assets_per_action": assets_per_action(args),
+            "concurrency": args.concurrency,
+            "failures": failures,
+            "elapsed_seconds": round(elapsed, 3),
+            "actions_per_second": round(args.actions / elapsed, 3),
+            "api_calls": simulator.total_calls,
+            "api_calls_per_asset": round(simulator.total_calls / total_assets, 2) if total_assets else 0,
+            "throttled_calls": simulator.throttled,
+            "not_modified_calls": simulator.not_modified,
+            "latency_p50_seconds": round(percentile(latencies, 50), 4),
+            "latency_p99_seconds": round(percentile(latencies, 99), 4),
+            "latency_mean_seconds": round(statistics.fmean(latencies), 4),
+            "calls_by_endpoint": {f"{method} {pattern}": count
+                                  for (method, pattern), count in sorted(simulator.calls.items())},
+        }
+
+
+def print_report(report):
+    for key, value in report.items():
+        if key != "calls_by_endpoint":
+            print(f"{key:>24}: {value}")
+    print("  calls by endpoint:")
+    for endpoint, count in report["calls_by_endpoint"].items():
+        print(f"    {count:>8}  {endpoint}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the plugin against a local iconik API simulator"
+    )
+    parser.add_argument("--action", choices=["add", "remove"], default="add",
+                        help="the plugin operation to benchmark")
+    parser.add_argument("--server", choices=["sync", "spawn", "asgi"], default="sync",
+                        help="how the plugin processes actions")
+    parser.add_argument("--actions", type=int, default=10,
+                        help="number of custom action requests to send")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="number of requests in flight at once")
+    parser.add_argument("--depth", type=int, default=1,
+                        help="levels of subcollections below each action's collection")
+    parser.add_argument("--fanout", type=int, default=2,
+                        help="subcollections per collection")
+    parser.add_argument("--assets-per-collection", type=int, default=5,
+                        help="assets in each collection")
+    parser.add_argument("--page-size", type=int, default=100,
+                        help="objects per page of collection contents")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds of latency added to each iconik call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="fraction of iconik calls answered with 429")
+    parser.add_argument("--job-steps", type=int, default=1,
+                        help="polls a job spends in each of QUEUED and STARTED")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of jobs that fail")
+    parser.add_argument("--poll-interval", type=float, default=0.01,
+                        help="seconds between job status polls")
+    parser.add_argument("--file-size", type=int, default=1024 * 1024,
+                        help="size of each simulated file in bytes")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="random seed for throttling and job failures")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
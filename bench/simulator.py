@@ -0,0 +1,399 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+A local stand-in for the parts of the iconik assets, files and jobs APIs that
+the plugin uses, so that we can measure the plugin's throughput without a live
+iconik instance.
+
+The simulator serves a configurable tree of collections and assets, paginates
+collection contents, adds latency to every call, optionally throttles calls
+with 429 responses, and moves bulk copy jobs through the
+QUEUED -> STARTED -> FINISHED/FAILED lifecycle as they are polled.
+"""
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+ASSETS_API = "/API/assets/v1"
+FILES_API = "/API/files/v1"
+JOBS_API = "/API/jobs/v1"
+
+UUID = "[0-9a-f-]+"
+
+# Namespace for deterministic object ids
+SIMULATOR_NAMESPACE = uuid.UUID("5b0e2d0e-3f0a-4c1d-9a52-8c1d2f0c9e11")
+
+
+def make_id(*parts):
+    return str(uuid.uuid5(SIMULATOR_NAMESPACE, "/".join(str(part) for part in parts)))
+
+
+class SimulatorConfig:
+    def __init__(self, page_size=100, latency=0.0, throttle_rate=0.0, job_steps=1, failure_rate=0.0,
+                 file_size=1024 * 1024, seed=None):
+        """
+        Args:
+            page_size (int): Number of objects per page of collection contents
+            latency (float): Seconds to wait before answering each call
+            throttle_rate (float): Fraction of calls that are answered with 429 Too Many Requests
+            job_steps (int): Number of polls a job spends in each of the QUEUED and STARTED states
+            failure_rate (float): Fraction of jobs that end up FAILED rather than FINISHED
+            file_size (int): Size, in bytes, of each simulated file
+            seed: Seed for the random number generator, for repeatable runs
+        """
+        self.page_size = page_size
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.job_steps = job_steps
+        self.failure_rate = failure_rate
+        self.file_size = file_size
+        self.seed = seed
+
+
+class IconikState:
+    """
+    The objects held by the simulator: storages, a collection tree, assets,
+    their formats and file sets, and jobs
+    """
+
+    def __init__(self, storage_ids, format_names, file_size):
+        self.storage_ids = set(storage_ids)
+        self.format_names = list(format_names)
+        self.file_size = file_size
+        # collection id -> list of {"id", "object_type"}
+        self.collections = {}
+        self.assets = set()
+        # (asset id, format id, storage id) -> list of file sets
+        self.file_sets = {}
+        self.jobs = {}
+
+    def format_id(self, asset_id, format_name):
+        return make_id(asset_id, format_name)
+
+    def add_asset(self, asset_id, storage_id):
+        """
+        Add an asset with a file set for every format on the given storage
+        """
+        self.assets.add(asset_id)
+        for format_name in self.format_names:
+            self.add_file_set(asset_id, format_name, storage_id)
+
+    def add_file_set(self, asset_id, format_name, storage_id):
+        key = (asset_id, self.format_id(asset_id, format_name), storage_id)
+        if not self.file_sets.get(key):
+            file_set_id = make_id(asset_id, format_name, storage_id, time.monotonic_ns())
+            self.file_sets[key] = [{
+                "id": file_set_id,
+                "format_id": key[1],
+                "storage_id": storage_id,
+                "status": "ACTIVE",
+                "file_count": 1,
+                "size": self.file_size,
+            }]
+
+    def delete_file_set(self, asset_id, file_set_id):
+        for key, file_sets in self.file_sets.items():
+            if key[0] == asset_id:
+                remaining = [file_set for file_set in file_sets if file_set["id"] != file_set_id]
+                if len(remaining) != len(file_sets):
+                    self.file_sets[key] = remaining
+                    return True
+        return False
+
+    def build_tree(self, storage_id, depth, fanout, assets_per_collection, name="root"):
+        """
+        Build a tree of collections, each with `fanout` subcollections down to
+        `depth` levels, and `assets_per_collection` assets in every collection.
+        Every asset has files for every format on the given storage. Trees with
+        different names have distinct collections and assets.
+        Returns:
+            The root collection id
+        """
+        def build(path, level):
+            collection_id = make_id("collection", path)
+            contents = []
+            if level < depth:
+                for i in range(fanout):
+                    child_id = build(f"{path}/{i}", level + 1)
+                    contents.append({"id": child_id, "object_type": "collections"})
+            for i in range(assets_per_collection):
+                asset_id = make_id("asset", path, i)
+                self.add_asset(asset_id, storage_id)
+                contents.append({"id": asset_id, "object_type": "assets"})
+            self.collections[collection_id] = contents
+            return collection_id
+
+        return build(name, 0)
+
+    def expand(self, object_ids, object_type):
+        """
+        Returns:
+            The ids of all the assets in, or below, the given objects
+        """
+        asset_ids = []
+        if object_type == "assets":
+            return [asset_id for asset_id in object_ids if asset_id in self.assets]
+        for collection_id in object_ids:
+            for obj in self.collections.get(collection_id, []):
+                asset_ids.extend(self.expand([obj["id"]], obj["object_type"]))
+        return asset_ids
+
+
+class IconikSimulator:
+    """
+    Serves the simulated iconik API from a background thread.
+
+    Usage:
+        with IconikSimulator(state, config) as simulator:
+            os.environ["ICONIK_API_BASE"] = simulator.url
+            ...
+            print(simulator.calls)
+    """
+
+    def __init__(self, state, config=None, host="127.0.0.1", port=0):
+        self.state = state
+        self.config = config or SimulatorConfig()
+        self.random = random.Random(self.config.seed)
+        self.calls = Counter()
+        self.throttled = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+        self.routes = [
+            ("GET", rf"{FILES_API}/storages/({UUID})/", self.get_storage),
+            ("GET", rf"{ASSETS_API}/collections/({UUID})/?", self.get_collection),
+            ("GET", rf"{ASSETS_API}/collections/({UUID})/contents/", self.get_collection_contents),
+            ("GET", rf"{FILES_API}/assets/({UUID})/formats/([A-Z_]+)/", self.get_format),
+            ("GET", rf"{FILES_API}/assets/({UUID})/formats/({UUID})/storages/({UUID})/file_sets/",
+             self.get_file_sets),
+            ("GET", rf"{FILES_API}/assets/({UUID})/file_sets/", self.get_asset_file_sets),
+            ("GET", rf"{FILES_API}/assets/({UUID})/files/", self.get_asset_files),
+            ("DELETE", rf"{FILES_API}/assets/({UUID})/file_sets/({UUID})/", self.delete_file_set),
+            ("DELETE", rf"{FILES_API}/assets/({UUID})/file_sets/({UUID})/purge/", self.purge_file_set),
+            ("POST", rf"{FILES_API}/storages/({UUID})/bulk/", self.bulk_copy),
+            ("GET", rf"{JOBS_API}/jobs/({UUID})/", self.get_job),
+        ]
+        self.server = ThreadingHTTPServer((host, port), self.make_request_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.throttled = 0
+            self.not_modified = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def make_request_handler(self):
+        simulator = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, so don't let Nagle's algorithm delay the body
+            disable_nagle_algorithm = True
+
+            def do_GET(self):  # noqa
+                simulator.dispatch(self, "GET")
+
+            def do_POST(self):  # noqa
+                simulator.dispatch(self, "POST")
+
+            def do_DELETE(self):  # noqa
+                simulator.dispatch(self, "DELETE")
+
+            def log_message(self, format, *args):  # noqa
+                # Keep benchmark output readable
+                pass
+
+        return RequestHandler
+
+    def dispatch(self, request_handler, method):
+        url = urlparse(request_handler.path)
+        length = int(request_handler.headers.get("Content-Length") or 0)
+        body = json.loads(request_handler.rfile.read(length)) if length else None
+
+        if self.config.latency:
+            time.sleep(self.config.latency)
+
+        with self.lock:
+            if self.config.throttle_rate and self.random.random() < self.config.throttle_rate:
+                self.throttled += 1
+                return self.respond(request_handler, 429, None, {"Retry-After": "0"})
+
+            for route_method, pattern, handler in self.routes:
+                match = re.fullmatch(pattern, url.path)
+                if route_method == method and match:
+                    self.calls[(method, pattern)] += 1
+                    status, payload = handler(parse_qs(url.query), body, *match.groups())
+                    if method == "GET" and status == 200:
+                        # Like iconik, tag responses so clients can revalidate them with If-None-Match
+                        etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest() + '"'
+                        if request_handler.headers.get("If-None-Match") == etag:
+                            self.not_modified += 1
+                            return self.respond(request_handler, 304, None, {"ETag": etag})
+                        return self.respond(request_handler, status, payload, {"ETag": etag})
+                    return self.respond(request_handler, status, payload)
+
+        return self.respond(request_handler, 404, {"errors": [f"No route for {method} {url.path}"]})
+
+    @staticmethod
+    def respond(request_handler, status, payload, headers=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        request_handler.send_response(status)
+        for name, value in (headers or {}).items():
+            request_handler.send_header(name, value)
+        request_handler.send_header("Content-Type", "application/json")
+        request_handler.send_header("Content-Length", str(len(data)))
+        request_handler.end_headers()
+        request_handler.wfile.write(data)
+
+    # Route handlers return (status, payload)
+
+    def get_storage(self, query, body, storage_id):
+        if storage_id not in self.state.storage_ids:
+            return 404, None
+        return 200, {"id": storage_id}
+
+    def get_collection(self, query, body, collection_id):
+        if collection_id not in self.state.collections:
+            return 404, None
+        return 200, {"id": collection_id, "date_modified": None}
+
+    def get_collection_contents(self, query, body, collection_id):
+        if collection_id not in self.state.collections:
+            return 404, None
+        object_types = query["object_types"][0].split(",") if "object_types" in query else None
+        contents = [obj for obj in self.state.collections[collection_id]
+                    if not object_types or obj["object_type"] in object_types]
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", [str(self.config.page_size)])[0])
+        start = (page - 1) * per_page
+        payload = {"objects": contents[start:start + per_page], "page": page, "per_page": per_page}
+        if start + per_page < len(contents):
+            next_query = f"page={page + 1}&per_page={per_page}"
+            if object_types:
+                next_query += f"&object_types={','.join(object_types)}"
+            payload["next_url"] = f"{ASSETS_API}/collections/{collection_id}/contents/?{next_query}"
+        return 200, payload
+
+    def get_format(self, query, body, asset_id, format_name):
+        if asset_id not in self.state.assets or format_name not in self.state.format_names:
+            return 404, None
+        return 200, {"id": self.state.format_id(asset_id, format_name), "name": format_name}
+
+    def get_file_sets(self, query, body, asset_id, format_id, storage_id):
+        return 200, {"objects": list(self.state.file_sets.get((asset_id, format_id, storage_id), []))}
+
+    def get_asset_file_sets(self, query, body, asset_id):
+        if asset_id not in self.state.assets:
+            return 404, None
+        return 200, {"objects": [file_set for key, file_sets in self.state.file_sets.items()
+                                 if key[0] == asset_id for file_set in file_sets]}
+
+    def get_asset_files(self, query, body, asset_id):
+        if asset_id not in self.state.assets:
+            return 404, None
+        # One file per file set, named after its format
+        files = []
+        for (file_asset_id, format_id, storage_id), file_sets in self.state.file_sets.items():
+            if file_asset_id == asset_id:
+                for file_set in file_sets:
+                    files.append({
+                        "id": make_id(file_set["id"], "file"),
+                        "format_id": format_id,
+                        "file_set_id": file_set["id"],
+                        "storage_id": storage_id,
+                        "original_name": f"{format_id}.mov",
+                        "directory_path": "",
+                        "size": file_set["size"],
+                        "status": "CLOSED",
+                    })
+        return 200, {"objects": files}
+
+    def delete_file_set(self, query, body, asset_id, file_set_id):
+        return (204 if self.state.delete_file_set(asset_id, file_set_id) else 404), None
+
+    def purge_file_set(self, query, body, asset_id, file_set_id):
+        # Deleting the file set already removed it from the simulator
+        return 204, None
+
+    def bulk_copy(self, query, body, storage_id):
+        if storage_id not in self.state.storage_ids:
+            return 404, None
+        job_id = make_id("job", len(self.state.jobs), time.monotonic_ns())
+        self.state.jobs[job_id] = {
+            "id": job_id,
+            "status": "QUEUED",
+            "polls": 0,
+            "storage_id": storage_id,
+            "format_name": body["format_name"],
+            "asset_ids": self.state.expand(body["object_ids"], body["object_type"]),
+        }
+        return 200, {"job_id": job_id, "success": f"Queued copying of file sets to storage {storage_id}"}
+
+    def get_job(self, query, body, job_id):
+        job = self.state.jobs.get(job_id)
+        if not job:
+            return 404, None
+        job["polls"] += 1
+        if job["status"] in ("QUEUED", "STARTED") and job["polls"] >= self.config.job_steps:
+            job["polls"] = 0
+            if job["status"] == "QUEUED":
+                job["status"] = "STARTED"
+            elif self.random.random() < self.config.failure_rate:
+                job["status"] = "FAILED"
+            else:
+                job["status"] = "FINISHED"
+                for asset_id in job["asset_ids"]:
+                    self.state.add_file_set(asset_id, job["format_name"], job["storage_id"])
+        return 200, {"id": job_id, "status": job["status"]}
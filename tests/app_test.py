@@ -20,9 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+
 import pytest
 
+from b2_iconik_plugin import common
 from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from b2_iconik_plugin.iconik import ICONIK_ASSETS_API
 from tests.test_common import *
 
 
@@ -42,7 +46,10 @@ def setup_secrets(request):
 
 
 @responses.activate
-def test_iconik_handler_add(client):
+def test_iconik_handler_add(client, monkeypatch):
+    monkeypatch.setattr(common, "CHECK_PRESENCE", True)
+    # Nothing is on LucidLink yet
+    set_asset_file_sets([])
     response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
                            json=PAYLOAD,
                            headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
@@ -53,6 +60,23 @@ def test_iconik_handler_add(client):
     assert_copy_call_counts(LL_STORAGE_ID, format_count=2)
 
 
+@responses.activate
+def test_iconik_handler_add_without_presence_check(client):
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+
+    assert 200 == response.status_code
+    # The asset and the collection are submitted for each format, without reading either
+    assert responses.assert_call_count(f'{ICONIK_FILES_API}/storages/{LL_STORAGE_ID}/bulk/', 4)
+    bulk_payloads = [json.loads(call.request.body) for call in responses.calls
+                     if call.request.url.endswith(f"/storages/{LL_STORAGE_ID}/bulk/")]
+    assert {("assets", (ASSET_ID,)), ("collections", (SUBCOLLECTION_ID,))} == {
+        (payload["object_type"], tuple(payload["object_ids"])) for payload in bulk_payloads}
+    assert responses.assert_call_count(f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/', 0)
+    assert responses.assert_call_count(f'{ICONIK_ASSETS_API}/collections/{SUBCOLLECTION_ID}/contents/', 0)
+
+
 @responses.activate
 def test_iconik_handler_remove(client):
     response = client.post(f'/remove?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
@@ -62,7 +86,37 @@ def test_iconik_handler_remove(client):
     assert 200 == response.status_code
     assert 'OK' == response.json
 
-    assert_copy_call_counts(B2_STORAGE_ID, format_count=1)
+    assert_remove_copy_call_counts(B2_STORAGE_ID)
+    assert_delete_call_counts()
+
+
+@responses.activate
+def test_iconik_handler_add_already_present(client, monkeypatch):
+    monkeypatch.setattr(common, "CHECK_PRESENCE", True)
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+
+    assert 200 == response.status_code
+    # Both formats are already on LucidLink, so there is nothing to copy
+    assert_copy_call_counts(LL_STORAGE_ID, format_count=0)
+    assert responses.assert_call_count(f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/', 1)
+
+
+@responses.activate
+def test_iconik_handler_remove_already_in_b2(client):
+    set_asset_file_sets([
+        (ORIGINAL_FILE_SET_ID, ORIGINAL_FORMAT_ID, LL_STORAGE_ID),
+        (PPRO_PROXY_FILE_SET_ID, PPRO_PROXY_FORMAT_ID, LL_STORAGE_ID),
+        (B2_ORIGINAL_FILE_SET_ID, ORIGINAL_FORMAT_ID, B2_STORAGE_ID),
+    ])
+    response = client.post(f'/remove?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+
+    assert 200 == response.status_code
+    # The original is already in B2, so its files are deleted without copying
+    assert_copy_call_counts(B2_STORAGE_ID, format_count=0)
     assert_delete_call_counts()
 
 
@@ -137,3 +191,20 @@ def test_iconik_handler_500(client):
                            json=PAYLOAD,
                            headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
     assert 500 == response.status_code
+
+
+@responses.activate
+def test_iconik_handler_413_too_large(client, monkeypatch):
+    monkeypatch.setattr(common, "MAX_REQUEST_BYTES", 100)
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=dict(PAYLOAD, asset_ids=[ASSET_ID] * 10),
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 413 == response.status_code
+
+
+@responses.activate
+def test_iconik_handler_400_invalid_id(client):
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=dict(PAYLOAD, asset_ids=["not-an-id"]),
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 400 == response.status_code
@@ -0,0 +1,135 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from b2_iconik_plugin import common, scheduler, workqueue
+from b2_iconik_plugin.asgi import create_app, task_runner
+from b2_iconik_plugin.common import IconikHandler, X_BZ_SHARED_SECRET
+from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.scheduler import Job
+from bench.asgi_client import AsgiClient
+from tests.test_common import *
+
+
+@pytest.fixture
+def asgi_client():
+    with AsgiClient(create_app({"TESTING": True})) as client:
+        yield client
+
+
+def test_root(asgi_client):
+    response = asgi_client.get("/")
+    assert 200 == response.status_code
+    assert b"ready for requests" in response.data
+
+
+def test_metrics(asgi_client):
+    response = asgi_client.get("/metrics")
+    assert 200 == response.status_code
+    assert b"b2_iconik_plugin_requests_in_progress" in response.data
+
+
+@responses.activate
+def test_add(asgi_client):
+    response = asgi_client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                                json=PAYLOAD,
+                                headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+
+    assert 200 == response.status_code
+    assert 'OK' == response.json
+    assert_whole_copy_call_counts(LL_STORAGE_ID)
+
+
+@responses.activate
+def test_unauthorized(asgi_client):
+    response = asgi_client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                                json=PAYLOAD,
+                                headers={X_BZ_SHARED_SECRET: "wrong"})
+
+    assert 401 == response.status_code
+    assert X_BZ_SHARED_SECRET == response.headers["www-authenticate"]
+
+
+@responses.activate
+def test_invalid_content(asgi_client):
+    response = asgi_client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                                data='This is not JSON!',
+                                headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 400 == response.status_code
+
+
+@responses.activate
+def test_actions_run_as_tasks(monkeypatch):
+    monkeypatch.setattr(workqueue, "HANDOFF_QUEUE", "")
+    with AsgiClient(create_app()) as client:
+        response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                               json=PAYLOAD,
+                               headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+        assert 200 == response.status_code
+
+        deadline = time.monotonic() + 30
+        while any(s.queued() or s.running() for s in scheduler.schedulers):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    assert_whole_copy_call_counts(LL_STORAGE_ID)
+    assert [] == scheduler.schedulers
+
+
+class WaitingHandler(IconikHandler):
+    """
+    Runs until it is asked to yield, then hands back all of its assets
+    """
+    def do_process(self, request, iconik, b2_storage, ll_storage, format_names):
+        deadline = time.monotonic() + 30
+        while not self.should_yield() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return {"asset_ids": request["asset_ids"]}
+
+
+def test_task_runner_preemption():
+    handler = WaitingHandler(Logger(), SHARED_SECRET, APP_ID, list(FORMATS))
+
+    async def run():
+        finished = asyncio.Event()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            runner = task_runner(handler, asyncio.get_running_loop(), executor, on_done=finished.set)
+            handle = runner(Job(dict(PAYLOAD), (None, None, None, list(FORMATS))))
+            assert not handle.done()
+            handle.preempt()
+            await asyncio.wait_for(finished.wait(), 30)
+            assert handle.done()
+            return handle.continuation()
+
+    assert [ASSET_ID] == asyncio.run(run())["asset_ids"]
+
+
+def test_too_large(asgi_client, monkeypatch):
+    monkeypatch.setattr(common, "MAX_REQUEST_BYTES", 100)
+    response = asgi_client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                                json=dict(PAYLOAD, asset_ids=[ASSET_ID] * 10),
+                                headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 413 == response.status_code
@@ -0,0 +1,95 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from b2_iconik_plugin.autoscaler import Autoscaler
+from b2_iconik_plugin.scheduler import BULK, Scheduler
+from tests.scheduler_test import FakeRunner, make_job
+from tests.test_common import FakeClock
+
+
+def test_scale_up_immediately():
+    scaler = Autoscaler(2, 10, 60, clock=FakeClock(0.0))
+    assert 7 == scaler.resize(2, 7)
+    assert 10 == scaler.resize(7, 25)
+
+
+def test_scale_down_is_damped():
+    clock = FakeClock(0.0)
+    scaler = Autoscaler(2, 10, 60, clock=clock)
+    assert 8 == scaler.resize(8, 3)
+    clock.now = 30
+    assert 8 == scaler.resize(8, 5)
+    clock.now = 59
+    assert 8 == scaler.resize(8, 1)
+    # Shrinks to the highest demand while it was low
+    clock.now = 61
+    assert 5 == scaler.resize(8, 1)
+
+
+def test_burst_cancels_scale_down():
+    clock = FakeClock(0.0)
+    scaler = Autoscaler(2, 10, 60, clock=clock)
+    assert 8 == scaler.resize(8, 1)
+    clock.now = 50
+    assert 8 == scaler.resize(8, 8)
+    clock.now = 70
+    assert 8 == scaler.resize(8, 1)
+    clock.now = 130
+    assert 2 == scaler.resize(8, 1)
+
+
+def test_invalid_bounds():
+    with pytest.raises(ValueError):
+        Autoscaler(5, 2, 60)
+
+
+def test_scheduler_autoscaling():
+    clock = FakeClock(0.0)
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=2, reserved_slots=1, tenant_max_concurrent=10,
+                      autoscaler=Autoscaler(2, 6, 60, clock=clock))
+    for i in range(8):
+        sched.submit(make_job(f"job{i}"))
+    sched.dispatch()
+    # Grows to the maximum, keeping one slot for interactive actions
+    assert 6 == sched.slots()
+    assert 5 == len(runner.started())
+    assert 3 == sched.queued(BULK)
+
+    for handle in runner.handles:
+        handle.finished = True
+    sched.dispatch()
+    assert 6 == sched.slots()
+    assert 8 == len(runner.started())
+
+    # Demand was 4 when it first fell, so the pool shrinks in two steps
+    for handle in runner.handles:
+        handle.finished = True
+    sched.dispatch()
+    clock.now = 61
+    sched.dispatch()
+    assert 4 == sched.slots()
+    clock.now = 122
+    sched.dispatch()
+    assert 2 == sched.slots()
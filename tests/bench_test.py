@@ -0,0 +1,86 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import os
+import subprocess
+import sys
+
+from bench.run import percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert 50 == percentile(values, 50)
+    assert 99 == percentile(values, 99)
+    assert 100 == percentile(values, 100)
+    assert 0.0 == percentile([], 50)
+
+
+def run_bench(*args, env=None):
+    # The plugin reads ICONIK_API_BASE at import time, so run the harness in its own interpreter
+    result = subprocess.run([sys.executable, "-m", "bench.run", "--json", *args],
+                            capture_output=True, text=True, check=True, env=dict(os.environ, **(env or {})))
+    return json.loads(result.stdout)
+
+
+def test_bench_add():
+    report = run_bench("--action", "add", "--actions", "2", "--depth", "1", "--fanout", "2",
+                       "--assets-per-collection", "2", "--page-size", "2")
+    assert 0 == report["failures"]
+    assert 6 == report["assets_per_action"]
+    assert report["api_calls"] > 0
+    assert report["latency_p99_seconds"] >= report["latency_p50_seconds"]
+
+
+def test_bench_remove_with_throttling():
+    report = run_bench("--action", "remove", "--actions", "2", "--depth", "1", "--fanout", "1",
+                       "--assets-per-collection", "2", "--throttle-rate", "0.2", "--job-steps", "2",
+                       "--seed", "42")
+    assert 0 == report["failures"]
+    assert report["throttled_calls"] > 0
+
+
+def test_bench_remove_with_cache_revalidation():
+    # Every cached response expires at once, so repeat reads are revalidated with If-None-Match
+    report = run_bench("--action", "remove", "--actions", "2", "--depth", "1", "--fanout", "1",
+                       "--assets-per-collection", "2",
+                       env={"ICONIK_CACHE_ENTRIES": "1000", "ICONIK_CACHE_TTL": "0.000001",
+                            "ICONIK_CACHE_LONG_TTL": "0.000001"})
+    assert 0 == report["failures"]
+    assert report["not_modified_calls"] > 0
+
+
+def test_bench_asgi():
+    report = run_bench("--server", "asgi", "--action", "add", "--actions", "2", "--concurrency", "2",
+                       "--depth", "1", "--fanout", "1", "--assets-per-collection", "2")
+    assert "asgi" == report["server"]
+    assert 0 == report["failures"]
+    assert report["api_calls"] > 0
+
+
+def test_bench_ids():
+    result = subprocess.run([sys.executable, "-m", "bench.ids", "--json", "--count", "1000", "--lookups", "10"],
+                            capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout)
+    assert report["IdSet"]["bytes_per_id"] < 17
+    assert report["IdSet"]["pickled_bytes"] < report["list of str"]["pickled_bytes"]
@@ -205,6 +205,66 @@ def setup_iconik_responses():
         status=200
     )
 
+    # Get asset file sets - the original and proxy are on LucidLink, but not yet on B2
+    responses.add(
+        method=responses.GET,
+        url=f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/',
+        json={"objects": [
+            {
+                "id": ORIGINAL_FILE_SET_ID,
+                "format_id": ORIGINAL_FORMAT_ID,
+                "storage_id": LL_STORAGE_ID,
+                "status": "ACTIVE"
+            },
+            {
+                "id": PPRO_PROXY_FILE_SET_ID,
+                "format_id": PPRO_PROXY_FORMAT_ID,
+                "storage_id": LL_STORAGE_ID,
+                "status": "ACTIVE"
+            },
+        ]},
+        status=200
+    )
+
+    # Get asset files - as they are once the original has been copied to B2
+    responses.add(
+        method=responses.GET,
+        url=f'{ICONIK_FILES_API}/assets/{ASSET_ID}/files/',
+        json={"objects": [
+            {
+                "id": ORIGINAL_FILE_ID,
+                "format_id": ORIGINAL_FORMAT_ID,
+                "file_set_id": ORIGINAL_FILE_SET_ID,
+                "storage_id": LL_STORAGE_ID,
+                "original_name": "clip.mov",
+                "directory_path": "",
+                "size": ORIGINAL_FILE_SIZE,
+                "status": "CLOSED"
+            },
+            {
+                "id": PPRO_PROXY_FILE_ID,
+                "format_id": PPRO_PROXY_FORMAT_ID,
+                "file_set_id": PPRO_PROXY_FILE_SET_ID,
+                "storage_id": LL_STORAGE_ID,
+                "original_name": "clip_proxy.mov",
+                "directory_path": "",
+                "size": PPRO_PROXY_FILE_SIZE,
+                "status": "CLOSED"
+            },
+            {
+                "id": B2_ORIGINAL_FILE_ID,
+                "format_id": ORIGINAL_FORMAT_ID,
+                "file_set_id": B2_ORIGINAL_FILE_SET_ID,
+                "storage_id": B2_STORAGE_ID,
+                "original_name": "clip.mov",
+                "directory_path": "",
+                "size": ORIGINAL_FILE_SIZE,
+                "status": "CLOSED"
+            },
+        ]},
+        status=200
+    )
+
     # Delete file sets
     responses.add(
         method=responses.DELETE,
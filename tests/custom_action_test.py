@@ -20,17 +20,26 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json
+from unittest.mock import patch
 from urllib.parse import urlparse, parse_qs
 
 import pytest
+import responses
 
 from b2_iconik_plugin.common import formats_match
-from b2_iconik_plugin.create_custom_actions import main as create_custom_actions, CONTEXTS
-from b2_iconik_plugin.delete_custom_actions import main as delete_custom_actions
-from b2_iconik_plugin.iconik import Iconik
+from b2_iconik_plugin.create_custom_actions import main as create_custom_actions, CONTEXTS, OPERATIONS, \
+    desired_actions, endpoint_actions, provision
+from b2_iconik_plugin import delete_custom_actions as delete_module
+from b2_iconik_plugin.delete_custom_actions import main as delete_custom_actions, delete_actions, \
+    delete_matching_actions
+from b2_iconik_plugin.iconik import Iconik, ICONIK_ASSETS_API
+from b2_iconik_plugin.reconcile_custom_actions import main as reconcile_custom_actions, CREATE, UPDATE, DELETE, \
+    action_key, diff, reconcile
 from tests.integration_test import B2_STORAGE_ID, LL_STORAGE_ID, ICONIK_ID, ICONIK_TOKEN, assert_environment_variables
 
 TEST_URL = 'http://1.2.3.4/'
+TEST_SECRET = 'top_secret'
 
 ACTION_ARGS = [
     (
@@ -118,6 +127,204 @@ def test_create_custom_actions_missing_args():
         create_custom_actions([])
 
 
+CONFIG = {
+    "endpoints": [
+        {
+            "url": "http://4.3.2.1",
+            "b2_storage_id": B2_STORAGE_ID,
+            "ll_storage_id": LL_STORAGE_ID,
+        },
+        {
+            "url": "http://4.3.2.2",
+            "b2_storage_id": B2_STORAGE_ID,
+            "ll_storage_id": LL_STORAGE_ID,
+            "formats": [None, "ORIGINAL", "ORIGINAL,PPRO_PROXY"],
+        },
+    ]
+}
+
+
+def add_custom_action_responses(status=200):
+    for context in CONTEXTS:
+        responses.add(method=responses.POST,
+                      url=f"{ICONIK_ASSETS_API}/custom_actions/{context}/",
+                      json={"id": context.lower()},
+                      status=status)
+
+
+def test_endpoint_actions():
+    actions = endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID, "ORIGINAL,PPRO_PROXY")
+
+    assert len(OPERATIONS) * len(CONTEXTS) == len(actions)
+    for action in actions:
+        url = urlparse(action["url"])
+        query_params = parse_qs(url.query)
+        assert url.path in ("/add", "/remove")
+        assert [B2_STORAGE_ID] == query_params["b2_storage_id"]
+        assert [LL_STORAGE_ID] == query_params["ll_storage_id"]
+        assert formats_match("ORIGINAL,PPRO_PROXY", query_params)
+        assert action["title"].startswith("Add original, Premiere Pro proxy file(s)") \
+            or action["title"].startswith("Remove original, Premiere Pro proxy file(s)")
+
+
+def test_desired_actions():
+    actions = desired_actions(CONFIG)
+
+    # One default format list for the first endpoint, three for the second
+    assert 4 * len(OPERATIONS) * len(CONTEXTS) == len(actions)
+    assert 4 * len(OPERATIONS) * len(CONTEXTS) == len({(action["context"], action["url"]) for action in actions})
+
+
+@responses.activate
+def test_provision():
+    add_custom_action_responses()
+    actions = desired_actions(CONFIG)
+    reported = []
+
+    results = provision(Iconik(ICONIK_ID, ICONIK_TOKEN), actions, ICONIK_ID, TEST_SECRET,
+                        concurrency=4, report=reported.append)
+
+    assert len(actions) == len(results)
+    assert len(actions) == len(reported)
+    for action, result in zip(actions, results):
+        assert action["url"] == result["url"]
+        assert action["context"].lower() == result["id"]
+        assert "error" not in result
+    assert len(actions) == len(responses.calls)
+    for call in responses.calls:
+        body = json.loads(call.request.body)
+        assert TEST_SECRET == body["headers"]["x-bz-secret"]
+        assert ICONIK_ID == body["app_id"]
+
+
+@responses.activate
+def test_provision_reports_failures():
+    add_custom_action_responses(status=400)
+    actions = endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID)
+
+    results = provision(Iconik(ICONIK_ID, ICONIK_TOKEN), actions, ICONIK_ID, TEST_SECRET)
+
+    assert len(actions) == len(results)
+    assert all("error" in result and "id" not in result for result in results)
+
+
+@responses.activate
+def test_create_custom_actions_from_config(tmp_path, capsys):
+    add_custom_action_responses()
+    config = tmp_path / "actions.json"
+    config.write_text(json.dumps(CONFIG))
+
+    results = create_custom_actions(["--config", str(config), "--concurrency", "2"])
+
+    assert len(desired_actions(CONFIG)) == len(results)
+    assert f"Creating {len(results)} actions" in capsys.readouterr().out
+
+
+@responses.activate
+def test_create_custom_actions_exits_on_failure(tmp_path):
+    add_custom_action_responses(status=500)
+
+    with pytest.raises(SystemExit) as system_exit:
+        create_custom_actions([TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID])
+    assert 1 == system_exit.value.code
+
+
+def existing_actions(actions, app_id=ICONIK_ID, shared_secret=TEST_SECRET):
+    return [
+        dict(action, id=f"action-{i}", type="POST", app_id=app_id, headers={"x-bz-secret": shared_secret})
+        for i, action in enumerate(actions)
+    ]
+
+
+def test_action_key_ignores_parameter_order_and_spaces():
+    assert action_key("ASSET", "http://4.3.2.1/add?b2_storage_id=a&ll_storage_id=b&formats=ORIGINAL%2CPPRO_PROXY") \
+        == action_key("ASSET", "http://4.3.2.1/add/?formats=ORIGINAL%2C+PPRO_PROXY&ll_storage_id=b&b2_storage_id=a")
+    assert action_key("ASSET", "http://4.3.2.1/add?formats=ORIGINAL") \
+        != action_key("BULK", "http://4.3.2.1/add?formats=ORIGINAL")
+    assert action_key("ASSET", "http://4.3.2.1/add?formats=ORIGINAL") \
+        != action_key("ASSET", "http://4.3.2.1/add")
+
+
+def test_diff_no_changes():
+    actions = desired_actions(CONFIG)
+
+    assert [] == diff(existing_actions(actions), actions, ICONIK_ID, TEST_SECRET)
+
+
+def test_diff():
+    actions = desired_actions(CONFIG)
+    existing = existing_actions(actions)
+    # Renamed, secret rotated, removed from iconik, and two that aren't wanted
+    existing[0]["title"] = "Old title"
+    existing[1]["headers"]["x-bz-secret"] = "old_secret"
+    missing = existing.pop(2)
+    unwanted = existing_actions(endpoint_actions("http://4.3.2.2", B2_STORAGE_ID, LL_STORAGE_ID, "EDIT_PROXY"))
+    duplicate = dict(existing[3], id="duplicate")
+    other = existing_actions(endpoint_actions("http://4.3.2.9", B2_STORAGE_ID, LL_STORAGE_ID))
+    # Someone else's actions on the same host as one of ours
+    webhook = dict(existing[4], id="webhook", url="http://4.3.2.1/webhook")
+    no_url = {"id": "no_url", "context": "ASSET", "title": "Not a URL action"}
+    existing += unwanted + [duplicate] + other + [webhook, no_url]
+
+    changes = diff(existing, actions, ICONIK_ID, TEST_SECRET)
+
+    by_change = {change: [c for c in changes if c["change"] == change] for change in (CREATE, UPDATE, DELETE)}
+    assert [existing[0]["id"], existing[1]["id"]] == [c["existing"]["id"] for c in by_change[UPDATE]]
+    assert [actions[0], actions[1]] == [c["action"] for c in by_change[UPDATE]]
+    assert [missing["url"]] == [c["action"]["url"] for c in by_change[CREATE]]
+    assert {a["id"] for a in unwanted} | {"duplicate"} == {c["existing"]["id"] for c in by_change[DELETE]}
+
+
+@responses.activate
+def test_reconcile():
+    actions = desired_actions(CONFIG)
+    existing = existing_actions(actions)
+    existing[0]["title"] = "Old title"
+    missing = existing.pop(1)
+    unwanted = existing_actions(endpoint_actions("http://4.3.2.1", B2_STORAGE_ID, LL_STORAGE_ID, "EDIT_PROXY"))[:2]
+    existing += unwanted
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": existing}, status=200)
+    responses.add(method=responses.PUT,
+                  url=f"{ICONIK_ASSETS_API}/custom_actions/{existing[0]['context']}/{existing[0]['id']}/",
+                  json=existing[0], status=200)
+    responses.add(method=responses.POST, url=f"{ICONIK_ASSETS_API}/custom_actions/{missing['context']}/",
+                  json={"id": "created"}, status=200)
+    # Deleting an action that's already gone is fine
+    responses.add(method=responses.DELETE,
+                  url=f"{ICONIK_ASSETS_API}/custom_actions/{unwanted[0]['context']}/{unwanted[0]['id']}",
+                  status=204)
+    responses.add(method=responses.DELETE,
+                  url=f"{ICONIK_ASSETS_API}/custom_actions/{unwanted[1]['context']}/{unwanted[1]['id']}",
+                  status=404)
+
+    results = reconcile(Iconik(ICONIK_ID, ICONIK_TOKEN), actions, ICONIK_ID, TEST_SECRET, concurrency=4)
+
+    assert 4 == len(results)
+    assert all("error" not in result for result in results)
+    assert "created" in [result["id"] for result in results]
+    # One listing, then one request per change
+    assert 5 == len(responses.calls)
+
+
+@responses.activate
+def test_reconcile_custom_actions_dry_run(capsys):
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": []}, status=200)
+
+    changes = reconcile_custom_actions([TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID, "--dry-run"])
+
+    assert len(OPERATIONS) * len(CONTEXTS) == len(changes)
+    assert all(CREATE == change["change"] for change in changes)
+    assert 1 == len(responses.calls)
+    assert f"{len(changes)} changes" in capsys.readouterr().out
+
+
+def test_reconcile_custom_actions_missing_args():
+    with pytest.raises(SystemExit):
+        reconcile_custom_actions([TEST_URL, B2_STORAGE_ID])
+
+
 @pytest.mark.integration
 @pytest.mark.parametrize("url,b2_storage_id,ll_storage_id,formats,add_title,remove_title,assert_environment_variables",
                          ACTION_ARGS, indirect=['assert_environment_variables'])
@@ -139,3 +346,105 @@ def test_delete_custom_actions_missing_args():
     with pytest.raises(SystemExit):
         delete_custom_actions([])
 2
+
+
+def delete_url(action):
+    return f"{ICONIK_ASSETS_API}/custom_actions/{action['context']}/{action['id']}"
+
+
+@responses.activate
+@patch.object(delete_module, "RETRY_DELAY", 0)
+def test_delete_actions_retries_transient_errors():
+    actions = existing_actions(endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID))[:4]
+    # Succeeds after a retry, already deleted, fails permanently, fails every retry
+    responses.add(method=responses.DELETE, url=delete_url(actions[0]), status=503)
+    responses.add(method=responses.DELETE, url=delete_url(actions[0]), status=204)
+    responses.add(method=responses.DELETE, url=delete_url(actions[1]), status=404)
+    responses.add(method=responses.DELETE, url=delete_url(actions[2]), status=403)
+    responses.add(method=responses.DELETE, url=delete_url(actions[3]), status=500)
+    reported = []
+
+    results = delete_actions(Iconik(ICONIK_ID, ICONIK_TOKEN), iter(actions), concurrency=2, report=reported.append)
+
+    assert [a["id"] for a in actions] == [r["id"] for r in results]
+    assert [False, False, True, True] == ["error" in result for result in results]
+    assert 4 == len(reported)
+    assert 2 == len([c for c in responses.calls if c.request.url == delete_url(actions[0])])
+    assert 1 + delete_module.DELETE_RETRIES == \
+        len([c for c in responses.calls if c.request.url == delete_url(actions[3])])
+
+
+@responses.activate
+def test_delete_matching_actions_lists_again():
+    actions = existing_actions(endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID))
+    other = existing_actions(endpoint_actions("http://4.3.2.9", B2_STORAGE_ID, LL_STORAGE_ID))
+    # The first listing misses an action, as if a page shifted under us
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": actions[1:] + other}, status=200)
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": actions[:1] + other}, status=200)
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": other}, status=200)
+    for action in actions:
+        responses.add(method=responses.DELETE, url=delete_url(action), status=204)
+
+    results = delete_matching_actions(Iconik(ICONIK_ID, ICONIK_TOKEN), TEST_URL)
+
+    assert {a["id"] for a in actions} == {r["id"] for r in results}
+    assert all("error" not in result for result in results)
+
+
+@responses.activate
+@patch.object(delete_module, "RETRY_DELAY", 0)
+def test_delete_custom_actions_exits_on_partial_failure(capsys):
+    actions = existing_actions(endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID))
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": actions}, status=200)
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": actions[:1]}, status=200)
+    responses.add(method=responses.DELETE, url=delete_url(actions[0]), status=403)
+    for action in actions[1:]:
+        responses.add(method=responses.DELETE, url=delete_url(action), status=204)
+
+    with pytest.raises(SystemExit) as system_exit:
+        delete_custom_actions([TEST_URL])
+
+    assert 1 == system_exit.value.code
+    assert f"Deleted {len(actions) - 1} actions, 1 failed" in capsys.readouterr().out
+
+
+@responses.activate
+@patch.object(delete_module, "RETRY_DELAY", 0)
+def test_delete_matching_actions_retries_listing():
+    actions = existing_actions(endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID))
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/", status=502)
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": actions}, status=200)
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": []}, status=200)
+    for action in actions:
+        responses.add(method=responses.DELETE, url=delete_url(action), status=204)
+
+    results = delete_matching_actions(Iconik(ICONIK_ID, ICONIK_TOKEN), TEST_URL)
+
+    assert {a["id"] for a in actions} == {r["id"] for r in results}
+
+
+@responses.activate
+@patch.object(delete_module, "RETRY_DELAY", 0)
+def test_delete_custom_actions_exits_when_listing_fails(capsys):
+    actions = existing_actions(endpoint_actions(TEST_URL, B2_STORAGE_ID, LL_STORAGE_ID))
+    # The first page is read, but the second never is
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/",
+                  json={"objects": actions, "next_url": "/API/assets/v1/custom_actions/?page=2"}, status=200)
+    responses.add(method=responses.GET, url=f"{ICONIK_ASSETS_API}/custom_actions/?page=2", status=503)
+    for action in actions:
+        responses.add(method=responses.DELETE, url=delete_url(action), status=204)
+
+    with pytest.raises(SystemExit) as system_exit:
+        delete_custom_actions([TEST_URL])
+
+    assert 1 == system_exit.value.code
+    out = capsys.readouterr().out
+    assert "Could not list custom actions" in out
+    assert f"Deleted {len(actions)} actions, 0 failed" in out
@@ -0,0 +1,228 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import threading
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+import responses
+
+from b2_iconik_plugin import delete_queue
+from b2_iconik_plugin.delete_queue import DeleteQueue, deleted_at, main as purge_delete_queue
+from b2_iconik_plugin.iconik import Iconik, ICONIK_ASSETS_API
+from tests.test_common import *
+
+DELETE_QUEUE_URL = f"{ICONIK_ASSETS_API}/delete_queue/assets/"
+PURGE_URL = f"{ICONIK_ASSETS_API}/delete_queue/assets/purge/"
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc).timestamp()
+DAY = 24 * 60 * 60
+
+
+def entry(days_ago, **kwargs):
+    date = datetime.fromtimestamp(NOW - days_ago * DAY, tz=timezone.utc).isoformat()
+    return dict({"id": new_id(), "date_deleted": date}, **kwargs)
+
+
+def make_queue(**kwargs):
+    return DeleteQueue(Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN), clock=lambda: NOW, **kwargs)
+
+
+def add_purge_callback(purged, status=lambda ids: 200):
+    def callback(request):
+        ids = json.loads(request.body)["ids"]
+        code = status(ids)
+        if code == 200:
+            purged.append(ids)
+        return code, {}, ""
+    responses.add_callback(responses.POST, PURGE_URL, callback=callback)
+
+
+def test_deleted_at():
+    assert NOW == deleted_at({"date_deleted": "2025-06-01T00:00:00Z"})
+    assert NOW == deleted_at({"date_deleted": "2025-06-01T00:00:00"})
+    assert NOW == deleted_at({"date_modified": "2025-06-01T00:00:00+00:00"})
+    assert deleted_at({}) is None
+
+
+@responses.activate
+def test_entries_filters_by_age_and_predicate():
+    old, recent, undated, old_video = entry(10), entry(1), {"id": new_id()}, entry(10, type="VIDEO")
+    responses.add(method=responses.GET, url=DELETE_QUEUE_URL,
+                  json={"objects": [old, recent, undated, old_video]}, status=200)
+    queue = make_queue()
+
+    assert [old, recent, undated, old_video] == list(queue.entries())
+    assert [old, old_video] == list(queue.entries(older_than=7 * DAY))
+    assert [old_video] == list(queue.entries(older_than=7 * DAY, predicate=lambda e: e.get("type") == "VIDEO"))
+
+
+@responses.activate
+def test_purge_in_chunks():
+    purged = []
+    add_purge_callback(purged)
+    ids = [new_id() for _ in range(7)]
+
+    result = make_queue(chunk_size=3, concurrency=2).purge(ids)
+
+    assert {"done": 7, "failed": []} == result
+    assert [3, 3, 1] == sorted((len(chunk) for chunk in purged), reverse=True)
+    assert set(ids) == {id_ for chunk in purged for id_ in chunk}
+
+
+@responses.activate
+def test_purge_splits_chunks_that_are_too_large():
+    purged = []
+    add_purge_callback(purged, status=lambda ids: 413 if len(ids) > 2 else 200)
+    ids = [new_id() for _ in range(8)]
+
+    result = make_queue(chunk_size=8).purge(ids)
+
+    assert {"done": 8, "failed": []} == result
+    assert all(len(chunk) <= 2 for chunk in purged)
+
+
+@responses.activate
+def test_purge_remembers_chunk_size():
+    purged = []
+    add_purge_callback(purged, status=lambda ids: 413 if len(ids) > 2 else 200)
+    queue = make_queue(chunk_size=8, concurrency=1)
+
+    assert {"done": 8, "failed": []} == queue.purge([new_id() for _ in range(8)])
+    assert 2 == queue.chunk_size
+
+    # Later chunks are sent at the size that worked
+    purged.clear()
+    calls = len(responses.calls)
+    assert {"done": 5, "failed": []} == queue.purge([new_id() for _ in range(5)])
+    assert [2, 2, 1] == sorted((len(chunk) for chunk in purged), reverse=True)
+    assert 3 == len(responses.calls) - calls
+
+
+@responses.activate
+@patch.object(delete_queue, "RETRY_DELAY", 0)
+def test_purge_retries_timeouts_without_splitting():
+    ids = [new_id() for _ in range(4)]
+    purged = []
+    attempts = []
+    add_purge_callback(purged, status=lambda chunk: attempts.append(chunk) or (504 if len(attempts) == 1 else 200))
+
+    queue = make_queue(chunk_size=4)
+
+    assert {"done": 4, "failed": []} == queue.purge(ids)
+    assert [ids] == purged
+    assert 4 == queue.chunk_size
+
+
+@responses.activate
+@patch.object(delete_queue, "RETRY_DELAY", 0)
+def test_purge_stops_after_repeated_failures():
+    ids = [new_id() for _ in range(20)]
+    attempts = []
+    add_purge_callback([], status=lambda chunk: attempts.append(chunk) or 503)
+    queue = make_queue(chunk_size=2, concurrency=1)
+
+    result = queue.purge(iter(ids))
+
+    assert queue.tripped
+    assert 0 == result["done"]
+    assert delete_queue.MAX_CONSECUTIVE_FAILURES * (delete_queue.RETRIES + 1) == len(attempts)
+    assert len(result["failed"]) < len(ids)
+
+
+@responses.activate
+@patch.object(delete_queue, "RETRY_DELAY", 0)
+def test_purge_retries_transient_errors():
+    ids = [new_id() for _ in range(4)]
+    bad = set(ids[2:])
+    attempts = []
+
+    def status(chunk):
+        attempts.append(chunk)
+        if bad & set(chunk):
+            return 400
+        # Fail the first attempt at each good chunk
+        return 503 if attempts.count(chunk) == 1 else 200
+
+    purged = []
+    add_purge_callback(purged, status=status)
+
+    result = make_queue(chunk_size=2).purge(ids)
+
+    assert 2 == result["done"]
+    assert sorted(bad) == sorted(result["failed"])
+    assert [ids[:2]] == purged
+
+
+@responses.activate
+def test_purge_matching_reads_queue_again():
+    entries = [entry(10) for _ in range(3)]
+    # The first read misses an entry, as if a page shifted under us
+    responses.add(method=responses.GET, url=DELETE_QUEUE_URL, json={"objects": entries[1:]}, status=200)
+    responses.add(method=responses.GET, url=DELETE_QUEUE_URL, json={"objects": entries[:1]}, status=200)
+    responses.add(method=responses.GET, url=DELETE_QUEUE_URL, json={"objects": []}, status=200)
+    purged = []
+    add_purge_callback(purged)
+
+    result = make_queue().purge_matching(older_than=DAY)
+
+    assert {"done": 3, "failed": []} == result
+    assert {e["id"] for e in entries} == {id_ for chunk in purged for id_ in chunk}
+
+
+@responses.activate
+def test_add():
+    added = []
+
+    def callback(request):
+        added.append(json.loads(request.body)["ids"])
+        return 200, {}, ""
+    responses.add_callback(responses.POST, DELETE_QUEUE_URL, callback=callback)
+    ids = [new_id() for _ in range(5)]
+
+    assert {"done": 5, "failed": []} == make_queue(chunk_size=2).add(iter(ids))
+    assert sorted(ids) == sorted(id_ for chunk in added for id_ in chunk)
+
+
+@responses.activate
+def test_compact_until_stopped():
+    responses.add(method=responses.GET, url=DELETE_QUEUE_URL, json={"objects": [entry(10)]}, status=200)
+    responses.add(method=responses.GET, url=DELETE_QUEUE_URL, json={"objects": []}, status=200)
+    purged = []
+    add_purge_callback(purged)
+    stop_event = threading.Event()
+    results = []
+
+    def report(result):
+        results.append(result)
+        stop_event.set()
+
+    make_queue().compact(DAY, interval=0, stop_event=stop_event, report=report)
+
+    assert [{"done": 1, "failed": []}] == results
+
+
+def test_compact_requires_older_than():
+    with pytest.raises(SystemExit):
+        purge_delete_queue(["--compact"])
@@ -0,0 +1,330 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import warnings
+
+import pytest
+
+from b2_iconik_plugin import eviction
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET, IconikHandler
+from b2_iconik_plugin.eviction import AccessLog, Evictor, LruIndex, parse_size
+from b2_iconik_plugin.iconik import Iconik
+from b2_iconik_plugin.ids import IdSet
+from b2_iconik_plugin.logger import Logger
+from tests.test_common import *
+
+
+class FakeIconik:
+    """Just the format and file reads and remove calls that the evictor makes"""
+
+    def __init__(self):
+        # asset id -> bytes on LucidLink
+        self.sizes = {}
+        self.size_reads = []
+        self.removed = []
+        # Assets that can't be copied to B2
+        self.failing = set()
+
+    def get_format(self, asset_id, format_name):
+        return {"id": FORMATS[format_name]}
+
+    def get_asset_files(self, asset_id):
+        self.size_reads.append(asset_id)
+        return [
+            {"format_id": ORIGINAL_FORMAT_ID, "storage_id": LL_STORAGE_ID, "size": self.sizes.get(asset_id, 0)},
+            # Neither a file in B2 nor one of another format counts
+            {"format_id": ORIGINAL_FORMAT_ID, "storage_id": B2_STORAGE_ID, "size": 1000},
+            {"format_id": new_id(), "storage_id": LL_STORAGE_ID, "size": 1000},
+        ]
+
+    def remove_assets(self, asset_ids, format_names, b2_storage_id, ll_storage_id):
+        assert (B2_STORAGE_ID, LL_STORAGE_ID) == (b2_storage_id, ll_storage_id)
+        removed = [asset_id for asset_id in asset_ids if asset_id not in self.failing]
+        if removed:
+            self.removed.append(removed)
+        return IdSet(asset_id for asset_id in asset_ids if asset_id in self.failing), IdSet()
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = AccessLog(str(tmp_path / "eviction.db"))
+    yield log
+    log.close()
+
+
+def make_evictor(iconik, log, high, low, **kwargs):
+    return Evictor(iconik, log, FORMAT_NAMES, B2_STORAGE_ID, LL_STORAGE_ID, high, low, **kwargs)
+
+
+def add_assets(iconik, log, sizes):
+    asset_ids = []
+    for when, size in enumerate(sizes):
+        asset_id = new_id()
+        iconik.sizes[asset_id] = size
+        log.record([asset_id], when=when)
+        asset_ids.append(asset_id)
+    return asset_ids
+
+
+def test_lru_index_pops_oldest_first():
+    index = LruIndex()
+    index.touch("a", 3)
+    index.touch("b", 1)
+    index.touch("c", 2)
+    # Touching b again moves it behind the others
+    index.touch("b", 4)
+    index.remove("c")
+
+    assert 2 == len(index)
+    assert ("a", 3) == index.pop()
+    assert ("b", 4) == index.pop()
+    assert index.pop() is None
+
+
+def test_lru_index_discards_superseded_entries():
+    index = LruIndex()
+    for when in range(1000):
+        index.touch("a", when)
+
+    assert len(index._heap) < 100
+    assert ("a", 999) == index.pop()
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("1024", 1024),
+    ("2K", 2048),
+    ("1.5G", 3 * 1024 ** 3 // 2),
+    ("2TiB", 2 * 1024 ** 4),
+])
+def test_parse_size(value, expected):
+    assert expected == parse_size(value)
+
+
+def test_parse_size_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_access_log_changes(log):
+    a, b = new_id(), new_id()
+    log.record([a, b], when=1)
+    version, rows = log.changes(0)
+    assert [(a, 1, None, False), (b, 1, None, False)] == rows
+
+    log.set_bytes(a, 100)
+    with warnings.catch_warnings():
+        # Positional parameters for named placeholders are deprecated
+        warnings.simplefilter("error")
+        log.forget([b])
+    version, rows = log.changes(version)
+    assert [(b, 1, None, True)] == rows
+
+    # Nothing has changed since
+    assert (version, []) == log.changes(version)
+
+
+def test_nothing_is_evicted_below_the_high_watermark(log):
+    iconik = FakeIconik()
+    add_assets(iconik, log, [100, 100, 100])
+
+    result = make_evictor(iconik, log, high=300, low=100).run_once()
+
+    assert {"usage_before": 300, "usage_after": 300, "evicted": 0, "failed": False} == result
+    assert [] == iconik.removed
+
+
+def test_least_recently_used_assets_are_evicted(log):
+    iconik = FakeIconik()
+    a, b, c, d = add_assets(iconik, log, [100, 100, 100, 100])
+    # a was added again most recently
+    log.record([a], when=10)
+
+    result = make_evictor(iconik, log, high=300, low=200).run_once()
+
+    assert {"usage_before": 400, "usage_after": 200, "evicted": 2, "failed": False} == result
+    assert [[b, c]] == iconik.removed
+    # The evicted assets are forgotten
+    _version, rows = log.changes(0)
+    assert sorted([a, d]) == sorted(asset_id for asset_id, _last_access, _bytes, removed in rows if not removed)
+
+
+def test_evictions_are_batched(log):
+    iconik = FakeIconik()
+    asset_ids = add_assets(iconik, log, [10] * 10)
+
+    make_evictor(iconik, log, high=50, low=0, batch_size=4).run_once()
+
+    assert [asset_ids[:4], asset_ids[4:8], asset_ids[8:]] == iconik.removed
+
+
+def test_sizes_are_read_once(log):
+    iconik = FakeIconik()
+    a, b = add_assets(iconik, log, [100, 100])
+    evictor = make_evictor(iconik, log, high=1000, low=500)
+    evictor.run_once()
+    evictor.run_once()
+    assert sorted([a, b]) == sorted(iconik.size_reads)
+
+    # Adding an asset again reads its size afresh
+    iconik.sizes[a] = 300
+    log.record([a], when=10)
+    assert {"usage_before": 400, "usage_after": 400, "evicted": 0, "failed": False} == evictor.run_once()
+    assert 3 == len(iconik.size_reads)
+
+    # So does a new evictor, since sizes are kept in the log
+    make_evictor(iconik, log, high=1000, low=500).run_once()
+    assert 3 == len(iconik.size_reads)
+
+
+def test_sizes_are_read_until_they_settle(tmp_path):
+    clock = FakeClock()
+    log = AccessLog(str(tmp_path / "eviction.db"), clock=clock)
+    iconik = FakeIconik()
+    a = new_id()
+    log.record([a])
+    evictor = make_evictor(iconik, log, high=1000, low=500, settle_time=60)
+
+    # The copy job hasn't written anything yet
+    evictor.run_once()
+    assert 0 == evictor.usage
+
+    iconik.sizes[a] = 300
+    clock.now += 30
+    evictor.run_once()
+    assert 300 == evictor.usage
+    assert a in evictor.unsettled
+
+    # Once the asset has settled, its size is kept in the log and not read again
+    iconik.sizes[a] = 400
+    clock.now += 30
+    evictor.run_once()
+    evictor.run_once()
+    assert 400 == evictor.usage
+    assert 3 == len(iconik.size_reads)
+    _version, rows = log.changes(0)
+    assert [(a, 1000, 400, False)] == rows
+    log.close()
+
+
+def test_removed_assets_stop_counting(log):
+    iconik = FakeIconik()
+    a, b = add_assets(iconik, log, [100, 100])
+    evictor = make_evictor(iconik, log, high=150, low=100)
+    evictor.refresh()
+    assert 200 == evictor.usage
+
+    log.forget([a])
+    result = evictor.run_once()
+
+    assert {"usage_before": 100, "usage_after": 100, "evicted": 0, "failed": False} == result
+    assert a not in evictor.index
+
+
+def test_failed_evictions_are_held_back(tmp_path):
+    clock = FakeClock()
+    log = AccessLog(str(tmp_path / "eviction.db"), clock=clock)
+    iconik = FakeIconik()
+    a, b, c = add_assets(iconik, log, [100, 100, 100])
+    evictor = make_evictor(iconik, log, high=150, low=100, retry_delay=60)
+    iconik.failing = {a}
+
+    # a can't be copied, but the cycle carries on with the next assets
+    assert {"usage_before": 300, "usage_after": 100, "evicted": 2, "failed": True} == evictor.run_once()
+    assert [[b], [c]] == iconik.removed
+    assert a in evictor.quarantine
+
+    # a isn't picked first while it is held back, even though it is the oldest
+    d = new_id()
+    iconik.sizes[d] = 100
+    log.record([d], when=5)
+    assert 1 == evictor.run_once()["evicted"]
+    assert [d] == iconik.removed[-1]
+
+    # Once the delay has passed, it is tried again
+    iconik.failing = set()
+    clock.now += 60
+    e = new_id()
+    iconik.sizes[e] = 100
+    log.record([e], when=6)
+    assert {"usage_before": 200, "usage_after": 100, "evicted": 1, "failed": False} == evictor.run_once()
+    assert [a] == iconik.removed[-1]
+    assert a not in evictor.failures
+    log.close()
+
+
+def test_watermarks_are_checked(log):
+    with pytest.raises(ValueError):
+        make_evictor(FakeIconik(), log, high=100, low=200)
+
+
+@pytest.fixture
+def recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(eviction, "EVICTION_STATE", f"sqlite:///{tmp_path / 'eviction.db'}")
+    monkeypatch.setattr(eviction, "_access_log", None)
+    yield eviction.access_log()
+    eviction.access_log().close()
+
+
+@responses.activate
+def test_add_is_recorded(client, recording):
+    set_asset_file_sets([])
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 200 == response.status_code
+
+    _version, rows = recording.changes(0)
+    assert ASSET_ID in {asset_id for asset_id, _last_access, _bytes, removed in rows if not removed}
+
+
+@responses.activate
+def test_remove_is_recorded(client, recording):
+    recording.record([ASSET_ID])
+    response = client.post(f'/remove?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 200 == response.status_code
+
+    _version, rows = recording.changes(0)
+    assert [(ASSET_ID, True)] == [(asset_id, removed) for asset_id, _last_access, _bytes, removed in rows
+                                  if asset_id == ASSET_ID]
+
+
+def test_remove_records_assets_that_were_removed(recording, monkeypatch):
+    handler = IconikHandler(Logger(), SHARED_SECRET, APP_ID, FORMAT_NAMES, testing=True)
+    client = Iconik(APP_ID, AUTH_TOKEN)
+    # BAD_ASSET_ID couldn't be copied to B2, so kept its files
+    monkeypatch.setattr(client, "remove_assets", lambda asset_ids, **kwargs: (IdSet([BAD_ASSET_ID]), IdSet()))
+    recording.record([ASSET_ID, BAD_ASSET_ID])
+    request = dict(PAYLOAD, action="remove", asset_ids=IdSet([ASSET_ID, BAD_ASSET_ID]), collection_ids=[])
+
+    handler.process(request, client, {"id": B2_STORAGE_ID}, {"id": LL_STORAGE_ID}, FORMAT_NAMES)
+
+    _version, rows = recording.changes(0)
+    assert {ASSET_ID: True, BAD_ASSET_ID: False} == {asset_id: removed for asset_id, _last_access, _bytes, removed
+                                                     in rows}
+
+
+def test_recording_is_off_by_default():
+    assert eviction.access_log() is None
+    eviction.record_added([ASSET_ID])
@@ -0,0 +1,286 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pickle
+
+import responses
+from responses import matchers
+
+from b2_iconik_plugin import httpcache, iconik
+from b2_iconik_plugin.httpcache import CachedResponse, ResponseCache, invalidation_prefix, make_key, ttl_for
+from tests.test_common import *
+
+STORAGE_URL = f"{iconik.ICONIK_FILES_API}/storages/{LL_STORAGE_ID}/"
+FORMAT_URL = f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/formats/{ORIGINAL_FORMAT_NAME}/"
+FILE_SETS_URL = f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/"
+
+
+def entry(url, body=b"{}", expires=2000.0):
+    return CachedResponse(url, 200, {"Content-Type": "application/json"}, body, expires)
+
+
+def cached_client(cache=None):
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    client.cache = cache if cache is not None else ResponseCache(100)
+    return client
+
+
+def calls_to(url):
+    return len([call for call in responses.calls if call.request.url == url])
+
+
+def test_ttl_for():
+    assert 0 == ttl_for(f"{iconik.ICONIK_JOBS_API}/jobs/{JOB_ID}/")
+    assert 0 == ttl_for(f"{iconik.ICONIK_ASSETS_API}/custom_actions/")
+    assert httpcache.LONG_TTL == ttl_for(STORAGE_URL)
+    assert httpcache.DEFAULT_TTL == ttl_for(FORMAT_URL)
+
+
+def test_make_key_depends_on_token_and_params():
+    assert make_key(STORAGE_URL, None, "a") != make_key(STORAGE_URL, None, "b")
+    assert make_key(STORAGE_URL, {"page": 1}, "a") != make_key(STORAGE_URL, {"page": 2}, "a")
+    assert make_key(STORAGE_URL, {"a": 1, "b": 2}, "a") == make_key(STORAGE_URL, {"b": 2, "a": 1}, "a")
+    assert AUTH_TOKEN not in make_key(STORAGE_URL, None, AUTH_TOKEN)
+
+
+def test_invalidation_prefix():
+    assert f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/" == \
+        invalidation_prefix(f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{ORIGINAL_FILE_SET_ID}/purge/")
+    assert f"{iconik.ICONIK_ASSETS_API}/delete_queue/assets/" == \
+        invalidation_prefix(f"{iconik.ICONIK_ASSETS_API}/delete_queue/assets/")
+
+
+def test_lru_eviction():
+    cache = ResponseCache(2, clock=FakeClock())
+    cache.put("a", entry("http://a"))
+    cache.put("b", entry("http://b"))
+    assert cache.get("a")
+    cache.put("c", entry("http://c"))
+
+    assert 2 == len(cache)
+    assert cache.get("a")
+    assert cache.get("b") is None
+    assert cache.get("c")
+
+
+def test_expiry():
+    clock = FakeClock()
+    cache = ResponseCache(2, clock=clock)
+    cache.put("a", entry("http://a", expires=clock() + 10))
+
+    assert cache.get("a")
+    clock.now += 10
+    assert cache.get("a") is None
+
+
+def test_invalidate():
+    cache = ResponseCache(10, clock=FakeClock())
+    cache.put("a", entry(FORMAT_URL))
+    cache.put("b", entry(FILE_SETS_URL))
+    cache.put("c", entry(STORAGE_URL))
+
+    cache.invalidate(f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/")
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c")
+
+
+def test_disk_cache(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(1, str(tmp_path), clock=clock)
+    cache.put("a", entry(FORMAT_URL, body=b'{"id": "a"}'))
+    cache.put("b", entry(STORAGE_URL, body=b'{"id": "b"}'))
+
+    # Evicted from memory, but still on disk
+    assert 1 == len(cache)
+    assert b'{"id": "a"}' == cache.get("a").body
+
+    # Shared with other processes
+    other = ResponseCache(1, str(tmp_path), clock=clock)
+    assert b'{"id": "b"}' == other.get("b").body
+    other.invalidate(FORMAT_URL)
+    assert ResponseCache(1, str(tmp_path), clock=clock).get("a") is None
+    assert 0o600 == os.stat(tmp_path / httpcache.DB_FILENAME).st_mode & 0o777
+
+
+def test_to_response():
+    response = entry(STORAGE_URL, body=b'{"id": "b"}').to_response()
+    assert 200 == response.status_code
+    assert {"id": "b"} == response.json()
+    assert "application/json" == response.headers["content-type"]
+
+
+@responses.activate
+def test_client_serves_repeat_reads_from_cache():
+    client = cached_client()
+
+    assert LL_STORAGE_ID == client.get_storage(id_=LL_STORAGE_ID)["id"]
+    assert LL_STORAGE_ID == iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN).get_storage(id_=LL_STORAGE_ID)["id"]
+    assert LL_STORAGE_ID == client.get_storage(id_=LL_STORAGE_ID)["id"]
+
+    # Once for the cached client, once for the client without a cache
+    assert 2 == calls_to(STORAGE_URL)
+
+
+@responses.activate
+def test_client_caches_not_found():
+    client = cached_client()
+
+    assert client.get_storage(id_=INVALID_STORAGE_ID) is None
+    assert client.get_storage(id_=INVALID_STORAGE_ID) is None
+
+    assert 1 == calls_to(f"{iconik.ICONIK_FILES_API}/storages/{INVALID_STORAGE_ID}/")
+
+
+@responses.activate
+def test_client_doesnt_cache_jobs():
+    url = f"{iconik.ICONIK_JOBS_API}/jobs/{JOB_ID}/"
+    responses.add(method=responses.GET, url=url, json={"id": JOB_ID, "status": "STARTED"}, status=200)
+    client = cached_client()
+
+    client.get_job(JOB_ID)
+    client.get_job(JOB_ID)
+
+    assert 2 == calls_to(url)
+    assert 0 == len(client.cache)
+
+
+@responses.activate
+def test_writes_invalidate_cached_reads():
+    cache = ResponseCache(100)
+    client = cached_client(cache)
+    client.get_asset_file_sets(ASSET_ID)
+    assert 1 == len(cache)
+
+    client.delete_and_purge_file_set(ASSET_ID, ORIGINAL_FILE_SET_ID)
+    assert 0 == len(cache)
+
+    # A new client, so its own memo of the asset's file sets doesn't hide the request
+    cached_client(cache).get_asset_file_sets(ASSET_ID)
+    assert 2 == calls_to(FILE_SETS_URL)
+
+
+@responses.activate
+def test_reads_during_a_write_are_invalidated():
+    cache = ResponseCache(100)
+    client = cached_client(cache)
+    send = client.session.request
+
+    def request(method, url, **kwargs):
+        if method != "GET":
+            # Another action reads the file sets while the delete is in flight
+            cached_client(cache).get_asset_file_sets(ASSET_ID)
+            assert 1 == len(cache)
+        return send(method, url, **kwargs)
+
+    client.session.request = request
+    client.delete_and_purge_file_set(ASSET_ID, ORIGINAL_FILE_SET_ID)
+
+    assert 0 == len(cache)
+
+
+@responses.activate
+def test_forget_listings_invalidates_cached_reads():
+    cache = ResponseCache(100)
+    client = cached_client(cache)
+    client.get_asset_file_sets(ASSET_ID)
+
+    client.forget_listings(FILE_SETS_URL)
+
+    assert 0 == len(cache)
+
+
+def test_pickled_client_uses_process_cache(monkeypatch):
+    shared = ResponseCache(10)
+    monkeypatch.setattr(httpcache, "_shared_cache", shared)
+    monkeypatch.setattr(httpcache, "CACHE_ENTRIES", 10)
+    client = cached_client()
+
+    copy = pickle.loads(pickle.dumps(client))
+
+    assert shared is copy.cache
+
+
+def test_validators():
+    cached = CachedResponse(STORAGE_URL, 200, {"ETag": '"abc"', "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"},
+                            b"{}", 0)
+    assert {"If-None-Match": '"abc"', "If-Modified-Since": "Wed, 01 Jan 2025 00:00:00 GMT"} == cached.validators()
+    assert entry(STORAGE_URL).validators() is None
+
+
+def test_stale_entries_kept_for_revalidation():
+    clock = FakeClock()
+    cache = ResponseCache(10, clock=clock)
+    cache.put("a", CachedResponse(STORAGE_URL, 200, {"ETag": '"abc"'}, b"{}", clock() + 10))
+    cache.put("b", entry(FORMAT_URL, expires=clock() + 10))
+    clock.now += 20
+
+    assert cache.get("a") is None
+    assert cache.get("a", stale=True)
+    # Without validators, an expired response is no use
+    assert cache.get("b", stale=True) is None
+    clock.now += httpcache.MAX_STALE
+    assert cache.get("a", stale=True) is None
+
+
+@responses.activate
+def test_client_revalidates_expired_responses():
+    url = f"{iconik.ICONIK_ASSETS_API}/collections/{COLLECTION_ID}"
+    etag = '"v1"'
+    # Registered first, so it's matched first when the request is conditional
+    responses.add(method=responses.GET, url=url, status=304, headers={"ETag": etag},
+                  match=[matchers.header_matcher({"If-None-Match": etag})])
+    responses.add(method=responses.GET, url=url, json={"id": COLLECTION_ID, "title": "Dailies"}, status=200,
+                  headers={"ETag": etag})
+    clock = FakeClock()
+    cache = ResponseCache(10, clock=clock)
+    client = cached_client(cache)
+
+    assert "Dailies" == client.get_collection(COLLECTION_ID)["title"]
+    clock.now += httpcache.DEFAULT_TTL + 1
+    assert "Dailies" == client.get_collection(COLLECTION_ID)["title"]
+    # Renewed by the 304, so this one is served from the cache
+    assert "Dailies" == client.get_collection(COLLECTION_ID)["title"]
+
+    assert [200, 304] == [call.response.status_code for call in responses.calls]
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert etag == responses.calls[1].request.headers["If-None-Match"]
+
+
+@responses.activate
+def test_client_replaces_changed_responses():
+    url = f"{iconik.ICONIK_ASSETS_API}/collections/{COLLECTION_ID}"
+    responses.add(method=responses.GET, url=url, json={"id": COLLECTION_ID, "title": "Dailies"}, status=200,
+                  headers={"ETag": '"v1"'})
+    responses.add(method=responses.GET, url=url, json={"id": COLLECTION_ID, "title": "Selects"}, status=200,
+                  headers={"ETag": '"v2"'})
+    clock = FakeClock()
+    client = cached_client(ResponseCache(10, clock=clock))
+
+    assert "Dailies" == client.get_collection(COLLECTION_ID)["title"]
+    clock.now += httpcache.DEFAULT_TTL + 1
+    assert "Selects" == client.get_collection(COLLECTION_ID)["title"]
+    assert "Selects" == client.get_collection(COLLECTION_ID)["title"]
+
+    assert 2 == len(responses.calls)
+    assert '"v1"' == responses.calls[1].request.headers["If-None-Match"]
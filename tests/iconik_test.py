@@ -20,8 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import threading
+
 import pytest
 import requests
+from responses import matchers
 
 from b2_iconik_plugin import iconik
 from tests.test_common import *
@@ -73,3 +76,259 @@ def test_get_objects_multiple_pages():
     assert 2 == len(objects)
     assert SUBCOLLECTION_ID == objects[0]["id"]
     assert ASSET_ID == objects[1]["id"]
+
+
+@responses.activate
+def test_iter_objects_streams_pages():
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    objects = client.iter_objects(f"{iconik.ICONIK_ASSETS_API}/collections/{MULTI_COLLECTION_ID}/contents/")
+    assert 0 == client.request_count
+    assert SUBCOLLECTION_ID == next(objects)["id"]
+    # The second page isn't read until it's needed
+    assert 1 == client.request_count
+    assert ASSET_ID == next(objects)["id"]
+    assert 2 == client.request_count
+    assert [] == list(objects)
+
+
+@responses.activate
+def test_request_retries_when_throttled():
+    url = f"{iconik.ICONIK_ASSETS_API}/assets/{ASSET_ID}/"
+    responses.add(method=responses.GET, url=url, status=429, headers={"Retry-After": "0"})
+    responses.add(method=responses.GET, url=url, json={"id": ASSET_ID}, status=200)
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    assert ASSET_ID == client.get_asset(ASSET_ID)["id"]
+    assert responses.assert_call_count(url, 2)
+
+
+@responses.activate
+def test_request_retries_after_http_date(monkeypatch):
+    url = f"{iconik.ICONIK_ASSETS_API}/assets/{ASSET_ID}/"
+    responses.add(method=responses.GET, url=url, status=429,
+                  headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+    responses.add(method=responses.GET, url=url, json={"id": ASSET_ID}, status=200)
+    delays = []
+    monkeypatch.setattr(iconik, "sleep", delays.append)
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    assert ASSET_ID == client.get_asset(ASSET_ID)["id"]
+    # The date has passed, so there is no need to wait
+    assert [0] == delays
+
+
+@pytest.mark.parametrize("retry_after,retries,expected", [
+    (None, 0, 1),
+    (None, 3, 8),
+    ("2.5", 0, 2.5),
+    ("86400", 0, iconik.MAX_RETRY_DELAY),
+    ("Wed, 21 Oct 2999 07:28:00 GMT", 0, iconik.MAX_RETRY_DELAY),
+    ("soon", 2, 4),
+])
+def test_retry_delay(retry_after, retries, expected):
+    assert expected == iconik.retry_delay(retry_after, retries)
+
+
+def bulk_copy(asset_ids, job_id):
+    return dict(method=responses.POST,
+                url=f"{iconik.ICONIK_FILES_API}/storages/{B2_STORAGE_ID}/bulk/",
+                json={"job_id": job_id},
+                match=[matchers.json_params_matcher({
+                    "object_ids": asset_ids,
+                    "object_type": "assets",
+                    "format_name": ORIGINAL_FORMAT_NAME
+                })],
+                status=200)
+
+
+@responses.activate
+def test_forget_presence():
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    assert client.is_present(ASSET_ID, "ORIGINAL", LL_STORAGE_ID)
+
+    # Removed from LucidLink by someone else
+    set_asset_file_sets([])
+    assert client.is_present(ASSET_ID, "ORIGINAL", LL_STORAGE_ID)
+    client.forget_presence()
+    assert not client.is_present(ASSET_ID, "ORIGINAL", LL_STORAGE_ID)
+
+
+@responses.activate
+def test_remove_files_isolates_failed_assets(monkeypatch):
+    monkeypatch.setattr(iconik, "JOB_POLL_INTERVAL", 0)
+    # The batch fails because of the bad asset, so each asset is retried on its own
+    responses.remove(responses.POST, f"{iconik.ICONIK_FILES_API}/storages/{B2_STORAGE_ID}/bulk/")
+    responses.add(**bulk_copy([ASSET_ID, BAD_ASSET_ID], FAILED_JOB_ID))
+    responses.add(**bulk_copy([ASSET_ID], JOB_ID))
+    responses.add(**bulk_copy([BAD_ASSET_ID], FAILED_JOB_ID))
+    responses.add(method=responses.GET,
+                  url=f"{iconik.ICONIK_JOBS_API}/jobs/{FAILED_JOB_ID}/",
+                  json={"id": FAILED_JOB_ID, "status": "FAILED"},
+                  status=200)
+    # Neither asset is in B2 yet
+    responses.add(method=responses.GET,
+                  url=f"{iconik.ICONIK_FILES_API}/assets/{BAD_ASSET_ID}/formats/{ORIGINAL_FORMAT_NAME}/",
+                  json={"id": ORIGINAL_FORMAT_ID, "name": ORIGINAL_FORMAT_NAME},
+                  status=200)
+    responses.add(method=responses.GET,
+                  url=f"{iconik.ICONIK_FILES_API}/assets/{BAD_ASSET_ID}/file_sets/",
+                  json={"objects": []},
+                  status=200)
+
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    assert not client.remove_files(request={"asset_ids": [ASSET_ID, BAD_ASSET_ID], "collection_ids": []},
+                                   format_names=list(FORMATS),
+                                   b2_storage_id=B2_STORAGE_ID,
+                                   ll_storage_id=LL_STORAGE_ID,
+                                   batch_size=2)
+
+    assert responses.assert_call_count(f"{iconik.ICONIK_FILES_API}/storages/{B2_STORAGE_ID}/bulk/", 3)
+    # The asset that was copied has its files deleted
+    assert_delete_call_counts()
+    # The asset that couldn't be copied keeps its files
+    assert not [call for call in responses.calls
+                if call.request.method == responses.DELETE and f"/assets/{BAD_ASSET_ID}/" in call.request.url]
+
+
+class FakeCopyJobs:
+    """Copy jobs that each finish after a given number of polls"""
+
+    def __init__(self, client, monkeypatch, polls):
+        self.polls = polls
+        self.jobs = {}
+        self.submitted = []
+        self.deleted = []
+        monkeypatch.setattr(iconik, "JOB_POLL_INTERVAL", 0)
+        monkeypatch.setattr(client, "is_present", lambda asset_id, format_name, storage_id: False)
+        monkeypatch.setattr(client, "copy_assets", self.copy_assets)
+        monkeypatch.setattr(client, "get_job", self.get_job)
+        monkeypatch.setattr(client, "verify_copies", lambda asset_ids, *args: set(asset_ids))
+        monkeypatch.setattr(client, "delete_asset_files",
+                            lambda asset_id, format_names, storage_id: self.deleted.append(asset_id))
+
+    def copy_assets(self, asset_ids, format_name, target_storage_id):
+        job_id = new_id()
+        self.jobs[job_id] = self.polls(list(asset_ids))
+        self.submitted.append(list(asset_ids))
+        return job_id
+
+    def get_job(self, job_id):
+        self.jobs[job_id] -= 1
+        return {"status": "FINISHED" if self.jobs[job_id] <= 0 else "STARTED"}
+
+
+def test_remove_assets_slow_job_holds_back_only_its_batch(monkeypatch):
+    monkeypatch.setattr(iconik, "REMOVE_MAX_JOBS", 2)
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    asset_ids = [new_id() for _ in range(8)]
+    # The first batch's copy is slow
+    jobs = FakeCopyJobs(client, monkeypatch, lambda batch: 10 if asset_ids[0] in batch else 1)
+
+    failed, remaining = client.remove_assets(asset_ids, list(FORMATS), B2_STORAGE_ID, LL_STORAGE_ID,
+                                             batch_size=2)
+
+    assert 0 == len(failed)
+    assert 0 == len(remaining)
+    assert 4 == len(jobs.submitted)
+    # Every other batch was copied and deleted while the first was still copying
+    assert asset_ids[2:] + asset_ids[:2] == jobs.deleted
+
+
+def test_remove_assets_yields_between_batches(monkeypatch):
+    monkeypatch.setattr(iconik, "REMOVE_MAX_JOBS", 1)
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    asset_ids = [new_id() for _ in range(6)]
+    jobs = FakeCopyJobs(client, monkeypatch, lambda batch: 1)
+    yield_event = threading.Event()
+
+    def should_yield():
+        if jobs.deleted:
+            yield_event.set()
+        return yield_event.is_set()
+
+    failed, remaining = client.remove_assets(asset_ids, list(FORMATS), B2_STORAGE_ID, LL_STORAGE_ID,
+                                             batch_size=2, should_yield=should_yield)
+
+    assert 0 == len(failed)
+    # The running batch was seen through, and no more were taken
+    assert [asset_ids[:2]] == jobs.submitted
+    assert asset_ids[:2] == jobs.deleted
+    assert asset_ids[2:] == list(remaining)
+
+
+def original_file(storage_id, size=ORIGINAL_FILE_SIZE, checksum=None, status="CLOSED", name="clip.mov"):
+    return {"format_id": ORIGINAL_FORMAT_ID, "storage_id": storage_id, "original_name": name,
+            "directory_path": "", "size": size, "checksum": checksum, "status": status}
+
+
+@pytest.mark.parametrize("b2_files,complete", [
+    ([original_file(B2_STORAGE_ID)], True),
+    ([original_file(B2_STORAGE_ID, checksum="abc")], True),
+    ([], False),
+    ([original_file(B2_STORAGE_ID, size=ORIGINAL_FILE_SIZE - 1)], False),
+    ([original_file(B2_STORAGE_ID, checksum="def")], False),
+    ([original_file(B2_STORAGE_ID, status="OPEN")], False),
+    ([original_file(B2_STORAGE_ID, name="other.mov")], False),
+])
+@responses.activate
+def test_is_copy_complete(b2_files, complete):
+    responses.replace(responses.GET, f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/files/",
+                      json={"objects": [original_file(LL_STORAGE_ID, checksum="abc")] + b2_files},
+                      status=200)
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    assert complete == client.is_copy_complete(ASSET_ID, ORIGINAL_FORMAT_NAME, LL_STORAGE_ID, B2_STORAGE_ID)
+
+
+def test_verify_copies_with_recorded_listings(monkeypatch):
+    # After a dry run, the client holds the plan's listings, which the verify
+    # threads must not mutate while each other iterate over them
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    asset_ids = [new_id() for _ in range(32)]
+    files_url = f"{iconik.ICONIK_FILES_API}/assets/{{}}/files/"
+    client.listings = {files_url.format(asset_id): [] for asset_id in asset_ids}
+    client.listings.update({f"{iconik.ICONIK_FILES_API}/other/{i}/": [] for i in range(1000)})
+    forgetting_threads = set()
+    forget_listings = client.forget_listings
+
+    def record_forget(prefix, suffix=""):
+        forgetting_threads.add(threading.current_thread())
+        forget_listings(prefix, suffix)
+
+    monkeypatch.setattr(client, "forget_listings", record_forget)
+    monkeypatch.setattr(client, "get_format", lambda asset_id, name: {"id": ORIGINAL_FORMAT_ID})
+    monkeypatch.setattr(client, "get_asset_files",
+                        lambda asset_id: [original_file(LL_STORAGE_ID), original_file(B2_STORAGE_ID)])
+
+    assert set(asset_ids) == client.verify_copies(asset_ids, ORIGINAL_FORMAT_NAME, LL_STORAGE_ID, B2_STORAGE_ID)
+    assert {threading.current_thread()} == forgetting_threads
+    assert 1000 == len(client.listings)
+
+
+@responses.activate
+def test_delete_asset_files_rereads_recorded_file_sets():
+    # A plan's listing of the file sets may be out of date by the time the action runs
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    stale_file_set_id = new_id()
+    client.listings[f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/formats/{ORIGINAL_FORMAT_ID}/storages/"
+                    f"{LL_STORAGE_ID}/file_sets/"] = [{"id": stale_file_set_id}]
+
+    client.delete_asset_files(ASSET_ID, [ORIGINAL_FORMAT_NAME], LL_STORAGE_ID)
+
+    deleted = [call.request.url for call in responses.calls if call.request.method == "DELETE"]
+    assert f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{ORIGINAL_FILE_SET_ID}/" in deleted
+    assert not any(stale_file_set_id in url for url in deleted)
+
+
+@responses.activate
+def test_remove_files_keeps_unverified_files(monkeypatch):
+    monkeypatch.setattr(iconik, "JOB_POLL_INTERVAL", 0)
+    # The copy job succeeds, but B2 is missing the original
+    responses.replace(responses.GET, f"{iconik.ICONIK_FILES_API}/assets/{ASSET_ID}/files/",
+                      json={"objects": [original_file(LL_STORAGE_ID)]},
+                      status=200)
+
+    client = iconik.Iconik(os.environ["ICONIK_ID"], AUTH_TOKEN)
+    assert not client.remove_files(request={"asset_ids": [ASSET_ID], "collection_ids": []},
+                                   format_names=list(FORMATS),
+                                   b2_storage_id=B2_STORAGE_ID,
+                                   ll_storage_id=LL_STORAGE_ID)
+
+    assert not [call for call in responses.calls if call.request.method == responses.DELETE]
@@ -0,0 +1,58 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pickle
+import uuid
+
+import pytest
+
+from b2_iconik_plugin.ids import IdSet
+from tests.test_common import *
+
+
+def test_id_set():
+    ids = IdSet([ASSET_ID, COLLECTION_ID, ASSET_ID.upper(), BAD_ASSET_ID])
+    # Duplicates are dropped, keeping the order in which ids first appear
+    assert [ASSET_ID, COLLECTION_ID, BAD_ASSET_ID] == list(ids)
+    assert 3 == len(ids)
+    assert 48 == len(ids.to_bytes())
+    assert ASSET_ID in ids
+    assert SUBCOLLECTION_ID not in ids
+    assert "not-an-id" not in ids
+    assert COLLECTION_ID == ids[1]
+    assert BAD_ASSET_ID == ids[-1]
+    assert [COLLECTION_ID, BAD_ASSET_ID] == ids[1:]
+    assert not IdSet()
+
+
+def test_id_set_rejects_invalid_ids():
+    with pytest.raises(ValueError):
+        IdSet(["not-an-id"])
+    with pytest.raises(ValueError):
+        IdSet([42])
+
+
+def test_id_set_pickles_compactly():
+    ids = IdSet(str(uuid.uuid4()) for _ in range(1000))
+    data = pickle.dumps(ids)
+    assert len(data) < 16 * 1000 + 100
+    assert ids == pickle.loads(data)
@@ -65,7 +65,7 @@ def test_iconik_handler_add(app, logger):
         assert 200 == response.status_code
         assert 'OK' == response.get_data(as_text=True)
 
-        assert_copy_call_counts(LL_STORAGE_ID, format_count=2)
+        assert_whole_copy_call_counts(LL_STORAGE_ID)
 
 
 @responses.activate
@@ -81,7 +81,7 @@ def test_iconik_handler_remove(app, logger):
         assert 200 == response.status_code
         assert 'OK' == response.get_data(as_text=True)
 
-        assert_copy_call_counts(B2_STORAGE_ID, format_count=1)
+        assert_remove_copy_call_counts(B2_STORAGE_ID)
         assert_delete_call_counts()
 
 
@@ -0,0 +1,59 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from b2_iconik_plugin import metrics
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from tests.test_common import *
+
+
+def test_endpoint_name():
+    assert "/API/files/v1/assets/{id}/file_sets/{id}/" == metrics.endpoint_name(
+        f"{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{ORIGINAL_FILE_SET_ID}/")
+    assert "/API/assets/v1/collections/{id}/contents/" == metrics.endpoint_name(
+        f"https://app.iconik.io/API/assets/v1/collections/{COLLECTION_ID}/contents/?page=2&per_page=1")
+
+
+def test_operation_name():
+    assert "/add" == metrics.operation_name("/add")
+    assert "/remove" == metrics.operation_name("/remove")
+    assert "other" == metrics.operation_name("/wp-login.php")
+
+
+@responses.activate
+def test_metrics(client):
+    response = client.post(f'/remove?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 200 == response.status_code
+
+    response = client.get('/metrics')
+    assert 200 == response.status_code
+    assert response.content_type.startswith("text/plain")
+
+    body = response.get_data(as_text=True)
+    assert 'b2_iconik_plugin_handler_seconds_count{operation="/remove",status_code="200"}' in body
+    assert 'b2_iconik_plugin_process_seconds_count{action="remove"}' in body
+    assert ('b2_iconik_plugin_iconik_responses_total{endpoint="/API/files/v1/storages/{id}/bulk/",'
+            'method="POST",status_code="200"}') in body
+    assert 'b2_iconik_plugin_iconik_pages_count{endpoint="/API/assets/v1/collections/{id}/contents/"}' in body
+    assert 'b2_iconik_plugin_job_wait_seconds_count{status="FINISHED"}' in body
+    assert 'b2_iconik_plugin_workers 1.0' in body
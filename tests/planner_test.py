@@ -0,0 +1,133 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+
+from b2_iconik_plugin import planner
+from b2_iconik_plugin.iconik import ICONIK_ASSETS_API
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from tests.test_common import *
+
+
+def dry_run(client, operation):
+    return client.post(f'/{operation}?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}&dry_run=true',
+                       json=PAYLOAD,
+                       headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+
+
+@responses.activate
+def test_plan_remove(client):
+    response = dry_run(client, "remove")
+    assert 200 == response.status_code
+
+    plan = response.json
+    assert "remove" == plan["action"]
+    assert B2_STORAGE_ID == plan["target_storage_id"]
+    assert LL_STORAGE_ID == plan["delete_storage_id"]
+    # The asset is in the request and in the subcollection, but is only counted once
+    assert 1 == plan["assets"]
+    assert 1 == plan["collections"]
+    # One batch, copying the original
+    assert [{"storage_id": B2_STORAGE_ID, "object_type": "assets", "object_count": 1,
+             "format_name": ORIGINAL_FORMAT_NAME}] == plan["bulk_jobs"]
+    assert {ORIGINAL_FILE_SET_ID, PPRO_PROXY_FILE_SET_ID} == {
+        file_set["file_set_id"] for file_set in plan["file_sets_to_delete"]}
+    assert ORIGINAL_FILE_SIZE == plan["copy_bytes"]
+    assert ORIGINAL_FILE_SIZE + PPRO_PROXY_FILE_SIZE == plan["delete_bytes"]
+    assert 1 == plan["estimated_api_calls"]["bulk_posts"]
+    assert 4 == plan["estimated_api_calls"]["deletes"]
+    assert 1 == plan["estimated_api_calls"]["verify_reads"]
+
+    # Nothing was copied or deleted
+    assert responses.assert_call_count(f'{ICONIK_FILES_API}/storages/{B2_STORAGE_ID}/bulk/', 0)
+    assert responses.assert_call_count(
+        f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{ORIGINAL_FILE_SET_ID}/', 0)
+
+
+@responses.activate
+def test_plan_add(client, monkeypatch):
+    monkeypatch.setattr(planner, "CHECK_PRESENCE", True)
+    plan = dry_run(client, "add").json
+    assert "add" == plan["action"]
+    assert LL_STORAGE_ID == plan["target_storage_id"]
+    assert plan["delete_storage_id"] is None
+    assert [] == plan["file_sets_to_delete"]
+    # Both formats are already on LucidLink
+    assert [] == plan["bulk_jobs"]
+    assert 0 == plan["copy_bytes"]
+
+
+@responses.activate
+def test_plan_add_missing(client, monkeypatch):
+    monkeypatch.setattr(planner, "CHECK_PRESENCE", True)
+    # Only the proxy is on LucidLink
+    set_asset_file_sets([(PPRO_PROXY_FILE_SET_ID, PPRO_PROXY_FORMAT_ID, LL_STORAGE_ID)])
+    plan = dry_run(client, "add").json
+    assert [{"storage_id": LL_STORAGE_ID, "object_type": "assets", "object_count": 1,
+             "format_name": ORIGINAL_FORMAT_NAME}] == plan["bulk_jobs"]
+    assert responses.assert_call_count(f'{ICONIK_FILES_API}/storages/{LL_STORAGE_ID}/bulk/', 0)
+
+
+@responses.activate
+def test_plan_add_without_presence_check(client):
+    plan = dry_run(client, "add").json
+    # The request's assets and collections are copied as they are, once per format
+    assert [{"storage_id": LL_STORAGE_ID, "object_type": object_type, "object_count": 1, "format_name": format_name}
+            for format_name in FORMATS for object_type in ("assets", "collections")] == plan["bulk_jobs"]
+
+
+@responses.activate
+def test_plan_reused(client):
+    dry_run(client, "remove")
+    response = client.post(f'/remove?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 200 == response.status_code
+
+    assert_remove_copy_call_counts(B2_STORAGE_ID)
+    assert_delete_call_counts()
+    # Executing the action read the formats and collection contents from the plan
+    for format_name in FORMATS:
+        assert responses.assert_call_count(f'{ICONIK_FILES_API}/assets/{ASSET_ID}/formats/{format_name}/', 1)
+    contents_url = f'{ICONIK_ASSETS_API}/collections/{SUBCOLLECTION_ID}/contents/'
+    assert 1 == len([call for call in responses.calls if call.request.url.startswith(contents_url)])
+
+
+def test_plan_cache_expiry():
+    cache = planner.PlanCache(ttl=60)
+    plan = planner.Plan("add", [], [], LL_STORAGE_ID, None)
+    cache.put("key", plan)
+    assert plan is cache.take("key")
+    # Plans are used once
+    assert cache.take("key") is None
+
+    plan.created = time.monotonic() - 61
+    cache.put("key", plan)
+    assert cache.take("key") is None
+
+
+def test_plan_key():
+    request = dict(PAYLOAD, action="remove")
+    key = planner.plan_key(request, list(FORMATS), B2_STORAGE_ID, LL_STORAGE_ID)
+    assert key == planner.plan_key(dict(request), list(FORMATS), B2_STORAGE_ID, LL_STORAGE_ID)
+    assert key != planner.plan_key(dict(request, action="add"), list(FORMATS), B2_STORAGE_ID, LL_STORAGE_ID)
+    assert key != planner.plan_key(dict(request, auth_token="other"), list(FORMATS), B2_STORAGE_ID, LL_STORAGE_ID)
@@ -0,0 +1,331 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from b2_iconik_plugin import prefetch
+from b2_iconik_plugin.asgi import create_app as create_asgi_app
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from b2_iconik_plugin.plugin import create_app
+from b2_iconik_plugin.prefetch import Batch, Prefetcher, PrefetchStore, make_batches, parse_time, schedule
+from bench.asgi_client import AsgiClient
+from tests.test_common import *
+
+MB = 1024 ** 2
+
+
+class FakeIconik:
+    """
+    Just the reads and bulk copies that the prefetcher makes. Each copy job
+    copies rate bytes per second of clock time
+    """
+
+    def __init__(self, clock, rate=MB):
+        self.clock = clock
+        self.rate = rate
+        # asset id -> format name -> bytes, or None if already on LucidLink
+        self.assets = {}
+        self.jobs = {}
+        self.submitted = []
+        self.max_running = 0
+        self.failing_formats = set()
+
+    def add_asset(self, **sizes):
+        asset_id = new_id()
+        self.assets[asset_id] = sizes
+        return asset_id
+
+    def get_request_asset_ids(self, request):
+        return list(request["asset_ids"]) + [asset_id for asset_id in self.assets
+                                             if request["collection_ids"] and asset_id not in request["asset_ids"]]
+
+    def is_present(self, asset_id, format_name, storage_id):
+        assert LL_STORAGE_ID == storage_id
+        return self.assets[asset_id].get(format_name) is None
+
+    def forget_presence(self):
+        # Presence is read afresh every time
+        pass
+
+    def get_format(self, asset_id, format_name):
+        return {"id": FORMATS[format_name]}
+
+    def get_asset_files(self, asset_id):
+        files = []
+        for format_name, size in self.assets[asset_id].items():
+            if size is not None:
+                files.append({"format_id": FORMATS[format_name], "storage_id": B2_STORAGE_ID, "size": size,
+                              "status": "CLOSED"})
+                # A partial copy elsewhere doesn't count
+                files.append({"format_id": FORMATS[format_name], "storage_id": new_id(), "size": size // 2,
+                              "status": "CLOSED"})
+        return files
+
+    def copy_assets(self, asset_ids, format_name, target_storage_id):
+        assert LL_STORAGE_ID == target_storage_id
+        job_id = new_id()
+        size = sum(self.assets[asset_id][format_name] for asset_id in asset_ids)
+        self.jobs[job_id] = (self.clock() + size / self.rate, format_name)
+        self.submitted.append((self.clock(), format_name, list(asset_ids)))
+        self.max_running = max(self.max_running, self.running())
+        return job_id
+
+    def running(self):
+        return sum(1 for finish, _format_name in self.jobs.values() if finish > self.clock())
+
+    def get_job(self, job_id):
+        finish, format_name = self.jobs[job_id]
+        if finish > self.clock():
+            return {"status": "STARTED"}
+        return {"status": "FAILED" if format_name in self.failing_formats else "FINISHED"}
+
+    @staticmethod
+    def job_done(job):
+        return job["status"] in ("FINISHED", "FAILED")
+
+    @staticmethod
+    def job_succeeded(job):
+        return job["status"] == "FINISHED"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_prefetcher(iconik, clock, **kwargs):
+    kwargs.setdefault("job_rate", MB)
+    return Prefetcher(iconik, FORMAT_NAMES, LL_STORAGE_ID, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_make_batches_ranks_by_size():
+    items = [("a", "ORIGINAL", 10), ("b", "ORIGINAL", 30), ("c", "PPRO_PROXY", 5), ("d", "ORIGINAL", 20),
+             ("e", "ORIGINAL", 15)]
+
+    batches = make_batches(items, batch_bytes=50, batch_assets=10)
+
+    assert [("ORIGINAL", ["b", "d"], 50), ("ORIGINAL", ["e", "a"], 25), ("PPRO_PROXY", ["c"], 5)] \
+           == [(batch.format_name, batch.asset_ids, batch.bytes) for batch in batches]
+
+
+def test_make_batches_limits_assets():
+    items = [(str(i), "ORIGINAL", 1) for i in range(5)]
+    assert [2, 2, 1] == [len(batch.asset_ids) for batch in make_batches(items, batch_bytes=100, batch_assets=2)]
+
+
+def test_schedule_uses_free_lanes():
+    batches = [Batch("ORIGINAL", ["a"], 30), Batch("ORIGINAL", ["b"], 20), Batch("ORIGINAL", ["c"], 10)]
+
+    projected, completion = schedule(batches, [0, 0], 10)
+
+    assert [(0, 3), (0, 2), (2, 3)] == [(start, finish) for _batch, start, finish in projected]
+    assert 3 == completion
+
+
+def test_parse_time():
+    assert 0 == parse_time("1970-01-01T00:00:00Z")
+    assert 3600 == parse_time("1970-01-01T01:00:00")
+    assert 0 == parse_time("1970-01-01T01:00:00+01:00")
+
+
+def test_plan_uses_fewest_jobs_that_meet_the_deadline(clock):
+    iconik = FakeIconik(clock)
+    for _ in range(8):
+        iconik.add_asset(ORIGINAL=100 * MB, PPRO_PROXY=None)
+    prefetcher = make_prefetcher(iconik, clock, max_jobs=8, batch_assets=1)
+
+    # 800 seconds of copying, with 500 seconds to go
+    plan = prefetcher.plan({"asset_ids": [], "collection_ids": [COLLECTION_ID]}, clock() + 500)
+    report = plan.report()
+
+    assert 2 == plan.concurrency
+    assert {"assets": 8, "jobs": 8, "bytes": 800 * MB, "concurrency": 2, "on_time": True,
+            "slack_seconds": 100.0} == {key: report[key] for key in
+                                        ("assets", "jobs", "bytes", "concurrency", "on_time", "slack_seconds")}
+
+
+def test_plan_reports_late_completion(clock):
+    iconik = FakeIconik(clock)
+    for _ in range(4):
+        iconik.add_asset(ORIGINAL=100 * MB)
+    prefetcher = make_prefetcher(iconik, clock, max_jobs=2, batch_assets=1)
+
+    report = prefetcher.plan({"asset_ids": [], "collection_ids": [COLLECTION_ID]}, clock() + 100).report()
+
+    assert 2 == report["concurrency"]
+    assert not report["on_time"]
+    assert -100 == report["slack_seconds"]
+
+
+def test_plan_skips_files_already_on_lucidlink(clock):
+    iconik = FakeIconik(clock)
+    present = iconik.add_asset(ORIGINAL=None, PPRO_PROXY=None)
+    partial = iconik.add_asset(ORIGINAL=None, PPRO_PROXY=MB)
+    prefetcher = make_prefetcher(iconik, clock)
+
+    plan = prefetcher.plan({"asset_ids": [present, partial], "collection_ids": []}, clock() + 100)
+
+    assert [("PPRO_PROXY", [partial], MB)] == [(b.format_name, b.asset_ids, b.bytes) for b in plan.batches]
+
+
+def test_run_spreads_jobs(clock):
+    iconik = FakeIconik(clock)
+    for _ in range(6):
+        iconik.add_asset(ORIGINAL=100 * MB)
+    prefetcher = make_prefetcher(iconik, clock, max_jobs=6, batch_assets=1)
+    plan = prefetcher.plan({"asset_ids": [], "collection_ids": [COLLECTION_ID]}, clock() + 350)
+    progress = []
+
+    report = prefetcher.run(plan, progress.append)
+
+    assert 2 == plan.concurrency
+    assert 2 == iconik.max_running
+    assert 6 == len(iconik.submitted)
+    assert 6 == report["completed_jobs"]
+    assert 600 * MB == report["copied_bytes"]
+    assert [] == report["failed_assets"]
+    assert [2, 4, 6] == [current["completed_jobs"] for current in progress]
+    # Jobs were submitted as earlier ones finished, not all at once
+    assert 3 == len({submitted for submitted, _format_name, _asset_ids in iconik.submitted})
+
+
+def test_run_adds_jobs_when_behind(clock):
+    # Copies are half as fast as expected
+    iconik = FakeIconik(clock, rate=MB / 2)
+    for _ in range(8):
+        iconik.add_asset(ORIGINAL=100 * MB)
+    prefetcher = make_prefetcher(iconik, clock, max_jobs=8, batch_assets=1)
+    plan = prefetcher.plan({"asset_ids": [], "collection_ids": [COLLECTION_ID]}, clock() + 400)
+    assert 2 == plan.concurrency
+
+    prefetcher.run(plan)
+
+    assert iconik.max_running > 2
+
+
+def test_run_reports_failed_jobs(clock):
+    iconik = FakeIconik(clock)
+    ok = iconik.add_asset(ORIGINAL=MB)
+    bad = iconik.add_asset(PPRO_PROXY=MB)
+    iconik.failing_formats.add("PPRO_PROXY")
+    prefetcher = make_prefetcher(iconik, clock)
+
+    report = prefetcher.run(prefetcher.plan({"asset_ids": [ok, bad], "collection_ids": []}, clock() + 100))
+
+    assert [bad] == report["failed_assets"]
+    assert 1 == report["completed_jobs"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PrefetchStore(str(tmp_path / "prefetch.db"))
+    yield store
+    store.close()
+
+
+def test_store_claims_earliest_deadline_first(store):
+    later = store.add([], [COLLECTION_ID], 2000)
+    sooner = store.add([ASSET_ID], [], 1000)
+
+    assert (sooner, {"asset_ids": [ASSET_ID], "collection_ids": []}, 1000) == store.claim()
+    assert later == store.claim()[0]
+    assert store.claim() is None
+
+    # Prefetches that were interrupted are run again
+    assert 2 == store.requeue_running()
+    assert sooner == store.claim()[0]
+
+
+def test_run_request_records_progress(store, clock):
+    iconik = FakeIconik(clock)
+    asset_id = iconik.add_asset(ORIGINAL=MB)
+    prefetch_id = store.add([asset_id], [], clock() + 100)
+    prefetcher = make_prefetcher(iconik, clock)
+
+    prefetcher.run_request(store, *store.claim())
+
+    recorded = store.get(prefetch_id)
+    assert prefetch.DONE == recorded["status"]
+    assert 1 == recorded["report"]["completed_jobs"]
+    assert recorded["report"]["on_time"]
+
+
+@pytest.fixture
+def prefetch_state_url(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'prefetch.db'}"
+    monkeypatch.setattr(prefetch, "PREFETCH_STATE", url)
+    return url
+
+
+def test_prefetch_endpoint(prefetch_state_url):
+    client = create_app({"TESTING": True}).test_client()
+
+    response = client.post("/prefetch", json={"collection_ids": [COLLECTION_ID], "deadline": "2999-01-01T09:00Z"},
+                           headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 200 == response.status_code
+    assert prefetch.PENDING == response.json["status"]
+    assert "2999-01-01T09:00:00+00:00" == response.json["deadline"]
+
+    response = client.get(f"/prefetch?id={response.json['id']}", headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 200 == response.status_code
+    assert [COLLECTION_ID] == response.json["collection_ids"]
+
+    assert [COLLECTION_ID] == prefetch.open_prefetch_store(prefetch_state_url).claim()[1]["collection_ids"]
+
+
+@pytest.mark.parametrize("body", [
+    {"collection_ids": [COLLECTION_ID]},
+    {"collection_ids": [COLLECTION_ID], "deadline": "tomorrow"},
+    {"collection_ids": [COLLECTION_ID], "deadline": "2000-01-01T00:00Z"},
+    {"collection_ids": [], "deadline": "2999-01-01T00:00Z"},
+    {"collection_ids": ["not an id"], "deadline": "2999-01-01T00:00Z"},
+    {"collection_ids": COLLECTION_ID, "deadline": "2999-01-01T00:00Z"},
+    [],
+])
+def test_prefetch_endpoint_rejects_bad_requests(prefetch_state_url, body):
+    client = create_app({"TESTING": True}).test_client()
+    response = client.post("/prefetch", json=body, headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 400 == response.status_code
+
+
+def test_prefetch_endpoint_checks_secret(prefetch_state_url):
+    client = create_app({"TESTING": True}).test_client()
+    response = client.post("/prefetch", json={"collection_ids": [COLLECTION_ID], "deadline": "2999-01-01T09:00Z"},
+                           headers={X_BZ_SHARED_SECRET: "wrong"})
+    assert 401 == response.status_code
+    response = client.get(f"/prefetch?id={new_id()}", headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 404 == response.status_code
+
+
+def test_prefetch_endpoint_asgi(prefetch_state_url):
+    with AsgiClient(create_asgi_app({"TESTING": True})) as client:
+        response = client.post("/prefetch", json={"asset_ids": [ASSET_ID], "deadline": "2999-01-01T09:00Z"},
+                               headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+
+    assert 200 == response.status_code
+    assert [ASSET_ID] == response.json["asset_ids"]
+
+
+def test_prefetch_endpoint_without_prefetch_state(client):
+    response = client.post("/prefetch", json={"collection_ids": [COLLECTION_ID], "deadline": "2999-01-01T09:00Z"},
+                           headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 404 == response.status_code
@@ -0,0 +1,124 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pstats
+import threading
+
+import pytest
+
+from b2_iconik_plugin import profiling
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from tests.test_common import *
+
+
+@pytest.fixture
+def profile_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_profile_disabled(client):
+    response = client.post('/admin/profile', headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 404 == response.status_code
+
+
+def test_profile_unauthorized(client, profile_dir):
+    response = client.post('/admin/profile', headers={X_BZ_SHARED_SECRET: 'dummy'})
+    assert 401 == response.status_code
+
+
+def test_profile_invalid_arguments(client, profile_dir):
+    response = client.post('/admin/profile?seconds=0',
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 400 == response.status_code
+    response = client.post('/admin/profile?sample_rate=2',
+                           headers={X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]})
+    assert 400 == response.status_code
+
+
+@responses.activate
+def test_profile_window(client, profile_dir):
+    headers = {X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"]}
+
+    response = client.post('/admin/profile?seconds=60&sample_rate=1', headers=headers)
+    assert 200 == response.status_code
+    assert response.json["active"]
+
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers=headers)
+    assert 200 == response.status_code
+
+    response = client.get('/admin/profile', headers=headers)
+    profiles = response.json["profiles"]
+    assert 1 == len(profiles)
+    assert profiles[0].startswith("post-")
+    # In testing, the action is processed within the request, so it appears in the same profile
+    stats = pstats.Stats(str(profile_dir / profiles[0]))
+    assert any(function == "do_process" for _, _, function in stats.stats)
+
+    response = client.delete('/admin/profile', headers=headers)
+    assert not response.json["active"]
+
+    response = client.post(f'/add?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers=headers)
+    assert 200 == response.status_code
+    assert profiles == client.get('/admin/profile', headers=headers).json["profiles"]
+
+
+def test_profile_action(profile_dir):
+    profiling.start(seconds=60, sample_rate=1)
+    with profiling.profile("do_process-remove"):
+        sum(range(1000))
+    profiles = profiling.status()["profiles"]
+    assert 1 == len(profiles)
+    assert profiles[0].startswith(f"do_process-remove-{os.getpid()}-")
+
+
+def test_concurrent_profiles(profile_dir):
+    profiling.start(seconds=60, sample_rate=1)
+    inside = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def first():
+        try:
+            with profiling.profile("first"):
+                inside.set()
+                release.wait(5)
+        except Exception as ex:  # noqa
+            errors.append(ex)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert inside.wait(5)
+    # The profiler is busy, so this runs unprofiled rather than failing
+    with profiling.profile("second"):
+        sum(range(1000))
+    release.set()
+    thread.join()
+
+    assert [] == errors
+    profiles = profiling.status()["profiles"]
+    assert 1 == len(profiles)
+    assert profiles[0].startswith("first-")
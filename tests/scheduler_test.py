@@ -0,0 +1,358 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+
+from b2_iconik_plugin import common, metrics, scheduler, tenants
+from b2_iconik_plugin.common import IconikHandler
+from b2_iconik_plugin.iconik import Iconik
+from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.plugin import spawn_runner
+from b2_iconik_plugin.scheduler import BULK, INTERACTIVE, STANDARD, Job, Scheduler
+from b2_iconik_plugin.workqueue import SqliteWorkQueue
+from tests.test_common import *
+
+
+class FakeHandle:
+    def __init__(self, job):
+        self.job = job
+        self.finished = False
+        self.preempted = False
+        self.terminated = False
+        self.remaining = None
+
+    def done(self):
+        return self.finished
+
+    def preempt(self):
+        self.preempted = True
+
+    def continuation(self):
+        return self.remaining
+
+    def terminate(self):
+        self.terminated = True
+        self.finished = True
+
+
+class FakeRunner:
+    def __init__(self):
+        self.handles = []
+
+    def __call__(self, job):
+        handle = FakeHandle(job)
+        self.handles.append(handle)
+        return handle
+
+    def started(self):
+        return [handle.job.request["name"] for handle in self.handles]
+
+
+def make_job(name, tenant="a", priority=BULK):
+    return Job({"name": name}, (), priority=priority, tenant=tenant)
+
+
+def test_classify():
+    assert INTERACTIVE == scheduler.classify({"context": "ASSET", "asset_ids": [ASSET_ID], "collection_ids": []})
+    assert STANDARD == scheduler.classify({"context": "COLLECTION", "asset_ids": [], "collection_ids": [COLLECTION_ID]})
+    assert BULK == scheduler.classify({"context": "BULK", "asset_ids": [ASSET_ID], "collection_ids": [COLLECTION_ID]})
+    assert BULK == scheduler.classify({"context": "ASSET", "asset_ids": [ASSET_ID] * 1000, "collection_ids": []})
+
+
+def test_tenants_take_turns():
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0)
+    for name in ["a1", "a2", "a3"]:
+        sched.submit(make_job(name, tenant="a"))
+    sched.submit(make_job("b1", tenant="b"))
+
+    for _ in range(4):
+        sched.dispatch()
+        runner.handles[-1].finished = True
+    assert ["a1", "b1", "a2", "a3"] == runner.started()
+
+
+def test_weighted_fair_queuing(monkeypatch):
+    monkeypatch.setattr(tenants, "TENANT_WEIGHTS", {"b": 2.0})
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0)
+    for i in range(4):
+        sched.submit(make_job(f"a{i}", tenant="a"))
+        sched.submit(make_job(f"b{i}", tenant="b"))
+
+    for _ in range(6):
+        sched.dispatch()
+        runner.handles[-1].finished = True
+    # b has twice a's weight, so it gets twice as many turns
+    assert ["b0", "a0", "b1", "b2", "a1", "b3"] == runner.started()
+
+
+def test_tenant_concurrency_quota():
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=4, reserved_slots=0, tenant_max_concurrent=2, tenant_rate_limit=10)
+    for i in range(3):
+        sched.submit(make_job(f"a{i}", tenant="a"))
+    sched.submit(make_job("b0", tenant="b"))
+    sched.dispatch()
+
+    # a's third job waits, even though there is a free slot
+    assert ["a0", "b0", "a1"] == runner.started()
+    assert 1 == sched.queued()
+    # The tenant's jobs share one bucket with the tenant's whole rate limit
+    a0, b0, a1 = (handle.job.rate_limiter for handle in runner.handles)
+    assert a0 is a1
+    assert a0 is not b0
+    assert all(10 == limiter.rate for limiter in (a0, b0))
+
+    runner.handles[0].finished = True
+    sched.dispatch()
+    assert ["a0", "b0", "a1", "a2"] == runner.started()
+
+
+def test_priority_order_and_reserved_slots():
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=2, reserved_slots=1)
+    sched.submit(make_job("bulk1"))
+    sched.submit(make_job("bulk2"))
+    sched.submit(make_job("standard", priority=STANDARD))
+    sched.dispatch()
+    # One slot is kept for interactive actions
+    assert ["standard"] == runner.started()
+
+    sched.submit(make_job("clip", priority=INTERACTIVE))
+    sched.dispatch()
+    assert ["standard", "clip"] == runner.started()
+    assert 2 == sched.queued(BULK)
+
+
+def test_preemption():
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0)
+    sched.submit(make_job("offload"))
+    sched.dispatch()
+    offload = runner.handles[0]
+
+    sched.submit(make_job("clip", priority=INTERACTIVE))
+    sched.dispatch()
+    assert offload.preempted
+    assert ["offload"] == runner.started()
+
+    # The offload yields at a chunk boundary, handing back the rest of its work
+    offload.finished = True
+    offload.remaining = {"name": "offload-rest"}
+    sched.dispatch()
+    assert ["offload", "clip"] == runner.started()
+    assert 1 == sched.queued(BULK)
+
+    runner.handles[1].finished = True
+    sched.dispatch()
+    assert ["offload", "clip", "offload-rest"] == runner.started()
+    assert BULK == runner.handles[2].job.priority
+
+
+def test_preemption_is_limited_by_tenant_quota():
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=3, reserved_slots=0, tenant_max_concurrent=1)
+    for tenant in ["b", "c", "d"]:
+        sched.submit(make_job(f"offload-{tenant}", tenant=tenant))
+    sched.dispatch()
+
+    for i in range(5):
+        sched.submit(make_job(f"a{i}", tenant="a", priority=STANDARD))
+    sched.dispatch()
+    # Only one of a's jobs can start, so only one job is asked to yield
+    assert 1 == sum(1 for handle in runner.handles if handle.preempted)
+    # The job it yields for is claimed, so none of a's other jobs could start
+    assert 0 == sched.queue.waiting()
+    assert 5 == sched.queued(STANDARD)
+
+    preempted = next(handle for handle in runner.handles if handle.preempted)
+    preempted.finished = True
+    sched.dispatch()
+    assert "a0" == runner.started()[-1]
+
+
+def test_drain_hands_off_to_next_worker(tmp_path):
+    handoff = SqliteWorkQueue(str(tmp_path / "handoff.db"))
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0)
+    sched.submit(make_job("offload"))
+    sched.submit(make_job("queued"))
+    sched.dispatch()
+    offload = runner.handles[0]
+    # The running job yields at its next chunk, handing back the rest of its work
+    offload.remaining = {"name": "offload-rest"}
+    offload.finished = True
+
+    assert 2 == sched.drain(1, handoff)
+    assert offload.preempted
+    assert not offload.terminated
+    sched.dispatch()
+    assert ["offload"] == runner.started()
+
+    next_runner = FakeRunner()
+    next_sched = Scheduler(next_runner, max_concurrent=2, reserved_slots=0)
+    assert 2 == next_sched.adopt(handoff)
+    next_sched.dispatch()
+    assert {"queued", "offload-rest"} == set(next_runner.started())
+    assert 0 == handoff.queued()
+
+
+def test_drain_stops_jobs_that_dont_yield(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "DISPATCH_INTERVAL", 0.01)
+    handoff = SqliteWorkQueue(str(tmp_path / "handoff.db"))
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0)
+    depth = metrics.QUEUE_DEPTH._value.get()
+    sched.submit(make_job("offload"))
+    sched.dispatch()
+
+    assert 1 == sched.drain(0.05, handoff)
+    assert runner.handles[0].terminated
+    assert depth == metrics.QUEUE_DEPTH._value.get()
+    # The job starts again from the beginning
+    assert ["offload"] == [job.request["name"] for job in handoff.pop_all()]
+
+
+def test_drain_keeps_jobs_that_cant_be_stopped(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "DISPATCH_INTERVAL", 0.01)
+    handoff = SqliteWorkQueue(str(tmp_path / "handoff.db"))
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=2, reserved_slots=0)
+    depth = metrics.QUEUE_DEPTH._value.get()
+    sched.submit(make_job("offload"))
+    sched.submit(make_job("thread"))
+    sched.dispatch()
+    # Like a thread, the second job only asks to yield when it's stopped
+    thread = runner.handles[1]
+    thread.terminate = thread.preempt
+
+    assert 1 == sched.drain(0.05, handoff)
+    assert depth == metrics.QUEUE_DEPTH._value.get()
+    assert thread.preempted
+    assert not thread.done()
+    # Only the job that stopped is run again
+    assert ["offload"] == [job.request["name"] for job in handoff.pop_all()]
+
+
+def test_drain_without_handoff_runs_everything(monkeypatch):
+    monkeypatch.setattr(scheduler, "DISPATCH_INTERVAL", 0.01)
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0)
+    sched.submit(make_job("offload"))
+    sched.submit(make_job("queued"))
+    sched.dispatch()
+
+    assert 0 == sched.drain(0.05)
+    # Nothing was dropped: the running job carries on, and the queued one starts
+    assert ["offload", "queued"] == runner.started()
+    assert not any(handle.preempted or handle.terminated for handle in runner.handles)
+    assert 0 == sched.queued()
+    sched.dispatch()
+    assert 2 == len(runner.handles)
+
+
+def test_drain_leaves_work_on_shared_queue(tmp_path):
+    path = str(tmp_path / "queue.db")
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0, queue=SqliteWorkQueue(path, owner="old"))
+    sched.submit(make_job("offload"))
+    sched.submit(make_job("queued"))
+    sched.dispatch()
+    runner.handles[0].remaining = {"name": "offload-rest"}
+    runner.handles[0].finished = True
+
+    assert 0 == sched.drain(1)
+    assert ["queued", "offload-rest"] == [job.request["name"] for job in SqliteWorkQueue(path).pop_all()]
+
+
+def test_dispatch_after_drain_starts_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "DISPATCH_INTERVAL", 0.01)
+    path = str(tmp_path / "queue.db")
+    runner = FakeRunner()
+    sched = Scheduler(runner, max_concurrent=1, reserved_slots=0, queue=SqliteWorkQueue(path, owner="old"))
+    sched.submit(make_job("offload"))
+    sched.submit(make_job("queued"))
+    sched.start()
+    deadline = time.monotonic() + 5
+    while not runner.handles and time.monotonic() < deadline:
+        time.sleep(0.01)
+    offload = runner.handles[0]
+
+    def preempt():
+        # The job yields straight away, handing back the rest of its work
+        offload.remaining = {"name": "offload-rest"}
+        offload.finished = True
+
+    offload.preempt = preempt
+    assert 0 == sched.drain(1)
+    assert not sched._thread.is_alive()
+    # Neither the continuation nor the other queued job start here
+    sched.dispatch()
+    assert sched.draining
+    assert ["offload"] == runner.started()
+    assert ["queued", "offload-rest"] == [job.request["name"] for job in SqliteWorkQueue(path).pop_all()]
+
+
+class YieldingEvent:
+    @staticmethod
+    def is_set():
+        return True
+
+
+@responses.activate
+def test_process_yields_between_chunks(monkeypatch):
+    monkeypatch.setattr(common, "CHECK_PRESENCE", True)
+    monkeypatch.setattr(common, "PREEMPT_CHUNK_SIZE", 1)
+    handler = IconikHandler(Logger(), SHARED_SECRET, APP_ID, list(FORMATS), testing=True)
+    handler.set_yield_event(YieldingEvent())
+    request = dict(PAYLOAD, action="add", asset_ids=[ASSET_ID, BAD_ASSET_ID], collection_ids=[])
+
+    continuation = handler.process(request, Iconik(APP_ID, AUTH_TOKEN), {"id": B2_STORAGE_ID},
+                                   {"id": LL_STORAGE_ID}, list(FORMATS))
+
+    # The first chunk was processed before yielding
+    assert responses.assert_call_count(f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/', 1)
+    assert [BAD_ASSET_ID] == continuation["asset_ids"]
+    assert [] == continuation["collection_ids"]
+    assert "add" == continuation["action"]
+
+
+class RecordingHandler(IconikHandler):
+    """
+    Stands in for a real handler in a subprocess, returning the assets it was given
+    """
+    def do_process(self, request, iconik, b2_storage, ll_storage, format_names):
+        return {"asset_ids": request["asset_ids"], "yielded": self.should_yield()}
+
+
+def test_spawn_runner():
+    handler = RecordingHandler(Logger(), SHARED_SECRET, APP_ID, list(FORMATS))
+    run = spawn_runner(handler)
+    handle = run(Job(dict(PAYLOAD), (None, None, None, list(FORMATS))))
+    handle.preempt()
+    deadline = time.monotonic() + 30
+    while not handle.done():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert [ASSET_ID] == handle.continuation()["asset_ids"]
+    assert handle.continuation()["yielded"]
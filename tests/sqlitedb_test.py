@@ -0,0 +1,64 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import stat
+import threading
+
+import pytest
+
+from b2_iconik_plugin import sqlitedb
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY)"
+
+
+def test_database_path():
+    assert "/var/lib/state.db" == sqlitedb.database_path("sqlite:////var/lib/state.db", "STATE")
+    with pytest.raises(ValueError, match="Unsupported STATE"):
+        sqlitedb.database_path("postgres://host/db", "STATE")
+
+
+def test_connect_creates_private_file(tmp_path):
+    path = str(tmp_path / "state.db")
+    db = sqlitedb.connect(path, SCHEMA)
+    assert 0o600 == stat.S_IMODE(os.stat(path).st_mode)
+    assert "wal" == db.execute("PRAGMA journal_mode").fetchone()[0]
+    db.close()
+
+    db = sqlitedb.connect(path, SCHEMA, journal_mode="DELETE")
+    assert "delete" == db.execute("PRAGMA journal_mode").fetchone()[0]
+    db.close()
+
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    db = sqlitedb.connect(str(tmp_path / "state.db"), SCHEMA)
+    lock = threading.Lock()
+
+    with sqlitedb.transaction(db, lock) as conn:
+        conn.execute("INSERT INTO items (id) VALUES (1)")
+    with pytest.raises(RuntimeError):
+        with sqlitedb.transaction(db, lock) as conn:
+            conn.execute("INSERT INTO items (id) VALUES (2)")
+            raise RuntimeError()
+
+    assert [(1,)] == db.execute("SELECT id FROM items").fetchall()
+    assert not lock.locked()
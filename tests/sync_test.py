@@ -0,0 +1,299 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from b2_iconik_plugin import sync
+from b2_iconik_plugin.asgi import create_app as create_asgi_app
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from b2_iconik_plugin.plugin import create_app
+from b2_iconik_plugin.sync import SyncState, Syncer
+from bench.asgi_client import AsgiClient
+from tests.test_common import *
+
+
+class FakeIconik:
+    """Just the collection reads and copy/remove calls that the syncer makes"""
+
+    def __init__(self):
+        # id -> {"date_modified": str, "assets": [...], "collections": [...]}
+        self.collections = {}
+        self.gets = []
+        self.listings = []
+        self.copied = []
+        self.removed = []
+        self.copy_succeeds = True
+
+    def add_collection(self, assets=(), collections=(), date_modified="1"):
+        collection_id = new_id()
+        self.collections[collection_id] = {"date_modified": date_modified, "assets": list(assets),
+                                           "collections": list(collections)}
+        return collection_id
+
+    def touch(self, collection_id):
+        collection = self.collections[collection_id]
+        collection["date_modified"] = str(int(collection["date_modified"]) + 1)
+
+    def get_collection(self, collection_id):
+        self.gets.append(collection_id)
+        if collection_id not in self.collections:
+            return None
+        return {"id": collection_id, "date_modified": self.collections[collection_id]["date_modified"]}
+
+    def get_collection_contents(self, collection_id, object_types):
+        self.listings.append(collection_id)
+        collection = self.collections[collection_id]
+        return ([{"id": id_, "object_type": "collections"} for id_ in collection["collections"]]
+                + [{"id": id_, "object_type": "assets"} for id_ in collection["assets"]])
+
+    def copy_files(self, request, format_names, target_storage_id, sync=False):
+        assert LL_STORAGE_ID == target_storage_id
+        self.copied.append(sorted(request["asset_ids"]))
+        return self.copy_succeeds
+
+    def remove_files(self, request, format_names, b2_storage_id, ll_storage_id):
+        assert (B2_STORAGE_ID, LL_STORAGE_ID) == (b2_storage_id, ll_storage_id)
+        self.removed.append(sorted(request["asset_ids"]))
+        return True
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = SyncState(str(tmp_path / "sync.db"))
+    yield state
+    state.close()
+
+
+def make_syncer(iconik, state, collection_ids, **kwargs):
+    return Syncer(iconik, state, collection_ids, FORMAT_NAMES, B2_STORAGE_ID, LL_STORAGE_ID, **kwargs)
+
+
+def test_first_cycle_copies_hot_assets(state):
+    iconik = FakeIconik()
+    a, b, c = new_id(), new_id(), new_id()
+    child = iconik.add_collection(assets=[b, c])
+    root = iconik.add_collection(assets=[a, b], collections=[child])
+
+    result = make_syncer(iconik, state, [root]).run_once()
+
+    assert {"listed": 2, "added": 3, "offloaded": 0, "failed": False} == result
+    assert [sorted([a, b, c])] == iconik.copied
+    assert sorted([a, b, c]) == sorted(state.synced_assets())
+
+
+def test_unchanged_collections_are_not_listed(state):
+    iconik = FakeIconik()
+    child = iconik.add_collection(assets=[new_id()])
+    root = iconik.add_collection(assets=[new_id()], collections=[child])
+    syncer = make_syncer(iconik, state, [root])
+    syncer.run_once()
+    iconik.listings.clear()
+
+    result = syncer.run_once()
+
+    assert {"listed": 0, "added": 0, "offloaded": 0, "failed": False} == result
+    assert [] == iconik.listings
+    assert 1 == len(iconik.copied)
+
+
+def test_changes_are_applied_incrementally(state):
+    iconik = FakeIconik()
+    a, b, c = new_id(), new_id(), new_id()
+    child = iconik.add_collection(assets=[b])
+    root = iconik.add_collection(assets=[a], collections=[child])
+    syncer = make_syncer(iconik, state, [root])
+    syncer.run_once()
+    iconik.listings.clear()
+
+    # b leaves the hot collections and c joins them
+    iconik.collections[child]["assets"] = [c]
+    iconik.touch(child)
+    result = syncer.run_once()
+
+    assert {"listed": 1, "added": 1, "offloaded": 1, "failed": False} == result
+    assert [child] == iconik.listings
+    assert [c] == iconik.copied[-1]
+    assert [[b]] == iconik.removed
+    assert sorted([a, c]) == sorted(state.synced_assets())
+
+
+def test_removed_subcollection_is_offloaded(state):
+    iconik = FakeIconik()
+    a, b = new_id(), new_id()
+    grandchild = iconik.add_collection(assets=[b])
+    child = iconik.add_collection(collections=[grandchild])
+    root = iconik.add_collection(assets=[a], collections=[child])
+    syncer = make_syncer(iconik, state, [root])
+    syncer.run_once()
+
+    iconik.collections[root]["collections"] = []
+    iconik.touch(root)
+    result = syncer.run_once()
+
+    assert 1 == result["offloaded"]
+    assert [[b]] == iconik.removed
+    assert state.collection(child) is None
+    assert state.collection(grandchild) is None
+
+
+def test_asset_in_two_hot_collections_stays(state):
+    iconik = FakeIconik()
+    a = new_id()
+    first = iconik.add_collection(assets=[a])
+    second = iconik.add_collection(assets=[a])
+    syncer = make_syncer(iconik, state, [first, second])
+    syncer.run_once()
+
+    iconik.collections[first]["assets"] = []
+    iconik.touch(first)
+    result = syncer.run_once()
+
+    assert 0 == result["offloaded"]
+    assert [] == iconik.removed
+
+
+def test_failed_copies_are_retried(state):
+    iconik = FakeIconik()
+    a = new_id()
+    root = iconik.add_collection(assets=[a])
+    syncer = make_syncer(iconik, state, [root])
+    iconik.copy_succeeds = False
+
+    assert syncer.run_once()["failed"]
+    assert 0 == len(state.synced_assets())
+
+    iconik.copy_succeeds = True
+    assert 1 == syncer.run_once()["added"]
+    assert [[a], [a]] == iconik.copied
+
+
+def test_events_only(state):
+    iconik = FakeIconik()
+    a, b = new_id(), new_id()
+    child = iconik.add_collection(assets=[a])
+    root = iconik.add_collection(collections=[child])
+    syncer = make_syncer(iconik, state, [root], events_only=True)
+    syncer.run_once()
+    iconik.gets.clear()
+
+    # Not even read until a webhook reports the change
+    iconik.collections[child]["assets"].append(b)
+    iconik.touch(child)
+    assert 0 == syncer.run_once()["added"]
+    assert [] == iconik.gets
+
+    assert 1 == state.mark_dirty([child, new_id()])
+    assert 1 == syncer.run_once()["added"]
+    assert [child] == iconik.gets
+
+
+def test_event_during_listing_is_not_lost(state):
+    iconik = FakeIconik()
+    a, b = new_id(), new_id()
+    child = iconik.add_collection(assets=[a])
+    root = iconik.add_collection(collections=[child])
+    syncer = make_syncer(iconik, state, [root], events_only=True)
+    syncer.run_once()
+    state.mark_dirty([child])
+
+    # b joins the collection after the listing, and its webhook arrives
+    # before the listing is recorded
+    list_contents = iconik.get_collection_contents
+
+    def get_collection_contents(collection_id, object_types):
+        contents = list_contents(collection_id, object_types)
+        iconik.collections[child]["assets"].append(b)
+        state.mark_dirty([child])
+        return contents
+
+    iconik.get_collection_contents = get_collection_contents
+    assert 0 == syncer.run_once()["added"]
+    assert state.collection(child)[1]
+
+    iconik.get_collection_contents = list_contents
+    assert 1 == syncer.run_once()["added"]
+    assert not state.collection(child)[1]
+
+
+@pytest.fixture
+def sync_state_url(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'sync.db'}"
+    monkeypatch.setattr(sync, "SYNC_STATE", url)
+    return url
+
+
+def collection_event(collection_id):
+    # The shape of an iconik webhook payload for a change to a collection's contents
+    return {
+        "system_domain_id": new_id(),
+        "user_id": new_id(),
+        "event_type": "collections",
+        "object_id": collection_id,
+        "realm": "contents",
+        "operation": "create",
+        "data": {"collection_id": collection_id, "object_id": new_id(), "object_type": "assets"},
+        "request_id": new_id(),
+        "date_created": "2024-01-01T00:00:00.000000+00:00",
+    }
+
+
+@responses.activate
+def test_sync_events(sync_state_url):
+    collection_id = new_id()
+    state = sync.open_sync_state(sync_state_url)
+    state.set_contents(collection_id, "1", [], [])
+    client = create_app({"TESTING": True}).test_client()
+
+    response = client.post("/sync/events", json=collection_event(collection_id),
+                           headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 200 == response.status_code
+    assert {"marked": 1} == response.json
+    assert state.collection(collection_id)[1]
+
+    response = client.post("/sync/events", json={"event_type": "assets", "object_id": new_id(),
+                                                        "realm": "entity", "operation": "update"},
+                           headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert {"marked": 0} == response.json
+
+    response = client.post("/sync/events", json=collection_event(collection_id),
+                           headers={X_BZ_SHARED_SECRET: "wrong"})
+    assert 401 == response.status_code
+
+
+@responses.activate
+def test_sync_events_asgi(sync_state_url):
+    collection_id = new_id()
+    sync.open_sync_state(sync_state_url).set_contents(collection_id, "1", [], [])
+
+    with AsgiClient(create_asgi_app({"TESTING": True})) as client:
+        response = client.post("/sync/events", json=collection_event(collection_id),
+                               headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+
+    assert 200 == response.status_code
+    assert {"marked": 1} == response.json
+
+
+@responses.activate
+def test_sync_events_without_sync_state(client):
+    response = client.post("/sync/events", json=collection_event(new_id()),
+                           headers={X_BZ_SHARED_SECRET: SHARED_SECRET})
+    assert 404 == response.status_code
@@ -0,0 +1,74 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import multiprocessing as mp
+import time
+
+from b2_iconik_plugin import tenants
+from b2_iconik_plugin.iconik import Iconik, ICONIK_USERS_API
+from tests.test_common import *
+
+USER_ID = PAYLOAD["user_id"]
+
+
+@responses.activate
+def test_resolve_tenant():
+    responses.add(method=responses.GET, url=f"{ICONIK_USERS_API}/users/current/", json={"id": USER_ID}, status=200)
+    resolver = tenants.TenantResolver()
+    iconik = Iconik(APP_ID, AUTH_TOKEN)
+    assert USER_ID == resolver.resolve(iconik, PAYLOAD)
+    assert USER_ID == resolver.resolve(iconik, PAYLOAD)
+    # The user is looked up once per token
+    assert responses.assert_call_count(f"{ICONIK_USERS_API}/users/current/", 1)
+
+
+@responses.activate
+def test_resolve_tenant_falls_back_to_token():
+    responses.add(method=responses.GET, url=f"{ICONIK_USERS_API}/users/current/", status=500)
+    tenant = tenants.TenantResolver().resolve(Iconik(APP_ID, AUTH_TOKEN), PAYLOAD)
+    assert tenants.token_hash(AUTH_TOKEN) == tenant
+    assert AUTH_TOKEN not in tenant
+
+
+def test_parse_weights():
+    assert {} == tenants.parse_weights(None)
+    assert {"a": 2.0, "b": 0.5} == tenants.parse_weights("a=2, b=0.5")
+
+
+def test_token_bucket():
+    bucket = tenants.TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    # The first request uses the burst, and the next three wait 1/50 s each
+    assert time.monotonic() - start >= 0.05
+
+
+def test_token_bucket_is_shared_with_subprocesses():
+    ctx = mp.get_context("spawn")
+    bucket = tenants.TokenBucket(rate=0.01, burst=2, context=ctx)
+    process = ctx.Process(target=bucket.acquire)
+    process.start()
+    process.join(timeout=30)
+    assert 0 == process.exitcode
+    # The subprocess took one of the two tokens from the parent's bucket
+    assert bucket._state[0] < 1.5
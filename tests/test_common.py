@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import uuid
 
 import responses
 
@@ -43,9 +44,17 @@ SECRETS = {
 
 # Random UUIDs for objects
 JOB_ID = 'eff79bf8-c782-11ec-8e9b-b66ad3c6ae38'
+FAILED_JOB_ID = '9b1f4d2e-7c3a-4e5b-8f6d-1a2b3c4d5e6f'
 ASSET_ID = '0d56db81-1b8e-4a68-9658-98ad9a94d841'
+BAD_ASSET_ID = '3e8a7c61-2f4d-4b9a-a5c7-6d8e9f0a1b2c'
 ORIGINAL_FILE_SET_ID = '0436578d-8418-48b0-89ad-9c719b65137f'
 PPRO_PROXY_FILE_SET_ID = '076ac114-de02-427f-b1aa-7ea6cf1c3835'
+B2_ORIGINAL_FILE_SET_ID = '5d3c9e53-0b7f-4d0e-9f3a-2b8e4c6a1d27'
+ORIGINAL_FILE_ID = 'c2b6f0a4-6a43-4b8e-a1a9-7a1d2e3f4b5c'
+PPRO_PROXY_FILE_ID = 'e4d7a1b2-3c4d-4e5f-8a9b-0c1d2e3f4a5b'
+B2_ORIGINAL_FILE_ID = 'f1e2d3c4-b5a6-4978-8a9b-c0d1e2f3a4b5'
+ORIGINAL_FILE_SIZE = 1000000
+PPRO_PROXY_FILE_SIZE = 10000
 COLLECTION_ID = '8ae20508-88b0-414e-8b4c-3fa2683e79e0'
 SUBCOLLECTION_ID = 'bf049e70-6749-4e44-a85b-7457236cdf4e'
 MULTI_COLLECTION_ID = '7e6abeea-4bff-4153-912d-2880617046ce'
@@ -60,6 +69,8 @@ FORMATS = {
     PPRO_PROXY_FORMAT_NAME: PPRO_PROXY_FORMAT_ID
 }
 
+FORMAT_NAMES = list(FORMATS)
+
 PAYLOAD = {
     "user_id": "256ebe90-c0c8-11ec-9fcd-0648baddf8b3",
     "system_domain_id": "57016980-6e13-11e8-ab5a-0a580a3c0f5c",
@@ -82,31 +93,83 @@ PAYLOAD = {
 GCP_PROJECT_ID = 'my-gcp-project-id'
 
 
+def new_id():
+    return str(uuid.uuid4())
+
+
+class FakeClock:
+    """
+    A clock for code that takes a clock function, and optionally a sleep
+    function, that only moves when a test moves it
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def set_asset_file_sets(file_sets):
+    # Replace the asset's file sets, as listed by conftest, with the given
+    # (file set id, format id, storage id) tuples
+    responses.replace(
+        responses.GET,
+        f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/',
+        json={"objects": [
+            {"id": file_set_id, "format_id": format_id, "storage_id": storage_id, "status": "ACTIVE"}
+            for file_set_id, format_id, storage_id in file_sets
+        ]},
+        status=200
+    )
+
+
 def assert_copy_call_counts(storage_id, format_count):
-    # There should be two calls to bulk copy per format - one for the asset and one
-    # for the collection
+    # There should be one call to bulk copy per format, since the asset is
+    # in the request and in the subcollection, but is only copied once
+    assert responses.assert_call_count(
+        f'{ICONIK_FILES_API}/storages/{storage_id}/bulk/',
+        format_count
+    )
+
+
+def assert_whole_copy_call_counts(storage_id):
+    # Without the presence check, the request's asset and collection are each
+    # submitted once per format
+    assert responses.assert_call_count(
+        f'{ICONIK_FILES_API}/storages/{storage_id}/bulk/',
+        2 * len(FORMATS)
+    )
+
+
+def assert_remove_copy_call_counts(storage_id):
+    # The asset is in the request and in the subcollection, but is copied in a
+    # single batch
     assert responses.assert_call_count(
         f'{ICONIK_FILES_API}/storages/{storage_id}/bulk/',
-        2 * format_count
+        1
     )
 
 
 def assert_delete_call_counts():
-    # The asset should be deleted and purged twice per format - once directly
-    # and once via the subcollection
+    # Each of the asset's file sets should be deleted and purged once, even though
+    # the asset is in the request and in the subcollection
     assert responses.assert_call_count(
         f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{ORIGINAL_FILE_SET_ID}/',
-        2
+        1
     )
     assert responses.assert_call_count(
         f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{ORIGINAL_FILE_SET_ID}/purge/',
-        2
+        1
     )
     assert responses.assert_call_count(
         f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{PPRO_PROXY_FILE_SET_ID}/',
-        2
+        1
     )
     assert responses.assert_call_count(
         f'{ICONIK_FILES_API}/assets/{ASSET_ID}/file_sets/{PPRO_PROXY_FILE_SET_ID}/purge/',
-        2
+        1
     )
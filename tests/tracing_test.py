@@ -0,0 +1,89 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pytest
+
+from b2_iconik_plugin import tracing
+from b2_iconik_plugin.common import X_BZ_SHARED_SECRET
+from b2_iconik_plugin.iconik import Iconik
+from tests.test_common import *
+
+CLOUD_TRACE_ID = "105445aa7843bc8bf206b12000100000"
+CLOUD_SPAN_ID = "1"
+
+
+@pytest.fixture
+def exporter():
+    in_memory = pytest.importorskip("opentelemetry.sdk.trace.export.in_memory_span_exporter")
+    span_exporter = in_memory.InMemorySpanExporter()
+    tracing.configure(span_exporter)
+    yield span_exporter
+    tracing.shutdown()
+
+
+def test_span_disabled():
+    with tracing.span("nothing") as span:
+        assert span is None
+    assert {} == tracing.inject()
+    assert tracing.extract({"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"}) is None
+
+
+def test_cloud_trace_context(exporter):
+    context = tracing.cloud_trace_context(f"{CLOUD_TRACE_ID}/{CLOUD_SPAN_ID};o=1")
+    with tracing.span("child", context=context) as span:
+        assert int(CLOUD_TRACE_ID, 16) == span.get_span_context().trace_id
+    assert tracing.cloud_trace_context("not a trace header") is None
+    assert tracing.cloud_trace_context(None) is None
+
+
+@responses.activate
+def test_remove_spans(client, exporter):
+    response = client.post(f'/remove?b2_storage_id={B2_STORAGE_ID}&ll_storage_id={LL_STORAGE_ID}',
+                           json=PAYLOAD,
+                           headers={
+                               X_BZ_SHARED_SECRET: os.environ["BZ_SHARED_SECRET"],
+                               "X-Cloud-Trace-Context": f"{CLOUD_TRACE_ID}/{CLOUD_SPAN_ID};o=1"
+                           })
+    assert 200 == response.status_code
+
+    tracing.flush()
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    for name in ["IconikHandler.post",
+                 "IconikHandler.do_process",
+                 "Iconik.get_storage",
+                 "Iconik.remove_assets",
+                 "Iconik.copy_assets",
+                 "Iconik.delete_asset_files",
+                 "POST /API/files/v1/storages/{id}/bulk/"]:
+        assert name in spans
+
+    # Every span belongs to the trace that iconik's request started
+    assert all(span.context.trace_id == int(CLOUD_TRACE_ID, 16) for span in spans.values())
+    assert spans["IconikHandler.do_process"].parent.span_id == spans["IconikHandler.post"].context.span_id
+    assert 200 == spans["POST /API/files/v1/storages/{id}/bulk/"].attributes["http.response.status_code"]
+
+
+def test_generators_are_not_traced():
+    # A span around a generator would end before it read any pages
+    for method in (Iconik.iter_objects, Iconik.iter_custom_actions, Iconik.iter_deleted_objects):
+        assert not hasattr(method, "__wrapped__")
+    assert hasattr(Iconik.get_storage, "__wrapped__")
@@ -0,0 +1,213 @@
+# MIT License
+#
+# Copyright (c) 2025 Backblaze
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sqlite3
+import time
+from unittest.mock import patch
+
+import pytest
+
+from b2_iconik_plugin import metrics, workqueue
+from b2_iconik_plugin.logger import Logger
+from b2_iconik_plugin.scheduler import BULK, INTERACTIVE, STANDARD, Scheduler
+from b2_iconik_plugin.workqueue import LocalWorkQueue, SqliteWorkQueue
+from tests.scheduler_test import FakeRunner, make_job
+from tests.test_common import *
+
+
+def test_open_work_queue(tmp_path):
+    assert isinstance(workqueue.open_work_queue(""), LocalWorkQueue)
+    queue = workqueue.open_work_queue(f"sqlite:///{tmp_path}/queue.db")
+    assert isinstance(queue, SqliteWorkQueue)
+    assert queue.shared
+    with pytest.raises(ValueError):
+        workqueue.open_work_queue("redis://localhost")
+
+
+def test_sqlite_fair_queuing(tmp_path):
+    queue = SqliteWorkQueue(str(tmp_path / "queue.db"))
+    for name in ["a1", "a2", "a3"]:
+        queue.put(make_job(name, tenant="a"))
+    queue.put(make_job("b1", tenant="b"))
+    queue.put(make_job("clip", tenant="b", priority=INTERACTIVE))
+    assert 5 == queue.queued()
+
+    taken = []
+    while job := queue.take(BULK):
+        taken.append(job.request["name"])
+        queue.complete(job)
+    assert ["a1", "b1", "a2", "a3"] == taken
+    assert "clip" == queue.take(INTERACTIVE).request["name"]
+
+
+def test_open_handoff_queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(workqueue, "HANDOFF_QUEUE", "")
+    assert workqueue.open_handoff_queue() is None
+    path = tmp_path / "handoff.db"
+    monkeypatch.setattr(workqueue, "HANDOFF_QUEUE", f"sqlite:///{path}")
+    assert isinstance(workqueue.open_handoff_queue(), SqliteWorkQueue)
+    # A file that another user created is refused
+    monkeypatch.setattr(workqueue.os, "getuid", lambda: path.stat().st_uid + 1)
+    with pytest.raises(PermissionError):
+        workqueue.open_handoff_queue()
+
+
+def test_sqlite_queue_shared_between_nodes(tmp_path):
+    path = str(tmp_path / "queue.db")
+    node1 = SqliteWorkQueue(path, owner="node1")
+    node2 = SqliteWorkQueue(path, owner="node2")
+    node1.put(make_job("offload"))
+    node1.put(make_job("other"))
+
+    assert "offload" == node2.take(BULK).request["name"]
+    assert "other" == node1.take(BULK).request["name"]
+    assert node2.take(BULK) is None
+    assert 0 == node1.queued()
+    # No WAL, whose shared memory only works on one host
+    assert not os.path.exists(path + "-wal")
+
+
+def test_sqlite_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "queue.db")
+    dead = SqliteWorkQueue(path, lease_seconds=0.01, owner="dead")
+    live = SqliteWorkQueue(path, owner="live")
+    dead.put(make_job("offload"))
+    job = dead.take(BULK)
+    time.sleep(0.05)
+
+    # The dead node's lease has expired, so another node picks the job up
+    retaken = live.take(BULK)
+    assert job.id == retaken.id
+    assert not dead.complete(job)
+    assert live.complete(retaken)
+    assert 0 == live.queued()
+
+
+def test_sqlite_job_is_abandoned_after_max_attempts(tmp_path):
+    path = str(tmp_path / "queue.db")
+    logger = Logger()
+    queue = SqliteWorkQueue(path, lease_seconds=0.01, max_attempts=2, logger=logger)
+    queue.put(make_job("offload"))
+    dead_actions = metrics.DEAD_ACTIONS._value.get()
+
+    # Releasing a job doesn't count as an attempt
+    queue.release(queue.take(BULK))
+    for _ in range(2):
+        assert queue.take(BULK)
+        time.sleep(0.02)
+    assert 0 == queue.queued()
+
+    with patch.object(logger, "log") as log:
+        assert queue.take(BULK) is None
+    log.assert_called_once()
+    assert "ERROR" == log.call_args.args[0]
+    assert dead_actions + 1 == metrics.DEAD_ACTIONS._value.get()
+    assert 1 == sqlite3.connect(path).execute("SELECT COUNT(*) FROM dead_jobs").fetchone()[0]
+
+
+def test_sqlite_heartbeat_keeps_lease(tmp_path):
+    path = str(tmp_path / "queue.db")
+    node1 = SqliteWorkQueue(path, lease_seconds=0.2, owner="node1")
+    node2 = SqliteWorkQueue(path, owner="node2")
+    node1.put(make_job("offload"))
+    job = node1.take(BULK)
+    for _ in range(3):
+        time.sleep(0.1)
+        node1.heartbeat([job])
+    assert node2.take(BULK) is None
+
+
+def test_sqlite_tenant_quota_spans_nodes(tmp_path):
+    path = str(tmp_path / "queue.db")
+    node1 = SqliteWorkQueue(path, tenant_max_concurrent=1, owner="node1")
+    node2 = SqliteWorkQueue(path, tenant_max_concurrent=1, owner="node2")
+    node1.put(make_job("a1", tenant="a"))
+    node1.put(make_job("a2", tenant="a"))
+    node1.put(make_job("clip", tenant="a", priority=INTERACTIVE))
+
+    job = node1.take(BULK)
+    assert node2.take(BULK) is None
+    assert 0 == node2.waiting(BULK)
+    # Interactive actions aren't limited
+    assert "clip" == node2.take(INTERACTIVE).request["name"]
+
+    node1.complete(job)
+    assert "a2" == node2.take(BULK).request["name"]
+
+
+def test_waiting_is_capped_by_tenant_quota(tmp_path):
+    for queue in [LocalWorkQueue(tenant_max_concurrent=2), SqliteWorkQueue(str(tmp_path / "queue.db"),
+                                                                          tenant_max_concurrent=2)]:
+        for i in range(5):
+            queue.put(make_job(f"a{i}", tenant="a", priority=STANDARD))
+        queue.put(make_job("a-bulk", tenant="a"))
+        queue.put(make_job("clip", tenant="a", priority=INTERACTIVE))
+        queue.take(STANDARD)
+
+        # a has one slot left, for either a standard or a bulk job
+        assert 1 == queue.waiting(STANDARD)
+        assert 1 == queue.waiting(BULK)
+        assert 2 == queue.waiting()
+
+
+def test_only_one_node_preempts_for_a_waiting_job(tmp_path):
+    path = str(tmp_path / "queue.db")
+    runners = [FakeRunner(), FakeRunner()]
+    nodes = [Scheduler(runner, max_concurrent=1, reserved_slots=0, queue=SqliteWorkQueue(path, owner=f"node{i}"))
+             for i, runner in enumerate(runners)]
+    nodes[0].submit(make_job("offload1", tenant="a"))
+    nodes[0].submit(make_job("offload2", tenant="b"))
+    for node in nodes:
+        node.dispatch()
+
+    nodes[0].submit(make_job("clip", tenant="c", priority=INTERACTIVE))
+    for node in nodes:
+        node.dispatch()
+
+    assert [True, False] == [runner.handles[0].preempted for runner in runners]
+    runners[0].handles[0].finished = True
+    nodes[0].dispatch()
+    assert "clip" == runners[0].started()[-1]
+
+
+def test_scheduler_with_shared_queue(tmp_path):
+    path = str(tmp_path / "queue.db")
+    runner1 = FakeRunner()
+    runner2 = FakeRunner()
+    ingest = Scheduler(FakeRunner(), queue=SqliteWorkQueue(path, owner="ingest"))
+    worker1 = Scheduler(runner1, max_concurrent=1, reserved_slots=0, queue=SqliteWorkQueue(path, owner="worker1"))
+    worker2 = Scheduler(runner2, max_concurrent=1, reserved_slots=0, queue=SqliteWorkQueue(path, owner="worker2"))
+    ingest.submit(make_job("offload", tenant="a"))
+    ingest.submit(make_job("other", tenant="b"))
+
+    worker1.dispatch()
+    worker2.dispatch()
+    assert ["offload"] == runner1.started()
+    assert ["other"] == runner2.started()
+
+    # A continuation goes back on the shared queue for any worker to take
+    runner1.handles[0].finished = True
+    runner1.handles[0].remaining = {"name": "offload-rest"}
+    worker1.dispatch()
+    assert ["offload", "offload-rest"] == runner1.started()
+    assert "a" == runner1.handles[1].job.tenant
+    assert 0 == ingest.queued()